@@ -0,0 +1,3 @@
+"""
+Benchmarks of jupyter_translate, run with: python -m benchmarks
+"""
@@ -0,0 +1,75 @@
+import hashlib
+import random
+import threading
+from time import sleep
+
+from jupyter_translate import TranslationRequestError
+
+class FakeTranslator:
+    """
+    Deterministic stand-in for a translation provider, with simulated latency,
+    errors and throttling.
+
+    The outcome of each request only depends on the seed, the text and the
+    number of times the same text was sent before, so runs are reproducible
+    whatever the order in which concurrent workers send their requests.
+
+    Args:
+        source (str): Source language code
+        target (str): Target language code
+        latency (float): Mean latency of a request in seconds
+        jitter (float): Relative variation of the latency, between 0 and 1
+        chars_per_second (float): Extra latency per character sent, or None to disable it
+        error_rate (float): Fraction of the requests failing with a server error
+        throttle_rate (float): Fraction of the requests rejected with a 429 and a Retry-After
+        retry_after (float): Seconds of the Retry-After of throttled requests
+        seed (int): Seed of the simulated outcomes
+    """
+    provider_name = 'fake'
+
+    def __init__(self, source='en', target='pt', latency=0.05, jitter=0.5, chars_per_second=None,
+                 error_rate=0.0, throttle_rate=0.0, retry_after=0.05, seed=0):
+        self.source = source
+        self.target = target
+        self.latency = latency
+        self.jitter = jitter
+        self.chars_per_second = chars_per_second
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.calls = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _draw(self, text):
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}")
+
+    def translate(self, text):
+        outcome = self._draw(text)
+        delay = self.latency * (1 + self.jitter * (2 * outcome.random() - 1))
+        if self.chars_per_second:
+            delay += len(text) / self.chars_per_second
+        sleep(max(0.0, delay))
+
+        draw = outcome.random()
+        if draw < self.throttle_rate:
+            raise TranslationRequestError('Too many requests', status_code=429, retry_after=self.retry_after)
+        if draw < self.throttle_rate + self.error_rate:
+            raise TranslationRequestError('Internal server error', status_code=500)
+        # Keeps the placeholders and segment delimiters, which are matched case-insensitively
+        return text.upper()
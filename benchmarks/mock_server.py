@@ -0,0 +1,163 @@
+import argparse
+import html
+import json
+import math
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+
+# Longest query accepted by each provider, as enforced by deep_translator
+MAX_QUERY_CHARS = {
+    'google': 5000,
+    'mymemory': 500,
+}
+
+class MockTranslationServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Google and MyMemory endpoints used by deep_translator,
+    to load-test concurrency, backoff and batching without network access.
+
+    Requests with a langpair parameter get a MyMemory JSON response, the others
+    a Google HTML page, whatever their path. The text is "translated" to upper
+    case, which keeps the placeholders and segment delimiters intact.
+
+    Faults come in bursts, like a throttled or overloaded service: a request
+    can start a burst of burst_length 429 (with Retry-After) or 5xx responses.
+    Queries longer than the provider limit are rejected with a 413.
+
+    Args:
+        address (tuple): Host and port to listen on, port 0 picks a free one
+        latency (float): Median latency of a response in seconds
+        latency_sigma (float): Spread of the log-normal latency distribution
+        throttle_rate (float): Probability that a request starts a burst of 429
+        error_rate (float): Probability that a request starts a burst of 5xx
+        burst_length (int): Number of responses of each burst
+        retry_after (int): Retry-After of the 429 responses in seconds
+        seed (int): Seed of the latencies and faults
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.05, latency_sigma=0.5, throttle_rate=0.0,
+                 error_rate=0.0, burst_length=5, retry_after=1, seed=0):
+        super().__init__(address, MockTranslationHandler)
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.stats = {}
+        self._random = random.Random(seed)
+        self._burst = (None, 0)  # (status, remaining responses)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def next_outcome(self):
+        """
+        Returns (latency, status) of the next response, where status is None for a success.
+        """
+        with self._lock:
+            latency = self._random.lognormvariate(math.log(self.latency), self.latency_sigma) if self.latency > 0 else 0.0
+            status, remaining = self._burst
+            if not remaining:
+                draw = self._random.random()
+                if draw < self.throttle_rate:
+                    status, remaining = 429, self.burst_length
+                elif draw < self.throttle_rate + self.error_rate:
+                    status, remaining = self._random.choice((500, 502, 503)), self.burst_length
+                else:
+                    status, remaining = None, 1
+            self._burst = (status, remaining - 1)
+            return latency, status
+
+    def record(self, status):
+        with self._lock:
+            self.stats[str(status)] = self.stats.get(str(status), 0) + 1
+
+    def start(self):
+        """
+        Serves requests from a background thread, returning the server.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class MockTranslationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type='text/plain; charset=utf-8', headers=()):
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.record(status)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self.send(200, json.dumps(self.server.stats), 'application/json')
+
+        params = parse_qs(url.query)
+        text = params.get('q', [''])[0]
+        provider = 'mymemory' if 'langpair' in params else 'google'
+
+        latency, status = self.server.next_outcome()
+        sleep(latency)
+        if len(text) >= MAX_QUERY_CHARS[provider]:
+            return self.send(413, f'Query longer than {MAX_QUERY_CHARS[provider]} characters')
+        if status == 429:
+            return self.send(429, 'Too many requests', headers=[('Retry-After', str(self.server.retry_after))])
+        if status is not None:
+            return self.send(status, 'Server error')
+
+        translated = text.upper()
+        if provider == 'mymemory':
+            body = {'responseData': {'translatedText': translated, 'match': 1}, 'responseStatus': 200, 'matches': []}
+            return self.send(200, json.dumps(body), 'application/json')
+        page = f'<html><body><div class="result-container">{html.escape(translated)}</div></body></html>'
+        return self.send(200, page, 'text/html; charset=utf-8')
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock of the Google and MyMemory translation endpoints.")
+    parser.add_argument('--host', default='127.0.0.1', help="Host to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument('--latency', type=float, default=0.05, help="Median latency of a response in seconds (default: 0.05)")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="Spread of the log-normal latency distribution (default: 0.5)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Probability that a request starts a burst of 429 (default: 0)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probability that a request starts a burst of 5xx (default: 0)")
+    parser.add_argument('--burst-length', type=int, default=5, help="Number of responses of each burst of errors (default: 5)")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After of the 429 responses in seconds (default: 1)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the latencies and faults (default: 0)")
+    args = parser.parse_args()
+
+    server = MockTranslationServer(
+        (args.host, args.port), latency=args.latency, latency_sigma=args.latency_sigma,
+        throttle_rate=args.throttle_rate, error_rate=args.error_rate, burst_length=args.burst_length,
+        retry_after=args.retry_after, seed=args.seed
+    )
+    print(f"Mock translation server listening on {server.url} (statistics at {server.url}/stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import base64
+import json
+import os
+import random
+
+WORDS = (
+    'data model training notebook value function result column table image vector '
+    'the a of to and in is that for with as this on we can each by from our you '
+    'compute load plot train test split sample feature label score error mean'
+).split()
+
+# Fraction of markdown cells, and whether code cells have large outputs, of each profile
+PROFILES = {
+    'mixed': (0.5, False),
+    'markdown': (0.85, False),
+    'comments': (0.15, False),
+    'outputs': (0.3, True),
+}
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(words // 2, words)))
+    return text.capitalize() + '.'
+
+def markdown_cell(rng):
+    lines = [f"## {sentence(rng, 5)[:-1]}", '']
+    for _ in range(rng.randint(1, 4)):
+        # Paragraphs with the spans that are protected from the translator
+        lines.append(
+            f"{sentence(rng)} See `{rng.choice(WORDS)}()` and [{rng.choice(WORDS)}](https://example.com/{rng.choice(WORDS)}). "
+            f"{sentence(rng)} $x_{rng.randint(0, 9)}^2$ {sentence(rng)}"
+        )
+        lines.append('')
+    return {'cell_type': 'markdown', 'metadata': {}, 'source': [line + '\n' for line in lines[:-1]]}
+
+def code_cell(rng, large_outputs=False):
+    lines = [f'def {rng.choice(WORDS)}_{rng.randint(0, 99)}(x):', f'    """{sentence(rng, 8)}"""']
+    for _ in range(rng.randint(2, 6)):
+        lines.append(f'    # {sentence(rng, 10)}')
+        lines.append(f'    x = x * {rng.randint(1, 9)}  # {sentence(rng, 4)}')
+    lines.append('    return x')
+    lines.append(f'print("{sentence(rng, 6)}")')
+    outputs = [{'name': 'stdout', 'output_type': 'stream', 'text': [sentence(rng) + '\n']}]
+    if large_outputs:
+        # A plot encoded in base64 and a long log, which are never translated
+        image = base64.b64encode(rng.getrandbits(8 * 150000).to_bytes(150000, 'little')).decode('ascii')
+        outputs.append({
+            'data': {'image/png': image, 'text/plain': ['<Figure size 640x480 with 1 Axes>']},
+            'metadata': {}, 'output_type': 'display_data'
+        })
+        outputs.append({'name': 'stdout', 'output_type': 'stream', 'text': [sentence(rng) + '\n' for _ in range(2000)]})
+    return {
+        'cell_type': 'code', 'execution_count': 1, 'metadata': {},
+        'outputs': outputs, 'source': [line + '\n' for line in lines[:-1]] + [lines[-1]]
+    }
+
+def generate_notebook(cells=100, profile='mixed', seed=0):
+    """
+    Returns a synthetic notebook with the given number of cells.
+
+    Args:
+        cells (int): Number of cells
+        profile (str): Mix of cells, one of PROFILES
+        seed (int): Seed of the generated content
+    """
+    markdown_ratio, large_outputs = PROFILES[profile]
+    rng = random.Random(f"{profile}:{cells}:{seed}")
+    return {
+        'cells': [
+            markdown_cell(rng) if rng.random() < markdown_ratio else code_cell(rng, large_outputs)
+            for _ in range(cells)
+        ],
+        'metadata': {'kernelspec': {'display_name': 'Python 3', 'language': 'python', 'name': 'python3'}},
+        'nbformat': 4,
+        'nbformat_minor': 5,
+    }
+
+def write_notebook(path, cells=100, profile='mixed', seed=0):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(generate_notebook(cells, profile, seed), f, indent=1, ensure_ascii=False)
+    return path
+
+def write_directory(directory, notebooks=10, cells=100, profile='mixed'):
+    """
+    Writes the given number of synthetic notebooks to directory, returning their paths.
+    """
+    return [
+        write_notebook(os.path.join(directory, f'notebook_{i:03d}.ipynb'), cells, profile, seed=i)
+        for i in range(notebooks)
+    ]
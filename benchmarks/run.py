@@ -0,0 +1,204 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Progress bars would be measured along with the translation
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import jupyter_translate
+from benchmarks.fake_translator import FakeTranslator
+from benchmarks.mock_server import MockTranslationServer
+from benchmarks.notebooks import PROFILES, write_directory, write_notebook
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory of this process and its children in MB, or None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_scenario(scenario, options):
+    """
+    Translates the synthetic notebooks of a scenario and returns its measurements.
+
+    Args:
+        scenario (dict): mode ('file' or 'directory'), profile, cells and notebooks
+        options (dict): Settings of the fake translator and of the translation
+    """
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    server = None
+    if options['http']:
+        # Real HTTP requests through deep_translator, to the local mock server
+        server = MockTranslationServer(
+            latency=options['latency'], error_rate=options['error_rate'],
+            throttle_rate=options['throttle_rate'], retry_after=0, seed=options['seed']
+        ).start()
+        translator = jupyter_translate.get_translator('google', 'en', 'pt', endpoint_url=server.url)
+    else:
+        translator = FakeTranslator(
+            latency=options['latency'], error_rate=options['error_rate'],
+            throttle_rate=options['throttle_rate'], seed=options['seed']
+        )
+    retry_policy = jupyter_translate.RetryPolicy(retries=options['retries'], base_delay=0.01, max_delay=1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if scenario['mode'] == 'file':
+            paths = [write_notebook(os.path.join(directory, 'notebook.ipynb'), scenario['cells'], scenario['profile'])]
+        else:
+            paths = write_directory(directory, scenario['notebooks'], scenario['cells'], scenario['profile'])
+        notebook_mb = sum(os.path.getsize(path) for path in paths) / (1024 * 1024)
+
+        jupyter_translate.metrics.reset()
+        started = perf_counter()
+        if scenario['mode'] == 'file':
+            jupyter_translate.jupyter_translate(
+                fname=paths[0], src_language='en', dest_language='pt', delay=0.01,
+                translator_name='fake', translator=translator, workers=options['workers'],
+                force=True, retry_policy=retry_policy
+            )
+            failures = {}
+        else:
+            failures = jupyter_translate.translate_directory(
+                directory, src_language='en', dest_language='pt', delay=0.01,
+                translator_name='fake', translator=translator, workers=options['workers'],
+                jobs=options['jobs'], force=True, retry_policy=retry_policy
+            )
+        wall_time = perf_counter() - started
+
+    if server is not None:
+        server.stop()
+    snapshot = jupyter_translate.metrics.snapshot()
+    return dict(
+        scenario,
+        notebook_mb=round(notebook_mb, 2),
+        wall_time=round(wall_time, 3),
+        segments=snapshot['segments'],
+        segments_per_second=round(snapshot['segments'] / wall_time, 1) if wall_time else None,
+        requests_per_notebook=round(snapshot['requests'] / len(paths), 1),
+        retries=snapshot['retries'],
+        failed_notebooks=len(failures),
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+def _run_in_child(queue, scenario, options):
+    queue.put(run_scenario(scenario, options))
+
+def run_isolated(scenario, options):
+    """
+    Runs a scenario in a new process, so that its peak memory isn't mixed with the other scenarios.
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_in_child, args=(queue, scenario, options))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+# Modules that the CLI should only import when a translation actually starts
+HEAVY_MODULES = ('deep_translator', 'requests', 'tqdm', 'asyncio')
+# The commands run from the directory of the module, so that it can be imported
+MODULE_DIRECTORY = os.path.dirname(os.path.abspath(jupyter_translate.__file__))
+
+def time_command(args, runs):
+    """
+    Runs a Python command runs times and returns its fastest wall time in milliseconds.
+    """
+    durations = []
+    for _ in range(runs):
+        started = perf_counter()
+        subprocess.run([sys.executable] + args, cwd=MODULE_DIRECTORY, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(perf_counter() - started)
+    return round(min(durations) * 1000, 1)
+
+def measure_startup(runs=5):
+    """
+    Measures the startup of the CLI: importing the module, --help, and a dry run of a small notebook.
+
+    Also reports the heavy modules loaded by the dry run, which should be none.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        notebook = write_notebook(os.path.join(directory, 'notebook.ipynb'), 50, 'mixed')
+        dry_run = ['-m', 'jupyter_translate', notebook, '--target', 'pt', '--dry-run', '--no-cache']
+        probe = (
+            f"import sys, jupyter_translate; sys.argv = ['jupyter_translate'] + {dry_run[2:]!r}; "
+            f"jupyter_translate.main(); print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        )
+        loaded = subprocess.run(
+            [sys.executable, '-c', probe], cwd=MODULE_DIRECTORY, check=True, capture_output=True, text=True
+        ).stdout.splitlines()[-1]
+        return {
+            'python_ms': time_command(['-c', 'pass'], runs),
+            'import_ms': time_command(['-c', 'import jupyter_translate'], runs),
+            'help_ms': time_command(['-m', 'jupyter_translate', '--help'], runs),
+            'dry_run_ms': time_command(dry_run, runs),
+            'dry_run_heavy_modules': loaded.split(',') if loaded else [],
+        }
+
+def scenarios(modes, profiles, sizes, notebooks):
+    return [
+        {'mode': mode, 'profile': profile, 'cells': cells, 'notebooks': notebooks if mode == 'directory' else 1}
+        for mode in modes for profile in profiles for cells in sizes
+    ]
+
+COLUMNS = ('mode', 'profile', 'cells', 'notebooks', 'notebook_mb', 'wall_time', 'segments',
+           'segments_per_second', 'requests_per_notebook', 'retries', 'failed_notebooks', 'peak_rss_mb')
+
+def print_table(results):
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in COLUMNS]
+    print('  '.join(column.ljust(width) for column, width in zip(COLUMNS, widths)))
+    for result in results:
+        print('  '.join(str(result[column]).ljust(width) for column, width in zip(COLUMNS, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of jupyter_translate with a simulated translator.")
+    parser.add_argument('--mode', nargs='+', choices=['file', 'directory'], default=['file', 'directory'], help="Translate a single file, a directory, or both (default: both)")
+    parser.add_argument('--profile', nargs='+', choices=sorted(PROFILES), default=sorted(PROFILES), help="Mixes of cells of the synthetic notebooks (default: all)")
+    parser.add_argument('--cells', nargs='+', type=int, default=[50, 500], help="Number of cells of each notebook (default: 50 500)")
+    parser.add_argument('--notebooks', type=int, default=10, help="Number of notebooks of the directory mode (default: 10)")
+    parser.add_argument('--latency', type=float, default=0.05, help="Mean latency of a request in seconds (default: 0.05)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of the requests failing with a server error (default: 0)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of the requests rejected with a 429 (default: 0)")
+    parser.add_argument('--retries', type=int, default=5, help="Maximum number of attempts for each request (default: 5)")
+    parser.add_argument('--workers', type=int, default=4, help="Number of concurrent translation requests (default: 4)")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of processes of the directory mode (default: 1)")
+    parser.add_argument('--http', action='store_true', help="Send HTTP requests to a local mock server instead of using the in-process fake translator")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the simulated outcomes (default: 0)")
+    parser.add_argument('--startup-runs', type=int, default=5, help="Runs of each command of the startup measurements, 0 to skip them (default: 5)")
+    parser.add_argument('--output', help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    options = dict(
+        latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+        retries=args.retries, workers=args.workers, jobs=args.jobs, seed=args.seed, http=args.http
+    )
+    startup = measure_startup(args.startup_runs) if args.startup_runs > 0 else None
+    if startup is not None:
+        print(
+            f"Startup: python {startup['python_ms']} ms, import {startup['import_ms']} ms, "
+            f"--help {startup['help_ms']} ms, --dry-run {startup['dry_run_ms']} ms "
+            f"(heavy modules loaded: {', '.join(startup['dry_run_heavy_modules']) or 'none'})"
+        )
+    results = [run_isolated(scenario, options) for scenario in scenarios(args.mode, args.profile, args.cells, args.notebooks)]
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'options': options, 'startup': startup, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,399 +1,3611 @@
-import json, os, re, sys
-import argparse
-from deep_translator import (
-    GoogleTranslator,
-    MyMemoryTranslator
-)
-from tqdm import tqdm  # For progress bar
-from time import sleep
-
-# Função para selecionar o tradutor com base no nome
-def get_translator(translator_name, src_language, dest_language):
-    translators = {
-        'google': GoogleTranslator,
-        'mymemory': MyMemoryTranslator,
-    }
-    TranslatorClass = translators.get(translator_name.lower())
-    if not TranslatorClass:
-        raise ValueError(f"Translator {translator_name} not supported.")
-    
-    try:
-        print(f"Using translator: {translator_name.capitalize()}")
-        print(f"Source language: {src_language}, Target language: {dest_language}")
-        
-        # Get supported languages
-        supported_languages = TranslatorClass().get_supported_languages(as_dict=True)
-        
-        # Check if source and target languages are supported
-        if src_language not in supported_languages.values():
-            print(f"Warning: Source language '{src_language}' might not be supported. Available languages:")
-            for code, lang in supported_languages.items():
-                if src_language.lower() in lang.lower():
-                    print(f"  - Did you mean '{lang}' (code: {code})?")
-        
-        if dest_language not in supported_languages.values():
-            print(f"Warning: Target language '{dest_language}' might not be supported. Available languages:")
-            for code, lang in supported_languages.items():
-                if dest_language.lower() in lang.lower():
-                    print(f"  - Did you mean '{lang}' (code: {code})?")
-        
-        # Initialize translator with source and target languages
-        return TranslatorClass(source=src_language, target=dest_language)
-        
-    except Exception as e:
-        if 'No support for the provided language' in str(e):
-            print(f"Error: {e}")
-            supported_languages = TranslatorClass().get_supported_languages(as_dict=True)
-            print(f"Supported languages for {translator_name}: {supported_languages}")
-        else:
-            print(f"Error initializing the translator: {e}")
-        sys.exit(1)
-
-def safe_translate(translator, text, retries=3, delay=10):
-    if not text.strip():  # Skip empty texts
-        return text
-        
-    print(f"Translating text: {text[:30]}...")  # Debug: Show what we're translating
-    for i in range(retries):
-        try:
-            translated = translator.translate(text)
-            print(f"Translation result: {translated[:30]}...")  # Debug: Show result
-            return translated
-        except Exception as e:
-            print(f"Error translating: {str(e)}. Trying again ({i+1}/{retries})...")
-            sleep(delay)
-    raise Exception(f"Failed to translate after {retries} attempts.")
-
-def translate_markdown(text, translator, delay):
-    # Regex expressions
-    MD_CODE_REGEX = r'```[a-z]*\n[\s\S]*?\n```'
-    CODE_REPLACEMENT_KW = r'xx_markdown_code_xx'
-    
-    MD_LINK_REGEX = r'\[([^\]]+)\]\(([^)]+)\)'
-    LINK_REPLACEMENT_KW = 'xx_markdown_link_xx'
-
-    # Markdown tags
-    END_LINE = '\n'
-    IMG_PREFIX = '!['
-    HEADERS = ['### ', '###', '## ', '##', '# ', '#']  # Should be from this order (bigger to smaller)
-
-    print(f"Processing markdown text: {text[:30]}...")  # Debug
-
-    # Inner function to replace tags from text from a source list
-    def replace_from_list(tag, text, replacement_list):
-        if not replacement_list:
-            return text
-        replacement_list = list(replacement_list)  # Ensure it's a list
-        replacement_iter = iter(replacement_list)
-        
-        def replace_match(match):
-            nonlocal replacement_iter
-            try:
-                return next(replacement_iter)
-            except StopIteration:
-                # Reset iterator if we ran out of replacements
-                replacement_iter = iter(replacement_list)
-                return next(replacement_iter)
-                
-        return re.sub(tag, replace_match, text)
-
-    # Inner function for translation
-    def translate(text):
-        # Get all markdown links
-        md_links = re.findall(MD_LINK_REGEX, text)
-        print(f"Found {len(md_links)} markdown links")  # Debug
-
-        # Get all markdown code blocks
-        md_codes = re.findall(MD_CODE_REGEX, text)
-        print(f"Found {len(md_codes)} markdown code blocks")  # Debug
-
-        # Replace markdown links in text to markdown_link
-        text = re.sub(MD_LINK_REGEX, LINK_REPLACEMENT_KW, text)
-
-        # Replace links in markdown to tag markdown_link
-        text = re.sub(MD_CODE_REGEX, CODE_REPLACEMENT_KW, text)
-
-        print(f"Text after replacements (before translation): {text[:50]}...")  # Debug
-
-        # Translate text
-        text = safe_translate(translator, text, delay=delay)
-
-        print(f"Text after translation: {text[:50]}...")  # Debug
-
-        # Replace tags to original link tags
-        if md_links:
-            # Reconstruct the original markdown links
-            original_links = [f"[{title}]({url})" for title, url in md_links]
-            text = replace_from_list(LINK_REPLACEMENT_KW, text, original_links)
-
-        # Replace code tags
-        if md_codes:
-            text = replace_from_list(CODE_REPLACEMENT_KW, text, md_codes)
-
-        return text
-
-    # Check if there are special Markdown tags
-    if len(text) >= 2:
-        if text[-1:] == END_LINE:
-            return translate(text) + '\n'
-
-        if text[:2] == IMG_PREFIX:
-            return text
-
-        for header in HEADERS:
-            len_header = len(header)
-            if text[:len_header] == header:
-                return header + translate(text[len_header:])
-
-    return translate(text)
-
-def translate_code_comments_and_prints(code, translator, delay):
-    if not code or code.isspace():
-        return code
-
-    def translate_text(text):
-        return safe_translate(translator, text, delay=delay)
-
-    # Split line by line to handle multi-line code
-    lines = code.split('\n')
-    translated_lines = []
-    
-    for line in lines:
-        # Handle comments (# ... )
-        if '#' in line:
-            code_part, comment_part = line.split('#', 1)
-            translated_comment = translate_text(comment_part.strip())
-            translated_line = f"{code_part}# {translated_comment}"
-            translated_lines.append(translated_line)
-            continue
-            
-        # Skip f-string print statements entirely to preserve variable references
-        if 'print(f' in line:
-            translated_lines.append(line)  # Keep f-string prints unchanged
-            continue
-            
-        # Handle regular print statements
-        if 'print(' in line and ('f"' not in line and "f'" not in line):
-            # Try to match regular print statements
-            match = re.search(r'print\(\s*["\'](.+?)["\']\s*(?:,.*?)?\)', line)
-            if match:
-                text_to_translate = match.group(1)
-                translated_text = translate_text(text_to_translate)
-                # Replace the original text with translated text
-                translated_line = line.replace(text_to_translate, translated_text)
-                translated_lines.append(translated_line)
-                continue
-        
-        # If none of the above conditions match, keep the line as is
-        translated_lines.append(line)
-    
-    return '\n'.join(translated_lines)
-
-def jupyter_translate(fname, src_language, dest_language, delay, translator_name, rename_source_file=False, print_translation=False):
-    """
-    Translates a Jupyter Notebook from one language to another.
-    """
-
-    # Initialize the translator
-    translator = get_translator(translator_name, src_language, dest_language)
-    
-    # Test the translator with a simple text
-    test_text = "Teste de tradução. Isso deve ser traduzido."
-    try:
-        test_result = translator.translate(test_text)
-        print(f"Translator test - Original: '{test_text}' → Translated: '{test_result}'")
-    except Exception as e:
-        print(f"Translator test failed: {str(e)}")
-        print("The translator is not working correctly. Please check your settings and try again.")
-        sys.exit(1)
-
-    # Check if the necessary parameters are provided
-    if not fname or not dest_language:
-        print("Error: Missing required parameters.")
-        print("Usage: python jupyter_translate.py <notebook_file> --source <source_language> --target <destination_language> --translator <translator>")
-        sys.exit(1)
-
-    # Load the notebook file
-    with open(fname, 'r', encoding='utf-8') as file:
-        data_translated = json.load(file)
-
-    total_cells = len(data_translated['cells'])
-    code_cells = sum(1 for cell in data_translated['cells'] if cell['cell_type'] == 'code')
-    markdown_cells = sum(1 for cell in data_translated['cells'] if cell['cell_type'] == 'markdown')
-
-    print(f"Total cells: {total_cells}")
-    print(f"Code cells: {code_cells}")
-    print(f"Markdown cells: {markdown_cells}")
-
-    # Translate each cell
-    for i, cell in enumerate(tqdm(data_translated['cells'], desc="Translating cells", unit="cell")):
-        if cell['cell_type'] == 'markdown':
-            # For markdown cells, we need to handle special markdown syntax
-            # Join all source lines into a single string for better translation
-            full_markdown = ''.join(cell['source'])
-            
-            # Translate the whole markdown content
-            translated_markdown = translate_markdown(full_markdown, translator, delay=delay)
-            
-            # Split the translated content back into lines
-            data_translated['cells'][i]['source'] = translated_markdown.splitlines(True)  # keepends=True to preserve newlines
-            
-            if print_translation:
-                print(f"Translated markdown cell {i}:")
-                print(''.join(data_translated['cells'][i]['source']))
-                
-        elif cell['cell_type'] == 'code':
-            # For code cells, translate comments and print statements
-            translated_source = []
-            for source_line in cell['source']:
-                # Translate comments and formatted print statements within code
-                translated_line = translate_code_comments_and_prints(source_line, translator, delay=delay)
-                translated_source.append(translated_line)
-                
-            data_translated['cells'][i]['source'] = translated_source
-            
-            if print_translation:
-                print(f"Translated code cell {i}:")
-                print(''.join(data_translated['cells'][i]['source']))
-
-    if rename_source_file:
-        fname_bk = f"{'.'.join(fname.split('.')[:-1])}_bk.ipynb"  # index.ipynb -> index_bk.ipynb
-
-        os.rename(fname, fname_bk)
-        print(f'{fname} has been renamed as {fname_bk}')
-
-        with open(fname, 'w', encoding='utf-8') as f:
-            json.dump(data_translated, f, ensure_ascii=False, indent=2)
-        print(f'The {dest_language} translation has been saved as {fname}')
-    else:
-        dest_fname = f"{'.'.join(fname.split('.')[:-1])}_{dest_language}.ipynb"  # any.name.ipynb -> any.name_en.ipynb
-        with open(dest_fname, 'w', encoding='utf-8') as f:
-            json.dump(data_translated, f, ensure_ascii=False, indent=2)
-        print(f'The {dest_language} translation has been saved as {dest_fname}')
-
-def translate_directory(directory, src_language, dest_language, delay, translator_name, rename_source_file=False, print_translation=False, recursive=True):
-    """
-    Translates all Jupyter Notebooks in a directory.
-    
-    Args:
-        directory (str): Path to the directory containing the notebooks
-        src_language (str): Source language code
-        dest_language (str): Destination language code
-        delay (int): Delay between API calls to avoid rate limiting
-        translator_name (str): Name of the translator to use
-        rename_source_file (bool): Whether to rename the original file
-        print_translation (bool): Whether to print translations to console
-        recursive (bool): Whether to process subdirectories recursively
-    """
-    if not os.path.isdir(directory):
-        print(f"Error: {directory} is not a valid directory")
-        return
-
-    translated_files = 0
-    
-    # Walk through the directory and its subdirectories if recursive is True
-    if recursive:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.endswith('.ipynb'):
-                    notebook_path = os.path.join(root, file)
-                    print(f"\nTranslating {notebook_path}...")
-                    jupyter_translate(
-                        fname=notebook_path, 
-                        src_language=src_language,
-                        dest_language=dest_language,
-                        delay=delay,
-                        translator_name=translator_name,
-                        rename_source_file=rename_source_file,
-                        print_translation=print_translation
-                    )
-                    translated_files += 1
-    else:
-        # Process only files in the current directory
-        for file in os.listdir(directory):
-            if file.endswith('.ipynb'):
-                notebook_path = os.path.join(directory, file)
-                print(f"\nTranslating {notebook_path}...")
-                jupyter_translate(
-                    fname=notebook_path, 
-                    src_language=src_language,
-                    dest_language=dest_language,
-                    delay=delay,
-                    translator_name=translator_name,
-                    rename_source_file=rename_source_file,
-                    print_translation=print_translation
-                )
-                translated_files += 1
-    
-    print(f"\nTranslation complete! Translated {translated_files} notebook{'s' if translated_files != 1 else ''}.")
-
-# Main function to parse arguments and run the translation
-def main():
-    parser = argparse.ArgumentParser(description="Translate a Jupyter Notebook from one language to another.")
-    parser.add_argument('fname', help="Path to the Jupyter Notebook file or directory containing notebooks")
-    parser.add_argument('--source', default='auto', help="Source language code (default: auto-detect)")
-    parser.add_argument('--target', required=True, help="Destination language code")
-    parser.add_argument('--delay', type=int, default=10, help="Delay between retries in seconds (default: 10)")
-    parser.add_argument('--translator', default='google', help="Translator to use (options: google or mymemory). Default: google")
-    parser.add_argument('--rename', action='store_true', help="Rename the original file after translation")
-    parser.add_argument('--print', dest='print_translation', action='store_true', help="Print translations to console")
-    parser.add_argument('--directory', action='store_true', help="Process all .ipynb files in the specified directory")
-    parser.add_argument('--no-recursive', dest='recursive', action='store_false', help="Don't process subdirectories when using --directory")
-    parser.set_defaults(recursive=True)
-
-    args = parser.parse_args()
-
-    # Map common language names to ISO codes if full names are provided
-    language_map = {
-        'english': 'en',
-        'portuguese': 'pt',
-        'spanish': 'es',
-        'french': 'fr',
-        'german': 'de',
-        'italian': 'it',
-        'dutch': 'nl',
-        'chinese': 'zh-CN',
-        'japanese': 'ja',
-        'korean': 'ko',
-        'russian': 'ru',
-        'arabic': 'ar'
-    }
-
-    # Convert source and target languages to ISO codes if they are full names
-    src_language = args.source.lower()
-    if src_language in language_map:
-        src_language = language_map[src_language]
-    
-    dest_language = args.target.lower()
-    if dest_language in language_map:
-        dest_language = language_map[dest_language]
-
-    print(f"Using source language code: {src_language}, target language code: {dest_language}")
-
-    # Check if we're processing a directory or a single file
-    if args.directory or os.path.isdir(args.fname):
-        translate_directory(
-            directory=args.fname,
-            src_language=src_language,
-            dest_language=dest_language,
-            delay=args.delay,
-            translator_name=args.translator,
-            rename_source_file=args.rename,
-            print_translation=args.print_translation,
-            recursive=args.recursive
-        )
-    else:
-        jupyter_translate(
-            fname=args.fname,
-            src_language=src_language,
-            dest_language=dest_language,
-            delay=args.delay,
-            translator_name=args.translator,
-            rename_source_file=args.rename,
-            print_translation=args.print_translation
-        )
-
-if __name__ == '__main__':
-    main()
-
-
+import json, os, re, sys
+import random
+import io
+import tokenize
+import mmap
+import argparse
+import bisect
+import hashlib
+import html
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from time import monotonic, sleep, time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from importlib import import_module
+try:
+    from typing import Protocol
+except ImportError:  # Python 3.7
+    Protocol = object
+
+logger = logging.getLogger(__name__)
+
+def _supported_languages():
+    from deep_translator.constants import GOOGLE_LANGUAGES_TO_CODES, MY_MEMORY_LANGUAGES_TO_CODES
+    # Languages supported by each translator, as {name: code}
+    return {
+        'google': GOOGLE_LANGUAGES_TO_CODES,
+        'mymemory': MY_MEMORY_LANGUAGES_TO_CODES,
+    }
+
+# Heavy dependencies, only imported when first used so that the CLI starts fast
+LAZY_ATTRIBUTES = {
+    'GoogleTranslator': lambda: import_module('deep_translator').GoogleTranslator,
+    'MyMemoryTranslator': lambda: import_module('deep_translator').MyMemoryTranslator,
+    'SUPPORTED_LANGUAGES': _supported_languages,
+    'tqdm': lambda: import_module('tqdm').tqdm,  # For progress bar
+}
+
+def __getattr__(name):
+    # Module attributes of LAZY_ATTRIBUTES are loaded on first access (PEP 562)
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = LAZY_ATTRIBUTES[name]()
+    return value
+
+def lazy(name):
+    """
+    Returns an attribute of LAZY_ATTRIBUTES, importing it on first use.
+
+    The lookup goes through the module, so patched attributes are honored.
+    """
+    return getattr(sys.modules[__name__], name)
+
+# Upper bounds of the request latency histogram, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class TranslationMetrics:
+    """
+    Thread-safe counters of the work sent to the translation providers.
+
+    Counts segments, requests, characters sent, cache hits and misses, retries,
+    failed requests, duplicate segments, segments shared with concurrent
+    callers and segments left untranslated, and keeps a histogram of the request latencies.
+    """
+    COUNTERS = ('segments', 'requests', 'chars_sent', 'cache_hits', 'cache_misses', 'retries', 'failed_requests',
+                'duplicate_segments', 'coalesced_segments', 'failed_segments')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+            # One bucket per bound, plus one for the slower requests
+            self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.latency_sum = 0.0
+            self.latency_max = 0.0
+            self.started = time()
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def record_request(self, chars, latency, failed=False):
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['chars_sent'] += chars
+            if failed:
+                self.counters['failed_requests'] += 1
+            self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def snapshot(self):
+        """
+        Returns the metrics as a JSON-serializable dict.
+        """
+        with self._lock:
+            count = sum(self.latency_buckets)
+            bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+            return dict(
+                self.counters,
+                elapsed_seconds=round(time() - self.started, 3),
+                latency_seconds={
+                    'count': count,
+                    'sum': round(self.latency_sum, 6),
+                    'mean': round(self.latency_sum / count, 6) if count else 0.0,
+                    'max': round(self.latency_max, 6),
+                    'buckets': dict(zip(bounds, self.latency_buckets)),
+                },
+            )
+
+    def merge(self, snapshot):
+        """
+        Adds the snapshot of another collector, e.g. of a worker process.
+        """
+        latency = snapshot['latency_seconds']
+        with self._lock:
+            for counter in self.COUNTERS:
+                self.counters[counter] += snapshot.get(counter, 0)
+            for i, count in enumerate(latency['buckets'].values()):
+                self.latency_buckets[i] += count
+            self.latency_sum += latency['sum']
+            self.latency_max = max(self.latency_max, latency['max'])
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+# Metrics of the current process
+metrics = TranslationMetrics()
+
+# Returned by disabled tracers, so that tracing costs a single check
+_NULL_SPAN = nullcontext()
+
+class Tracer:
+    """
+    Records timed spans as Chrome trace events, which open in Perfetto,
+    chrome://tracing or speedscope.
+
+    Tracing is disabled until enable() is called, and span() then returns
+    a shared no-op context manager.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    @contextmanager
+    def _record(self, name, category, args):
+        start = time()
+        try:
+            yield
+        finally:
+            end = time()
+            event = {
+                'name': name, 'cat': category, 'ph': 'X',
+                # Wall clock microseconds, comparable between processes
+                'ts': round(start * 1e6, 3), 'dur': round((end - start) * 1e6, 3),
+                'pid': os.getpid(), 'tid': threading.get_ident(),
+            }
+            if args:
+                event['args'] = args
+            with self._lock:
+                self.events.append(event)
+
+    def span(self, name, category='phase', **args):
+        """
+        Returns a context manager recording the time spent in its block.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._record(name, category, args)
+
+    def take_events(self):
+        """
+        Returns the recorded events and forgets them, e.g. at the end of a job in a worker process.
+        """
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def merge(self, events):
+        with self._lock:
+            self.events.extend(events)
+
+    def write(self, path):
+        with self._lock:
+            trace = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f)
+
+# Tracer of the current process
+tracer = Tracer()
+
+# Class of each translator, imported when a translator is built
+TRANSLATOR_CLASSES = {
+    'google': 'GoogleTranslator',
+    'mymemory': 'MyMemoryTranslator',
+}
+
+# Language codes, as opposed to the language names also accepted by the translators
+LANGUAGE_CODE_REGEX = re.compile(r'auto|[a-z]{2,3}(-[A-Za-z]{2,4})?')
+
+def language_to_code(translator_name, language):
+    """
+    Returns the code of a language given by code or by name, as the translator maps it.
+
+    The language tables of the translators are only imported for names.
+    """
+    if LANGUAGE_CODE_REGEX.fullmatch(language):
+        return language
+    return lazy('SUPPORTED_LANGUAGES').get(translator_name.lower(), {}).get(language.lower(), language)
+
+class TranslatorKey:
+    """
+    Stand-in with the identity of a translator used by the cache keys, to
+    look up the cache without importing the translation backends.
+    It can't translate anything.
+    """
+
+    def __init__(self, provider_name, source, target):
+        self.provider_name = provider_name
+        self.source = source
+        self.target = target
+
+    def translate(self, text):
+        raise TypeError(f"{self.provider_name} was only built to compute cache keys.")
+
+# Função para selecionar o tradutor com base no nome
+def get_translator(translator_name, src_language, dest_language, rate_limiter_class=None, endpoint_url=None, key_only=False):
+    # With key_only, returns a TranslatorKey instead of importing and building the translator
+    # Several comma-separated translators are combined into a RoutingTranslator
+    names = [name.strip().lower() for name in translator_name.split(',') if name.strip()]
+    if len(names) > 1:
+        # Parallel processes must share the same rate limit budget, see SharedRateLimiter
+        rate_limiter_class = rate_limiter_class or RateLimiter
+        backends = [
+            RouteBackend(
+                name,
+                get_translator(
+                    name, map_language_code(name, src_language), map_language_code(name, dest_language),
+                    endpoint_url=endpoint_url, key_only=key_only
+                ),
+                rate_limiter=rate_limiter_class.for_translator(name),
+                max_chars=MAX_REQUEST_CHARS.get(name)
+            )
+            for name in names
+        ]
+        return RoutingTranslator(backends)
+
+    class_name = TRANSLATOR_CLASSES.get(translator_name.lower())
+    if not class_name:
+        raise ValueError(f"Translator {translator_name} not supported.")
+    if key_only:
+        provider_name = f"{class_name}@{endpoint_url}" if endpoint_url else class_name
+        return TranslatorKey(
+            provider_name, language_to_code(translator_name, src_language), language_to_code(translator_name, dest_language)
+        )
+    TranslatorClass = lazy(class_name)
+    
+    try:
+        logger.info(f"Using translator: {translator_name.capitalize()}")
+        logger.info(f"Source language: {src_language}, Target language: {dest_language}")
+        
+        # Get supported languages
+        supported_languages = lazy('SUPPORTED_LANGUAGES')[translator_name.lower()]
+        
+        # Check if source and target languages are supported
+        if src_language not in supported_languages.values():
+            logger.warning(f"Source language '{src_language}' might not be supported. Available languages:")
+            for code, lang in supported_languages.items():
+                if src_language.lower() in lang.lower():
+                    logger.warning(f"  - Did you mean '{lang}' (code: {code})?")
+        
+        if dest_language not in supported_languages.values():
+            logger.warning(f"Target language '{dest_language}' might not be supported. Available languages:")
+            for code, lang in supported_languages.items():
+                if dest_language.lower() in lang.lower():
+                    logger.warning(f"  - Did you mean '{lang}' (code: {code})?")
+        
+        # Initialize translator with source and target languages
+        translator = TranslatorClass(source=src_language, target=dest_language)
+        if endpoint_url:
+            # deep_translator has no option for it, e.g. to use a mock server in load tests
+            logger.info(f"Sending the requests to {endpoint_url}")
+            translator._base_url = endpoint_url
+            # Keeps the cached translations of each endpoint apart
+            translator.provider_name = f"{class_name}@{endpoint_url}"
+        return translator
+        
+    except Exception as e:
+        if 'No support for the provided language' in str(e):
+            logger.error(f"Error: {e}")
+            supported_languages = lazy('SUPPORTED_LANGUAGES')[translator_name.lower()]
+            logger.error(f"Supported languages for {translator_name}: {supported_languages}")
+        else:
+            logger.error(f"Error initializing the translator: {e}")
+        sys.exit(1)
+
+# Default file of the segments left untranslated
+DEFAULT_DEAD_LETTER = 'translation_failures.jsonl'
+
+# Default location of the persistent translation memory
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'jupyter_translate'
+)
+
+def normalize_segment(text):
+    """
+    Normalizes a segment so equivalent texts share the same cache entry.
+    """
+    return text.replace('\r\n', '\n').replace('\r', '\n').strip()
+
+class TranslationCache:
+    """
+    Persistent translation memory in front of the translation providers.
+
+    Entries are stored in a SQLite file under cache_dir, keyed by translator,
+    source language, target language and a hash of the normalized segment.
+    The most recently used entries are also kept in an in-memory LRU.
+
+    Args:
+        cache_dir (str): Directory of the SQLite file
+        memory_size (int): Number of entries kept in memory
+        max_entries (int): Number of entries kept on disk before evicting the least recently used
+        max_age_days (float): Age after which entries are evicted from disk
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, memory_size=10000, max_entries=1000000, max_age_days=90):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, 'translations.sqlite3')
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._db = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(translator, text):
+        # Async translators share the entries of their blocking counterparts
+        provider = (getattr(translator, 'provider_name', None) or type(translator).__name__).lower()
+        source = getattr(translator, 'source', '')
+        target = getattr(translator, 'target', '')
+        digest = hashlib.sha256(normalize_segment(text).encode('utf-8')).hexdigest()
+        return f"{provider}:{source}:{target}:{digest}"
+
+    def _connect(self):
+        # The database is only opened on first use so that building a cache is free
+        if self._db is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            import sqlite3
+            self._db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS translations ('
+                'key TEXT PRIMARY KEY, translation TEXT NOT NULL, '
+                'created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS translations_accessed ON translations (accessed)')
+            self.evict()
+        return self._db
+
+    def __getstate__(self):
+        # Only the settings are sent to other processes, which open their own connection
+        return {
+            'cache_dir': self.cache_dir, 'memory_size': self.memory_size,
+            'max_entries': self.max_entries, 'max_age_days': self.max_age_days
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _remember(self, key, translation):
+        self._memory[key] = translation
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, translator, text):
+        """
+        Returns the cached translation of text, or None if it isn't cached.
+        """
+        key = self.make_key(translator, text)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                metrics.increment('cache_hits')
+                return self._memory[key]
+
+            db = self._connect()
+            row = db.execute('SELECT translation FROM translations WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.increment('cache_misses')
+                return None
+
+            db.execute('UPDATE translations SET accessed = ? WHERE key = ?', (time(), key))
+            db.commit()
+            self._remember(key, row[0])
+            self.hits += 1
+            metrics.increment('cache_hits')
+            return row[0]
+
+    def set_many(self, translator, items):
+        """
+        Stores a list of (text, translation) pairs in a single transaction.
+        """
+        now = time()
+        rows = [(self.make_key(translator, text), translation, now, now) for text, translation in items]
+        if not rows:
+            return
+        with self._lock:
+            db = self._connect()
+            db.executemany('INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)', rows)
+            db.commit()
+            for key, translation, _, _ in rows:
+                self._remember(key, translation)
+
+    def set(self, translator, text, translation):
+        self.set_many(translator, [(text, translation)])
+
+    def contains(self, translator, text):
+        """
+        Returns whether text is cached, without counting a hit or refreshing the entry.
+        """
+        key = self.make_key(translator, text)
+        with self._lock:
+            if key in self._memory:
+                return True
+            return self._connect().execute('SELECT 1 FROM translations WHERE key = ?', (key,)).fetchone() is not None
+
+    def evict(self):
+        """
+        Removes entries older than max_age_days and the least recently used
+        entries above max_entries.
+        """
+        with self._lock:
+            db = self._connect()
+            db.execute('DELETE FROM translations WHERE created < ?', (time() - self.max_age_days * 86400,))
+            db.execute(
+                'DELETE FROM translations WHERE key IN ('
+                'SELECT key FROM translations ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+# Default rate limits of each provider: (requests per second, characters per minute)
+DEFAULT_RATE_LIMITS = {
+    'google': (5, 100000),
+    'mymemory': (2, 10000),
+}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at rate tokens per second up to capacity.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, amount):
+        # Takes amount tokens if available, otherwise returns how long to wait for them
+        amount = min(amount, self.capacity)  # Requests bigger than the bucket are allowed once it is full
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0
+            return (amount - self._tokens) / self.rate
+
+    def acquire(self, amount=1):
+        """
+        Blocks until amount tokens are available and takes them.
+        """
+        wait = self._take(amount)
+        while wait:
+            sleep(wait)
+            wait = self._take(amount)
+
+    async def acquire_async(self, amount=1):
+        """
+        Waits without blocking the event loop until amount tokens are available and takes them.
+        """
+        import asyncio
+        wait = self._take(amount)
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self._take(amount)
+
+class RateLimiter:
+    """
+    Limits the requests sent to a translator by requests per second and characters per minute.
+
+    Either limit can be None to disable it.
+    """
+    bucket_class = TokenBucket
+
+    def __init__(self, requests_per_second=None, chars_per_minute=None):
+        self.requests = self.bucket_class(requests_per_second) if requests_per_second else None
+        self.chars = self.bucket_class(chars_per_minute / 60, capacity=chars_per_minute) if chars_per_minute else None
+
+    @classmethod
+    def for_translator(cls, translator_name, requests_per_second=None, chars_per_minute=None):
+        """
+        Builds a rate limiter using the provider's default limits for the values not given.
+        """
+        default_rps, default_cpm = DEFAULT_RATE_LIMITS.get(translator_name.lower(), (None, None))
+        return cls(
+            requests_per_second if requests_per_second is not None else default_rps,
+            chars_per_minute if chars_per_minute is not None else default_cpm
+        )
+
+    def acquire(self, chars):
+        if self.requests is not None:
+            self.requests.acquire()
+        if self.chars is not None:
+            self.chars.acquire(chars)
+
+    async def acquire_async(self, chars):
+        if self.requests is not None:
+            await self.requests.acquire_async()
+        if self.chars is not None:
+            await self.chars.acquire_async(chars)
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket whose state lives in shared memory, so that all the
+    processes of a pool draw from the same budget.
+
+    It must be handed to the worker processes when they are created,
+    e.g. through the initargs of a ProcessPoolExecutor.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        import multiprocessing
+        # [tokens, last update]
+        self._state = multiprocessing.RawArray('d', [self.capacity, monotonic()])
+        self._lock = multiprocessing.Lock()
+
+    def _take(self, amount):
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = monotonic()
+            tokens = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+            self._state[1] = now
+            if tokens >= amount:
+                self._state[0] = tokens - amount
+                return 0
+            self._state[0] = tokens
+            return (amount - tokens) / self.rate
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter shared by all the processes of a pool.
+    """
+    bucket_class = SharedTokenBucket
+
+class TranslationFailedError(Exception):
+    """
+    Raised when a text can't be translated, after retrying if the error was retryable.
+    """
+
+# Errors of the providers that can't be fixed by trying again
+FATAL_ERRORS = (
+    'ApiKeyException',
+    'AuthorizationException',
+    'InvalidSourceOrTargetLanguage',
+    'LanguageNotSupportedException',
+    'NotValidLength',
+    'NotValidPayload',
+)
+
+def get_retry_after(error):
+    """
+    Returns the number of seconds a provider asked to wait before retrying, or None.
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        response = getattr(error, 'response', None)
+        retry_after = getattr(response, 'headers', {}).get('Retry-After') if response is not None else None
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    # Retry-After can also be an HTTP date
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    """
+    Decides whether and how long to wait before retrying a failed request.
+
+    Waits follow an exponential backoff with full jitter, unless the provider
+    gave a Retry-After hint.
+
+    Args:
+        retries (int): Maximum number of attempts
+        base_delay (float): Delay of the first retry in seconds, before jitter
+        max_delay (float): Maximum delay between two attempts in seconds
+    """
+
+    def __init__(self, retries=3, base_delay=1, max_delay=60):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, error):
+        if type(error).__name__ in FATAL_ERRORS:
+            return False
+        status_code = getattr(error, 'status_code', None)
+        # Client errors won't change when retried, except for timeouts and throttling
+        if isinstance(status_code, int) and 400 <= status_code < 500 and status_code not in (408, 429):
+            return False
+        return True
+
+    def backoff(self, attempt, error=None):
+        """
+        Returns how long to wait after the given failed attempt, counting from 0.
+        """
+        retry_after = get_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class CircuitBreaker:
+    """
+    Pauses every request to a provider after consecutive failures, instead
+    of letting each worker keep hitting a throttled endpoint.
+
+    After failure_threshold consecutive failures, or a Retry-After hint, the
+    circuit opens and all callers of wait() block until the cooldown is over.
+    The next request then probes the provider: a success closes the circuit,
+    a failure opens it again.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the circuit
+        cooldown (float): Seconds the circuit stays open
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Each process of a pool gets its own closed circuit
+        return {'failure_threshold': self.failure_threshold, 'cooldown': self.cooldown}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def remaining(self):
+        """
+        Returns how long the circuit stays open, or 0 if it is closed.
+        """
+        with self._lock:
+            return max(0.0, self._open_until - monotonic())
+
+    def wait(self):
+        remaining = self.remaining()
+        while remaining:
+            sleep(remaining)
+            remaining = self.remaining()
+
+    async def wait_async(self):
+        import asyncio
+        remaining = self.remaining()
+        while remaining:
+            await asyncio.sleep(remaining)
+            remaining = self.remaining()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or retry_after:
+                pause = max(self.cooldown if self.failures >= self.failure_threshold else 0, retry_after or 0)
+                if self._open_until < monotonic() + pause:
+                    self._open_until = monotonic() + pause
+                    logger.warning(f"Too many translation errors. Pausing all requests for {pause:.0f} seconds...")
+
+# Language codes that have another name in some providers
+LANGUAGE_CODE_MAP = {
+    'mymemory': {
+        'en': 'en-GB', 'pt': 'pt-PT', 'es': 'es-ES', 'fr': 'fr-FR', 'de': 'de-DE', 'it': 'it-IT',
+        'nl': 'nl-NL', 'ja': 'ja-JP', 'ko': 'ko-KR', 'ru': 'ru-RU', 'ar': 'ar-SA', 'zh-cn': 'zh-CN',
+    },
+}
+
+def map_language_code(translator_name, language):
+    """
+    Returns the code a provider uses for a language code of the default translator.
+    """
+    return LANGUAGE_CODE_MAP.get(translator_name.lower(), {}).get(language.lower(), language)
+
+class RouteBackend:
+    """
+    A provider of a RoutingTranslator, with its own quota and error budget.
+
+    Args:
+        name (str): Name of the provider
+        translator: Translator of the provider
+        rate_limiter (RateLimiter): Limits of the provider, or None to disable them
+        max_chars (int): Maximum characters of a request to the provider, or None for the default
+        circuit_breaker (CircuitBreaker): Error budget of the provider
+    """
+
+    def __init__(self, name, translator, rate_limiter=None, max_chars=None, circuit_breaker=None):
+        self.name = name
+        self.translator = translator
+        self.rate_limiter = rate_limiter
+        self.max_chars = max_chars or DEFAULT_MAX_REQUEST_CHARS
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        # Requests per second the provider can take, to spread the load between providers
+        requests = getattr(rate_limiter, 'requests', None)
+        self.weight = requests.rate if requests is not None else 1
+        self.in_flight = 0
+
+    def chunks(self, text):
+        """
+        Splits a payload of delimited segments into requests that fit in max_chars,
+        or returns None if one of its segments doesn't fit.
+        """
+        if len(text) <= self.max_chars:
+            return [text]
+        parts = text.split(SEGMENT_DELIMITER)
+        if any(len(part) > self.max_chars for part in parts):
+            return None
+        return [SEGMENT_DELIMITER.join(parts[i] for i in batch) for batch in pack_segments(parts, self.max_chars)]
+
+    def translate(self, text):
+        chunks = self.chunks(text)
+        if chunks is None:
+            raise ValueError(f"Text too long for {self.name}")
+        translations = []
+        for chunk in chunks:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(len(chunk))
+            translations.append(self.translator.translate(chunk))
+        return SEGMENT_DELIMITER.join(translations)
+
+class RoutingTranslator:
+    """
+    Translator that spreads requests across several providers to add up
+    their throughput, and fails over to another provider when one fails.
+
+    Each request goes to the healthy provider with the least load for its
+    rate. A provider whose error budget (circuit breaker) is exhausted only
+    gets requests when every other provider failed too.
+
+    Args:
+        backends (list): RouteBackend of each provider, in order of preference
+    """
+    provider_name = 'RoutingTranslator'
+
+    def __init__(self, backends):
+        if not backends:
+            raise ValueError("RoutingTranslator needs at least one backend.")
+        self.backends = backends
+        self.source = backends[0].translator.source
+        self.target = backends[0].translator.target
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'backends': self.backends}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _ranked_backends(self, text):
+        # Healthy backends first, then by load relative to their rate
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.chunks(text) is not None]
+            return sorted(candidates, key=lambda backend: (
+                backend.circuit_breaker.remaining() > 0, (backend.in_flight + 1) / backend.weight
+            ))
+
+    def translate(self, text):
+        candidates = self._ranked_backends(text)
+        if not candidates:
+            raise ValueError(f"Text of {len(text)} characters is too long for every translator.")
+
+        error = None
+        for backend in candidates:
+            # Only reached for an open circuit once the healthy backends failed
+            backend.circuit_breaker.wait()
+            with self._lock:
+                backend.in_flight += 1
+            try:
+                translated = backend.translate(text)
+            except Exception as e:
+                error = e
+                backend.circuit_breaker.record_failure(get_retry_after(e))
+                logger.warning(f"Translator {backend.name} failed: {str(e)}. Trying the next translator...")
+                continue
+            finally:
+                with self._lock:
+                    backend.in_flight -= 1
+            backend.circuit_breaker.record_success()
+            return translated
+        raise error
+
+def check_translator(translator):
+    """
+    Tests the translator with a simple text, exiting if it doesn't work.
+    """
+    test_text = "Teste de tradução. Isso deve ser traduzido."
+    try:
+        test_result = translator.translate(test_text)
+        logger.info(f"Translator test - Original: '{test_text}' → Translated: '{test_result}'")
+    except Exception as e:
+        logger.error(f"Translator test failed: {str(e)}")
+        logger.error("The translator is not working correctly. Please check your settings and try again.")
+        sys.exit(1)
+
+def safe_translate(translator, text, retries=3, delay=10, cache=None, rate_limiter=None, retry_policy=None, circuit_breaker=None):
+    """
+    Translates a text, retrying retryable errors with exponential backoff.
+
+    delay is the base delay of the backoff, unless a RetryPolicy is given.
+    A CircuitBreaker shared by several workers pauses all of them when the
+    provider keeps failing.
+    """
+    if not text.strip():  # Skip empty texts
+        return text
+
+    retry_policy = retry_policy or RetryPolicy(retries=retries, base_delay=delay)
+
+    if cache is not None:
+        cached = cache.get(translator, text)
+        if cached is not None:
+            return cached
+
+    logger.debug("Translating text: %.30s...", text)
+    for i in range(retry_policy.retries):
+        if circuit_breaker is not None:
+            with tracer.span('circuit breaker', 'wait'):
+                circuit_breaker.wait()
+        if rate_limiter is not None:
+            with tracer.span('rate limit', 'wait'):
+                rate_limiter.acquire(len(text))
+        started = monotonic()
+        try:
+            with tracer.span('request', 'provider', chars=len(text), attempt=i + 1):
+                translated = translator.translate(text)
+        except Exception as e:
+            metrics.record_request(len(text), monotonic() - started, failed=True)
+            if not retry_policy.is_retryable(e):
+                raise TranslationFailedError(f"Failed to translate: {str(e)}") from e
+            if circuit_breaker is not None:
+                circuit_breaker.record_failure(get_retry_after(e))
+            if i + 1 < retry_policy.retries:
+                wait = retry_policy.backoff(i, e)
+                logger.warning(f"Error translating: {str(e)}. Trying again in {wait:.1f}s ({i+1}/{retry_policy.retries})...")
+                metrics.increment('retries')
+                with tracer.span('backoff', 'wait', seconds=wait):
+                    sleep(wait)
+            continue
+
+        metrics.record_request(len(text), monotonic() - started)
+        logger.debug("Translation result: %.30s...", translated)
+        if circuit_breaker is not None:
+            circuit_breaker.record_success()
+        if cache is not None:
+            cache.set(translator, text, translated)
+        return translated
+    raise TranslationFailedError(f"Failed to translate after {retry_policy.retries} attempts.")
+
+# Markdown spans protected from the translator, matched in a single pass.
+# The name of each group is the kind of its placeholders.
+MD_PROTECTED_REGEX = re.compile(r'''
+    (?P<code>
+        ^[ \t]*(?P<fence>`{3,}|~{3,})[^\n]*\n[\s\S]*?^[ \t]*(?P=fence)[ \t]*$  # Fenced code blocks
+        | (?P<tick>`+)[^`][\s\S]*?(?P=tick)                                 # Inline code
+    )
+    | (?P<math>
+        \$\$[\s\S]+?\$\$ | \$[^\s$](?:[^$\n]*[^\s$])?\$ | \\\([\s\S]+?\\\) | \\\[[\s\S]+?\\\]
+    )
+    | (?P<img>!\[[^\]]*\]\([^)]*\))
+    | (?P<link>\[[^\]]+\]\([^)]+\))
+    | (?P<html>
+        <!--[\s\S]*?-->
+        | </[A-Za-z][A-Za-z0-9-]*\s*>                                          # Closing tags
+        | <[A-Za-z][A-Za-z0-9-]*                                             # Opening tags, whose attributes have values
+          (?:\s+(?:[A-Za-z_:][\w:.-]*\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+)
+                  | (?:allowfullscreen|async|autoplay|checked|controls|defer|disabled|download|hidden|loop|multiple|muted|open|readonly|required|selected)(?=[\s/>])))*
+          \s*/?>
+    )
+    | (?P<url>https?://[^\s)>\]]*[^\s)>\].,;:!?'"])
+''', re.VERBOSE | re.MULTILINE)
+MD_PROTECTED_KINDS = ('code', 'math', 'img', 'link', 'html', 'url')
+# Kinds whose placeholders are kept apart from the words they touch, so that
+# the translator sees <b>bold</b> as three words instead of a single token
+MD_PADDED_KINDS = ('html',)
+
+# Placeholders of the protected spans, e.g. xxlink0xx, tolerating spaces added by the translator
+PLACEHOLDER_REGEX = re.compile(r'xx\s*(code|math|img|link|html|url)\s*(\d+)\s*xx', re.IGNORECASE)
+# A placeholder with the space on each side that may be padding
+PADDED_PLACEHOLDER_REGEX = re.compile(r'([ \t]?)(' + PLACEHOLDER_REGEX.pattern + r')([ \t]?)', re.IGNORECASE)
+
+# Markdown tags
+HEADERS = ['### ', '###', '## ', '##', '# ', '#']  # Should be from this order (bigger to smaller)
+
+# Delimiter used to pack several segments into a single provider request
+SEGMENT_DELIMITER = '\nxx_segment_break_xx\n'
+SEGMENT_SPLIT_REGEX = re.compile(r'\s*xx_segment_break_xx\s*', re.IGNORECASE)
+
+# Maximum number of characters each provider accepts in a single request
+# (deep_translator rejects texts of 5000 and 500 characters or more)
+MAX_REQUEST_CHARS = {
+    'google': 4999,
+    'mymemory': 499,
+}
+DEFAULT_MAX_REQUEST_CHARS = 4999
+
+# Boundaries at which long segments are split, from the safest to the last resort:
+# paragraphs, lines, sentences and words. Placeholders of protected spans have no
+# whitespace, so they are never split.
+CHUNK_BOUNDARY_REGEXES = [
+    re.compile(r'(\n[ \t]*\n\s*)'),
+    re.compile(r'(\n\s*)'),
+    re.compile(r'(?<=[.!?:;])(\s+)'),
+    re.compile(r'(\s+)'),
+]
+
+def split_whitespace(text):
+    """
+    Splits a text into its leading whitespace, its core and its trailing whitespace.
+    """
+    core = text.strip()
+    if not core:
+        return text, '', ''
+    start = text.index(core)
+    return text[:start], core, text[start + len(core):]
+
+def mask_markdown(text):
+    """
+    Replaces the code, math, images, links, HTML and URLs of a markdown text
+    with indexed placeholders in a single pass.
+
+    Returns a tuple (masked, protected) where protected is the list of the
+    original spans, with the padding added before and after their placeholder,
+    indexed by the number of their placeholders.
+    """
+    protected = []
+
+    def mask(match):
+        kind = next(kind for kind in MD_PROTECTED_KINDS if match.group(kind) is not None)
+        before = after = ''
+        if kind in MD_PADDED_KINDS:
+            if match.start() > 0 and not text[match.start() - 1].isspace():
+                before = ' '
+            if match.end() < len(text) and not text[match.end()].isspace():
+                after = ' '
+        protected.append((match.group(), before, after))
+        return f"{before}xx{kind}{len(protected) - 1}xx{after}"
+
+    return MD_PROTECTED_REGEX.sub(mask, text), protected
+
+def restore_markdown(text, protected):
+    """
+    Puts the protected spans back in place of their placeholders in a single pass,
+    removing the padding added around them by mask_markdown.
+    """
+    if not protected:
+        return text
+
+    def restore(match):
+        space_before, placeholder, _, index, space_after = match.groups()
+        if int(index) >= len(protected):
+            return match.group()
+        span, before, after = protected[int(index)]
+        return (space_before if not before else '') + span + (space_after if not after else '')
+
+    return PADDED_PLACEHOLDER_REGEX.sub(restore, text)
+
+def plan_markdown(text):
+    """
+    Extracts the translatable segments of a markdown cell.
+
+    Returns a tuple (segments, rebuild) where rebuild takes the list of
+    translated segments and returns the translated markdown.
+    """
+    logger.debug("Processing markdown text: %.30s...", text)
+
+    leading, core, trailing = split_whitespace(text)
+
+    # Headers are kept out of the translated text
+    for header in HEADERS:
+        if core[:len(header)] == header:
+            header_leading, core, header_trailing = split_whitespace(core[len(header):])
+            leading = leading + header + header_leading
+            trailing = header_trailing + trailing
+            break
+
+    if not core:
+        return [], lambda translations: text
+
+    # Protected spans are not sent to the translator
+    masked, protected = mask_markdown(core)
+    logger.debug("Found %d protected markdown spans", len(protected))
+
+    # Nothing left to translate, e.g. a cell with only an image or a code block
+    if not re.search(r'[^\W\d_]', PLACEHOLDER_REGEX.sub('', masked)):
+        return [], lambda translations: text
+
+    def rebuild(translations):
+        return leading + restore_markdown(translations[0], protected) + trailing
+
+    return [masked], rebuild
+
+# Print statements handled by the line based fallback of plan_code
+PRINT_REGEX = re.compile(r'print\(\s*["\'](.+?)["\']\s*(?:,.*?)?\)')
+STRING_PREFIX_REGEX = re.compile(r'^[A-Za-z]*')
+# Escape sequences of string literals, and the characters that start a known one
+STRING_ESCAPE_REGEX = re.compile(r'\\(.)', re.DOTALL)
+STRING_ESCAPE_CHARS = '\n\\\'"abfnrtv01234567xNuU'
+
+def _line_offsets(code):
+    # Offset of the start of each line, indexed by the 1-based row numbers of tokenize
+    offsets = [0, 0]
+    for line in code.splitlines(True):
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+def _string_literal_parts(token):
+    """
+    Splits a string literal into its prefix, quote and content.
+    """
+    prefix = STRING_PREFIX_REGEX.match(token).group()
+    quote = token[len(prefix):len(prefix) + 3]
+    if quote not in ('"""', "'''"):
+        quote = quote[0]
+    return prefix, quote, token[len(prefix) + len(quote):-len(quote)]
+
+def _unescape_literal(content):
+    """
+    Returns the value of the content of a string literal without r prefix.
+
+    Unknown escape sequences like \\d keep their backslash, as in Python.
+    Raises UnicodeDecodeError if an escape sequence is incomplete.
+    """
+    content = STRING_ESCAPE_REGEX.sub(lambda match: match.group() if match.group(1) in STRING_ESCAPE_CHARS else '\\' + match.group(), content)
+    return content.encode('latin-1', 'backslashreplace').decode('unicode_escape')
+
+def _escape_literal(text, quote, raw=False):
+    """
+    Escapes a translated text so that it can be put back between quote.
+
+    The text of a raw literal is put back as is, so None is returned if it
+    can't be written between the quotes of a raw literal.
+    """
+    if raw:
+        unclosed = quote in text or text.endswith('\\') or (len(quote) == 1 and ('\n' in text or '\r' in text))
+        return None if unclosed or (len(quote) == 3 and text.endswith(quote[0])) else text
+    text = text.replace('\\', '\\\\').replace('\r', '\\r')
+    if len(quote) == 1:
+        return text.replace('\n', '\\n').replace('\t', '\\t').replace(quote, '\\' + quote)
+    # Runs of quotes, and a quote right before the closing quotes, would end the literal early
+    return re.sub(re.escape(quote[0]) + r'(?=' + re.escape(quote[0]) + r'|$)', lambda match: '\\' + quote[0], text)
+
+def extract_code_spans(code):
+    """
+    Finds the comments, print literals and docstrings of a code cell with the tokenize module.
+
+    Returns a list of (start, end, text, quote, raw) where start and end are
+    the offsets of the translatable text in the code, quote is the quote of
+    the string literal around it, or None for comments, and raw tells whether
+    the literal has an r prefix. The text of the other literals is their value,
+    with escape sequences decoded. f-strings and bytes are left out to
+    preserve their references and values.
+
+    Raises tokenize.TokenError, IndentationError or SyntaxError if the code can't be tokenized.
+    """
+    offsets = _line_offsets(code)
+    tokens = [
+        token for token in tokenize.generate_tokens(io.StringIO(code).readline)
+        if token.type not in (tokenize.NL, tokenize.ENCODING)
+    ]
+
+    spans = []
+    statement_keyword = None  # First name of the statement that opened the current block
+    previous = None
+    for i, token in enumerate(tokens):
+        start = offsets[token.start[0]] + token.start[1]
+
+        if token.type == tokenize.COMMENT:
+            prefix = re.match(r'#\s*', token.string).group()
+            text = token.string[len(prefix):].rstrip()
+            if text and not token.string.startswith('#!'):
+                spans.append((start + len(prefix), start + len(prefix) + len(text), text, None, False))
+            continue
+
+        if token.type == tokenize.STRING:
+            prefix, quote, content = _string_literal_parts(token.string)
+            following = tokens[i + 1] if i + 1 < len(tokens) else None
+            is_print_argument = (
+                previous is not None and previous.string == '(' and i >= 2 and tokens[i - 2].string == 'print'
+                and following is not None and following.string in (',', ')')
+            )
+            # A string alone at the top of a cell is its displayed value, unless other statements follow
+            is_docstring = (
+                following is not None and following.type in (tokenize.NEWLINE, tokenize.ENDMARKER)
+                and (
+                    (previous.type == tokenize.INDENT and statement_keyword in ('def', 'class')) if previous is not None
+                    else any(later.type not in (tokenize.NEWLINE, tokenize.COMMENT, tokenize.ENDMARKER) for later in tokens[i + 1:])
+                )
+            )
+            if (is_print_argument or is_docstring) and not set(prefix.lower()) & {'b', 'f'}:
+                leading, text, _ = split_whitespace(content)
+                raw = 'r' in prefix.lower()
+                text_start = start + len(prefix) + len(quote) + len(leading)
+                text_end = text_start + len(text)
+                try:
+                    text = text if raw else _unescape_literal(text)
+                except UnicodeDecodeError:
+                    text = ''  # e.g. a backslash before the stripped whitespace
+                if text.strip():
+                    spans.append((text_start, text_end, text, quote, raw))
+
+        if token.type == tokenize.NEWLINE:
+            # Remember how the statement started, to recognize the docstrings of its block
+            statement_keyword = None
+            for statement_token in reversed(tokens[:i]):
+                if statement_token.type in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+                    break
+                if statement_token.type == tokenize.NAME:
+                    statement_keyword = statement_token.string
+            if statement_keyword == 'async':
+                statement_keyword = 'def'
+        else:
+            previous = token
+
+    return spans
+
+def plan_code(code):
+    """
+    Extracts the comments, print literals and docstrings of a code cell in a single pass.
+
+    Returns a tuple (segments, rebuild) where rebuild takes the list of
+    translated segments and returns the translated code, spliced back by offset.
+    Code that can't be tokenized, like some cell magics, is handled line by line.
+    """
+    if not code or code.isspace():
+        return [], lambda translations: code
+
+    try:
+        spans = extract_code_spans(code)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return plan_code_lines(code)
+
+    def rebuild(translations):
+        parts = []
+        pos = 0
+        for (start, end, _, quote, raw), translation in zip(spans, translations):
+            parts.append(code[pos:start])
+            # Comments must stay on one line, literals must stay valid
+            if quote is None:
+                parts.append(translation.replace('\n', ' '))
+            else:
+                escaped = _escape_literal(translation, quote, raw)
+                parts.append(code[start:end] if escaped is None else escaped)
+            pos = end
+        parts.append(code[pos:])
+        return ''.join(parts)
+
+    return [text for _, _, text, _, _ in spans], rebuild
+
+def plan_code_lines(code):
+    """
+    Line based version of plan_code, for code that can't be tokenized.
+    """
+    segments = []
+    # Each line is either kept as is or rebuilt from its translated segment
+    line_builders = []
+
+    # Split line by line to handle multi-line code
+    for line in code.split('\n'):
+        # Handle comments (# ... )
+        if '#' in line:
+            code_part, comment_part = line.split('#', 1)
+            line_builders.append((len(segments), lambda t, code_part=code_part: f"{code_part}# {t}"))
+            segments.append(comment_part.strip())
+            continue
+
+        # Skip f-string print statements entirely to preserve variable references
+        if 'print(f' in line:
+            line_builders.append((None, line))
+            continue
+
+        # Handle regular print statements
+        if 'print(' in line and ('f"' not in line and "f'" not in line):
+            match = PRINT_REGEX.search(line)
+            if match:
+                text_to_translate = match.group(1)
+                # Replace the original text with translated text
+                line_builders.append((len(segments), lambda t, line=line, text_to_translate=text_to_translate: line.replace(text_to_translate, t)))
+                segments.append(text_to_translate)
+                continue
+
+        # If none of the above conditions match, keep the line as is
+        line_builders.append((None, line))
+
+    def rebuild(translations):
+        lines = []
+        for index, builder in line_builders:
+            if index is None:
+                lines.append(builder)
+            else:
+                lines.append(builder(translations[index]))
+        return '\n'.join(lines)
+
+    return segments, rebuild
+
+def translate_markdown(text, translator, delay):
+    segments, rebuild = plan_markdown(text)
+    return rebuild([safe_translate(translator, segment, delay=delay) for segment in segments])
+
+def translate_code_comments_and_prints(code, translator, delay):
+    segments, rebuild = plan_code(code)
+    return rebuild([safe_translate(translator, segment, delay=delay) for segment in segments])
+
+def pack_segments(segments, max_chars):
+    """
+    Groups segment indices into batches whose joined payload fits in max_chars.
+
+    Empty segments are left out, as they don't need to be translated.
+    """
+    batches = []
+    batch, batch_chars = [], 0
+    for index, segment in enumerate(segments):
+        if not segment.strip():
+            continue
+        extra = len(segment) + (len(SEGMENT_DELIMITER) if batch else 0)
+        if batch and batch_chars + extra > max_chars:
+            batches.append(batch)
+            batch, batch_chars = [], 0
+            extra = len(segment)
+        batch.append(index)
+        batch_chars += extra
+    if batch:
+        batches.append(batch)
+    return batches
+
+def chunk_segment(text, max_chars, level=0):
+    """
+    Splits a text longer than max_chars into chunks that fit, at the safest
+    boundaries available.
+
+    The whitespace between chunks is returned as separate chunks, so that
+    joining the chunks gives back the exact text.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(CHUNK_BOUNDARY_REGEXES):
+        # A single word longer than max_chars is cut, but not inside a placeholder
+        chunks = []
+        while len(text) > max_chars:
+            cut = max_chars
+            for match in PLACEHOLDER_REGEX.finditer(text, 0, max_chars + 20):
+                if match.start() < cut < match.end() and match.start() > 0:
+                    cut = match.start()
+            chunks.append(text[:cut])
+            text = text[cut:]
+        return chunks + [text]
+
+    chunks = []
+    current = ''
+    # Alternates pieces of text and boundaries
+    tokens = CHUNK_BOUNDARY_REGEXES[level].split(text)
+    for i in range(0, len(tokens), 2):
+        piece = tokens[i]
+        boundary = tokens[i + 1] if i + 1 < len(tokens) else ''
+        if len(piece) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.extend(chunk_segment(piece, max_chars, level + 1))
+            if boundary:
+                chunks.append(boundary)
+        elif current and len(current) + len(piece) <= max_chars:
+            current += piece
+        else:
+            if current:
+                chunks.append(current)
+            current = piece
+        if boundary and current:
+            # The boundary is kept inside the chunk if the next piece fits too
+            next_piece = tokens[i + 2] if i + 2 < len(tokens) else ''
+            if len(current) + len(boundary) + len(next_piece) <= max_chars:
+                current += boundary
+            else:
+                chunks.extend([current, boundary])
+                current = ''
+        elif boundary and not chunks[-1:] == [boundary]:
+            chunks.append(boundary)
+    if current:
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk]
+
+def chunk_segments(segments, max_chars):
+    """
+    Splits the segments longer than max_chars into chunks.
+
+    Returns a tuple (chunks, owners) where owners[i] is the index of the
+    segment chunks[i] comes from.
+    """
+    chunks, owners = [], []
+    for index, segment in enumerate(segments):
+        segment_chunks = chunk_segment(segment, max_chars) if segment.strip() else [segment]
+        chunks.extend(segment_chunks)
+        owners.extend([index] * len(segment_chunks))
+    return chunks, owners
+
+def join_chunks(translated_chunks, owners, count):
+    """
+    Joins the translated chunks of each segment, reversing chunk_segments.
+
+    A segment with an untranslated (None) chunk is None.
+    """
+    translations = [''] * count
+    for chunk, owner in zip(translated_chunks, owners):
+        if chunk is None or translations[owner] is None:
+            translations[owner] = None
+        else:
+            translations[owner] += chunk
+    return translations
+
+def dedupe_segments(segments):
+    """
+    Normalizes the segments and keeps one copy of each.
+
+    Returns a tuple (unique, positions) where positions[i] is the index in
+    unique of the normalized segments[i], or None for blank segments.
+    """
+    unique, positions, seen = [], [], {}
+    for segment in segments:
+        if not segment.strip():
+            positions.append(None)
+            continue
+        normalized = normalize_segment(segment)
+        if normalized not in seen:
+            seen[normalized] = len(unique)
+            unique.append(normalized)
+        positions.append(seen[normalized])
+    return unique, positions
+
+def expand_segments(translated_unique, positions, segments):
+    """
+    Gives each segment the translation of its unique copy, reversing dedupe_segments.
+
+    Each segment gets back its own leading and trailing whitespace, and its CRLF line endings.
+    """
+    expanded = []
+    for segment, position in zip(segments, positions):
+        translation = segment if position is None else translated_unique[position]
+        if position is not None and translation is not None:
+            leading, _, trailing = split_whitespace(segment)
+            if '\r\n' in segment:
+                translation = translation.replace('\r\n', '\n').replace('\n', '\r\n')
+            translation = leading + translation + trailing
+        expanded.append(translation)
+    return expanded
+
+class SingleFlight:
+    """
+    Registry of the segments being translated in this process.
+
+    A caller that needs a segment already requested by another thread or
+    coroutine waits for that request instead of sending a duplicate one.
+    The caller that claimed a key must resolve it, with a result or an error.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """
+        Returns a tuple (future, owner) where owner is True if the caller must translate the key.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future, False
+            future = self._futures[key] = Future()
+            return future, True
+
+    def resolve(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._futures)
+
+# Segments being translated by the threads and coroutines of this process
+in_flight = SingleFlight()
+
+def claim_segments(translator, segments, cache=None, journal=None):
+    """
+    Looks up the segments in the journal and the cache, and claims the others in in_flight.
+
+    Returns a tuple (translations, pending, owned, shared): the segments with
+    the cached translations filled in, the segments to translate (blank for
+    the others), the (key, future) claimed for each pending index, and the
+    futures of the indices already requested by a concurrent caller.
+    """
+    translations = list(segments)
+    pending = [''] * len(segments)
+    owned, shared = {}, {}
+    for index, segment in enumerate(segments):
+        if not segment.strip():
+            continue
+        cached = journal.get(segment) if journal is not None else None
+        if cached is None and cache is not None:
+            cached = cache.get(translator, segment)
+        if cached is not None:
+            translations[index] = cached
+            continue
+        key = TranslationCache.make_key(translator, segment)
+        future, owner = in_flight.claim(key)
+        if owner:
+            pending[index] = segment
+            owned[index] = (key, future)
+        else:
+            shared[index] = future
+    if shared:
+        metrics.increment('coalesced_segments', len(shared))
+    return translations, pending, owned, shared
+
+def fail_batch(batch, owned, error):
+    """
+    Leaves the segments of a request that failed after its retries untranslated (None).
+    """
+    logger.warning(f"Leaving {len(batch)} segment{'s' if len(batch) != 1 else ''} untranslated: {error}")
+    metrics.increment('failed_segments', len(batch))
+    for index in batch:
+        in_flight.resolve(*owned[index], error=error)
+    return [None] * len(batch)
+
+def release_segments(owned, error):
+    """
+    Fails the claims that weren't resolved, so that the callers waiting for them don't hang.
+    """
+    for key, future in owned.values():
+        if not future.done():
+            in_flight.resolve(key, future, error=error)
+
+def translate_batch(translator, batch, delay, rate_limiter=None, retry_policy=None, circuit_breaker=None):
+    """
+    Translates a list of segments with a single provider request.
+
+    Falls back to one request per segment when the translated payload
+    can't be split back into the same number of segments.
+    """
+    def request(text):
+        return safe_translate(
+            translator, text, delay=delay, rate_limiter=rate_limiter,
+            retry_policy=retry_policy, circuit_breaker=circuit_breaker
+        )
+
+    if len(batch) == 1:
+        return [request(batch[0])]
+
+    translated = request(SEGMENT_DELIMITER.join(batch))
+    parts = SEGMENT_SPLIT_REGEX.split(translated.strip())
+    if len(parts) == len(batch):
+        return parts
+
+    logger.warning(f"Batch of {len(batch)} segments came back as {len(parts)}. Translating them one by one...")
+    return [request(segment) for segment in batch]
+
+def translate_segments(translator, segments, delay, max_chars=DEFAULT_MAX_REQUEST_CHARS, cache=None, workers=1, rate_limiter=None, retry_policy=None, circuit_breaker=None, journal=None, skip_failures=False):
+    """
+    Translates a list of segments using as few provider requests as possible.
+
+    Segments found in the cache are not sent to the provider. With more than
+    one worker, requests are sent concurrently from a thread pool, throttled
+    by the rate limiter. Segments found in the journal of an interrupted run
+    are reused, and the translated ones appended to it. Identical segments,
+    once normalized, are translated once, and segments already being translated by a concurrent caller are
+    awaited instead of requested again. Segments longer than max_chars are
+    split into chunks at paragraph, line, sentence or word boundaries.
+    Returns the translations in the same order as the segments. With
+    skip_failures, the segments of the requests that failed after their
+    retries are None instead of raising TranslationFailedError.
+    """
+    unique, positions = dedupe_segments(segments)
+    duplicates = sum(position is not None for position in positions) - len(unique)
+    # Segments are always translated normalized, whether they are repeated or not
+    if duplicates or any(position is not None and segment != unique[position] for segment, position in zip(segments, positions)):
+        if duplicates:
+            metrics.increment('duplicate_segments', duplicates)
+        translated_unique = translate_segments(
+            translator, unique, delay, max_chars=max_chars, cache=cache, workers=workers,
+            rate_limiter=rate_limiter, retry_policy=retry_policy, circuit_breaker=circuit_breaker, journal=journal,
+            skip_failures=skip_failures
+        )
+        return expand_segments(translated_unique, positions, segments)
+
+    chunks, owners = chunk_segments(segments, max_chars)
+    if len(chunks) > len(segments):
+        translated_chunks = translate_segments(
+            translator, chunks, delay, max_chars=max_chars, cache=cache, workers=workers,
+            rate_limiter=rate_limiter, retry_policy=retry_policy, circuit_breaker=circuit_breaker, journal=journal,
+            skip_failures=skip_failures
+        )
+        return join_chunks(translated_chunks, owners, len(segments))
+
+    translations, pending, owned, shared = claim_segments(translator, segments, cache, journal)
+
+    def translate_indices(batch):
+        try:
+            results = translate_batch(
+                translator, [segments[i] for i in batch], delay, rate_limiter=rate_limiter,
+                retry_policy=retry_policy, circuit_breaker=circuit_breaker
+            )
+        except TranslationFailedError as e:
+            if not skip_failures:
+                raise
+            return fail_batch(batch, owned, e)
+        if cache is not None:
+            cache.set_many(translator, list(zip([segments[i] for i in batch], results)))
+        if journal is not None:
+            journal.record(zip([segments[i] for i in batch], results))
+        for index, result in zip(batch, results):
+            in_flight.resolve(*owned[index], result=result)
+        return results
+
+    batches = pack_segments(pending, max_chars)
+    metrics.increment('segments', sum(1 for segment in segments if segment.strip()))
+    progress = lazy('tqdm')(total=len(batches), desc="Translating segments", unit="request")
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # map keeps the results in the order of the batches
+            for batch, results in zip(batches, executor.map(translate_indices, batches)):
+                for index, result in zip(batch, results):
+                    translations[index] = result
+                progress.update()
+    except BaseException as e:
+        release_segments(owned, TranslationFailedError(f"Concurrent translation failed: {e}"))
+        raise
+    finally:
+        progress.close()
+    # Our own claims are all resolved, so waiting for the others can't deadlock
+    for index, future in shared.items():
+        try:
+            translations[index] = future.result()
+        except TranslationFailedError:
+            if not skip_failures:
+                raise
+            translations[index] = None
+    return translations
+
+# Patterns of the streaming notebook scanner
+_JSON_WS_REGEX = re.compile(rb'[ \t\r\n]*')
+_JSON_STRING_REGEX = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_JSON_STRUCTURE_REGEX = re.compile(rb'[\[\]{}"]')
+_JSON_SCALAR_REGEX = re.compile(rb'[^,\]}\s]+')
+_COPY_CHUNK_SIZE = 1 << 20
+
+def _skip_ws(buffer, pos):
+    return _JSON_WS_REGEX.match(buffer, pos).end()
+
+def _skip_value(buffer, pos):
+    """
+    Returns the end of the JSON value starting at pos without decoding it.
+    """
+    first = buffer[pos:pos + 1]
+    if first == b'"':
+        return _JSON_STRING_REGEX.match(buffer, pos).end()
+    if first not in (b'{', b'['):
+        return _JSON_SCALAR_REGEX.match(buffer, pos).end()
+
+    depth = 0
+    while True:
+        match = _JSON_STRUCTURE_REGEX.search(buffer, pos)
+        if match is None:
+            raise ValueError("Unterminated JSON value")
+        char = match.group()
+        if char == b'"':
+            # Strings are skipped in one go, so brackets inside them are ignored
+            pos = _JSON_STRING_REGEX.match(buffer, match.start()).end()
+            continue
+        pos = match.end()
+        depth += 1 if char in (b'{', b'[') else -1
+        if depth == 0:
+            return pos
+
+def _iter_members(buffer, pos):
+    """
+    Yields (key, key_start, value_start, value_end) for each member of the JSON object starting at pos.
+    """
+    if buffer[pos:pos + 1] != b'{':
+        raise ValueError("Expected a JSON object")
+    pos = _skip_ws(buffer, pos + 1)
+    if buffer[pos:pos + 1] == b'}':
+        return
+    while True:
+        key_start = pos
+        key_end = _JSON_STRING_REGEX.match(buffer, pos).end()
+        key = json.loads(bytes(buffer[key_start:key_end]).decode('utf-8'))
+        pos = _skip_ws(buffer, key_end)
+        if buffer[pos:pos + 1] != b':':
+            raise ValueError("Expected ':' in JSON object")
+        value_start = _skip_ws(buffer, pos + 1)
+        value_end = _skip_value(buffer, value_start)
+        yield key, key_start, value_start, value_end
+        pos = _skip_ws(buffer, value_end)
+        if buffer[pos:pos + 1] == b'}':
+            return
+        if buffer[pos:pos + 1] != b',':
+            raise ValueError("Expected ',' in JSON object")
+        pos = _skip_ws(buffer, pos + 1)
+
+def _iter_elements(buffer, pos):
+    """
+    Yields (value_start, value_end) for each element of the JSON array starting at pos.
+    """
+    if buffer[pos:pos + 1] != b'[':
+        raise ValueError("Expected a JSON array")
+    pos = _skip_ws(buffer, pos + 1)
+    if buffer[pos:pos + 1] == b']':
+        return
+    while True:
+        value_end = _skip_value(buffer, pos)
+        yield pos, value_end
+        pos = _skip_ws(buffer, value_end)
+        if buffer[pos:pos + 1] == b']':
+            return
+        if buffer[pos:pos + 1] != b',':
+            raise ValueError("Expected ',' in JSON array")
+        pos = _skip_ws(buffer, pos + 1)
+
+class NotebookDocument:
+    """
+    Streaming view of a notebook file.
+
+    The file is memory-mapped and only the cell_type, source and metadata of
+    each cell, and the metadata of the notebook, are decoded. Everything else,
+    like outputs and attachments, is copied through as raw bytes by write(),
+    so memory use is bounded by the largest cell source rather than the file.
+
+    Changes to the cells and metadata attributes are spliced into the
+    original bytes when the document is written.
+    """
+    CELL_KEYS = ('cell_type', 'source', 'metadata')
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._file = open(fname, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size:
+                self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = b''
+            self._scan()
+        except Exception:
+            self.close()
+            raise
+
+    def _scan(self):
+        buffer = self._buffer
+        root = _skip_ws(buffer, 0)
+        self.cells = []
+        self.metadata = {}
+        self._cell_spans = []
+        self._metadata_span = None
+        self._root_first_key = None
+        self._indent_unit = None
+
+        for key, key_start, value_start, value_end in _iter_members(buffer, root):
+            if self._root_first_key is None:
+                self._root_first_key = key_start
+                # Guess the indentation of the file from its first key
+                if b'\n' in buffer[root:key_start]:
+                    self._indent_unit = len(self._line_indent(key_start))
+            if key == 'metadata':
+                self.metadata = self._decode(value_start, value_end)
+                self._metadata_span = (key_start, value_start, value_end)
+            elif key == 'cells':
+                for cell_start, _ in _iter_elements(buffer, value_start):
+                    cell, spans = {}, {}
+                    for cell_key, cell_key_start, cell_value_start, cell_value_end in _iter_members(buffer, cell_start):
+                        if cell_key in self.CELL_KEYS:
+                            cell[cell_key] = self._decode(cell_value_start, cell_value_end)
+                            spans[cell_key] = (cell_key_start, cell_value_start, cell_value_end)
+                        spans.setdefault(None, cell_key_start)  # First key of the cell
+                    cell.setdefault('metadata', {})
+                    self.cells.append(cell)
+                    self._cell_spans.append(spans)
+
+        # Decoded copies used to only rewrite the values that changed
+        self._original_cells = json.loads(json.dumps(self.cells))
+        self._original_metadata = json.loads(json.dumps(self.metadata))
+
+    def _decode(self, start, end):
+        return json.loads(bytes(self._buffer[start:end]).decode('utf-8'))
+
+    def _line_indent(self, pos):
+        line_start = self._buffer.rfind(b'\n', 0, pos) + 1
+        return bytes(self._buffer[line_start:pos]).decode('utf-8')
+
+    def _dump(self, value, key_start):
+        if self._indent_unit is None:
+            return json.dumps(value, ensure_ascii=False)
+        # Keep nested lines aligned with the key the value belongs to
+        return json.dumps(value, ensure_ascii=False, indent=self._indent_unit).replace('\n', '\n' + self._line_indent(key_start))
+
+    def _member_edit(self, key, value, span, first_key_start):
+        # Replaces the value of an existing member, or inserts the member before the first key
+        if span is not None:
+            key_start, value_start, value_end = span
+            return value_start, value_end, self._dump(value, key_start)
+        separator = ',\n' + self._line_indent(first_key_start) if self._indent_unit is not None else ', '
+        member = json.dumps(key) + ': ' + self._dump(value, first_key_start) + separator
+        return first_key_start, first_key_start, member
+
+    def sha256(self):
+        """
+        Returns the hash of the raw bytes of the file.
+        """
+        return hashlib.sha256(self._buffer).hexdigest()
+
+    def write(self, dest_fname, cells=None, metadata=None):
+        """
+        Writes the document, with its changes, to dest_fname.
+
+        cells and metadata replace the attributes of the same name, e.g. to
+        write several versions of the document concurrently.
+        dest_fname can't be the file of the document, which is read while writing.
+        """
+        if os.path.realpath(dest_fname) == os.path.realpath(self.fname):
+            raise ValueError(f"Can't write {self.fname} over itself")
+        cells = self.cells if cells is None else cells
+        metadata = self.metadata if metadata is None else metadata
+
+        edits = []
+        if metadata != self._original_metadata:
+            edits.append(self._member_edit('metadata', metadata, self._metadata_span, self._root_first_key))
+        for cell, original, spans in zip(cells, self._original_cells, self._cell_spans):
+            for key in ('source', 'metadata'):
+                if cell.get(key) != original.get(key):
+                    edits.append(self._member_edit(key, cell[key], spans.get(key), spans[None]))
+        edits.sort(key=lambda edit: edit[0])
+
+        with open(dest_fname, 'wb') as f:
+            pos = 0
+            for start, end, text in edits:
+                self._copy(f, pos, start)
+                f.write(text.encode('utf-8'))
+                pos = end
+            self._copy(f, pos, len(self._buffer))
+            # The file must be on disk before it's renamed over a previous output
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _copy(self, f, start, end):
+        for chunk_start in range(start, end, _COPY_CHUNK_SIZE):
+            f.write(self._buffer[chunk_start:min(end, chunk_start + _COPY_CHUNK_SIZE)])
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def plan_notebook(cells, skip=()):
+    """
+    Extracts the translatable segments of every markdown and code cell of a notebook,
+    except for the cells whose index is in skip.
+
+    Returns a tuple (plans, segments) where segments is the flat list of
+    segments of the notebook and each plan is a tuple
+    (cell_index, offset, count, rebuild) locating the segments of a cell.
+    """
+    plans = []
+    segments = []
+    for i, cell in enumerate(cells):
+        if i in skip:
+            continue
+        if cell['cell_type'] == 'markdown':
+            # Join all source lines into a single string for better translation
+            with tracer.span('plan markdown cell', 'cell', index=i):
+                cell_segments, rebuild = plan_markdown(''.join(cell['source']))
+        elif cell['cell_type'] == 'code':
+            # For code cells, translate comments and print statements
+            with tracer.span('plan code cell', 'cell', index=i):
+                cell_segments, rebuild = plan_code(''.join(cell['source']))
+        else:
+            continue
+        plans.append((i, len(segments), len(cell_segments), rebuild))
+        segments.extend(cell_segments)
+    return plans, segments
+
+def apply_translations(cells, plans, translations, print_translation=False):
+    """
+    Rebuilds the source of the planned cells from the translated segments.
+    """
+    for i, offset, count, rebuild in plans:
+        cell = cells[i]
+        # Split the translated content back into lines
+        with tracer.span('rebuild cell', 'cell', index=i):
+            cell['source'] = rebuild(translations[offset:offset + count]).splitlines(True)  # keepends=True to preserve newlines
+
+        if print_translation:
+            print(f"Translated {cell['cell_type']} cell {i}:")
+            print(''.join(cell['source']))
+
+def output_filename(fname, dest_language):
+    return f"{'.'.join(fname.split('.')[:-1])}_{dest_language}.ipynb"  # any.name.ipynb -> any.name_en.ipynb
+
+class TranslationRequestError(Exception):
+    """
+    Error returned by a translation provider, with its HTTP status and Retry-After hint if any.
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class AsyncTranslator(Protocol):
+    """
+    Interface of the non-blocking translators used by translate_notebook_async.
+    """
+    source: str
+    target: str
+
+    async def translate(self, text):
+        ...
+
+class AsyncHTTPTranslator:
+    """
+    Base of the non-blocking translators, sharing one pooled aiohttp session
+    for all the requests. Use them as async context managers, or call close().
+
+    Args:
+        source (str): Source language code
+        target (str): Target language code
+        base_url (str): URL of the provider, or None for the default one
+        max_connections (int): Size of the connection pool
+        timeout (float): Timeout of each request in seconds
+    """
+    provider_name = None
+    default_base_url = None
+
+    def __init__(self, source='auto', target='en', base_url=None, max_connections=100, timeout=30):
+        self.source = source
+        self.target = target
+        self.base_url = base_url or self.default_base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = None
+
+    async def _get(self, params):
+        if self._session is None:
+            try:
+                import aiohttp
+            except ImportError:
+                raise ImportError("The asyncio engine needs aiohttp. Install it with: pip install jupyter-translate[async]")
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+
+        async with self._session.get(self.base_url, params=params) as response:
+            if response.status >= 400:
+                error = TranslationRequestError(
+                    f"{self.provider_name} returned HTTP {response.status}",
+                    status_code=response.status,
+                    retry_after=response.headers.get('Retry-After')
+                )
+                # Retry-After is a number of seconds or an HTTP date
+                error.retry_after = get_retry_after(error)
+                raise error
+            return await response.text()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class AsyncGoogleTranslator(AsyncHTTPTranslator):
+    """
+    Non-blocking version of deep_translator's GoogleTranslator.
+    """
+    provider_name = 'GoogleTranslator'
+    default_base_url = 'https://translate.google.com/m'
+    RESULT_REGEX = re.compile(r'<div[^>]*class="(?:t0|result-container)"[^>]*>(.*?)</div>', re.DOTALL)
+
+    async def translate(self, text):
+        page = await self._get({'sl': self.source, 'tl': self.target, 'q': text.strip()})
+        match = self.RESULT_REGEX.search(page)
+        if not match:
+            raise TranslationRequestError(f"No translation found for: {text[:30]}...")
+        return html.unescape(match.group(1)).strip()
+
+class AsyncMyMemoryTranslator(AsyncHTTPTranslator):
+    """
+    Non-blocking version of deep_translator's MyMemoryTranslator.
+    """
+    provider_name = 'MyMemoryTranslator'
+    default_base_url = 'http://api.mymemory.translated.net/get'
+
+    async def translate(self, text):
+        response = json.loads(await self._get({'langpair': f'{self.source}|{self.target}', 'q': text.strip()}))
+        return response['responseData']['translatedText']
+
+class ThreadedAsyncTranslator:
+    """
+    Adapts a blocking translator to the AsyncTranslator interface by running
+    its requests in a thread pool.
+    """
+
+    def __init__(self, translator, executor=None):
+        self.translator = translator
+        self.executor = executor
+        self.provider_name = type(translator).__name__
+
+    @property
+    def source(self):
+        return self.translator.source
+
+    @property
+    def target(self):
+        return self.translator.target
+
+    async def translate(self, text):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.translator.translate, text)
+
+async def safe_translate_async(translator, text, retries=3, delay=10, cache=None, rate_limiter=None, retry_policy=None, circuit_breaker=None):
+    """
+    Non-blocking version of safe_translate for AsyncTranslator instances.
+    """
+    import asyncio
+    if not text.strip():  # Skip empty texts
+        return text
+
+    retry_policy = retry_policy or RetryPolicy(retries=retries, base_delay=delay)
+    # The cache is a sqlite database, which is queried off the event loop
+    loop = asyncio.get_running_loop()
+
+    if cache is not None:
+        cached = await loop.run_in_executor(None, cache.get, translator, text)
+        if cached is not None:
+            return cached
+
+    for i in range(retry_policy.retries):
+        if circuit_breaker is not None:
+            await circuit_breaker.wait_async()
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async(len(text))
+        started = monotonic()
+        try:
+            translated = await translator.translate(text)
+        except Exception as e:
+            metrics.record_request(len(text), monotonic() - started, failed=True)
+            if not retry_policy.is_retryable(e):
+                raise TranslationFailedError(f"Failed to translate: {str(e)}") from e
+            if circuit_breaker is not None:
+                circuit_breaker.record_failure(get_retry_after(e))
+            if i + 1 < retry_policy.retries:
+                wait = retry_policy.backoff(i, e)
+                logger.warning(f"Error translating: {str(e)}. Trying again in {wait:.1f}s ({i+1}/{retry_policy.retries})...")
+                metrics.increment('retries')
+                await asyncio.sleep(wait)
+            continue
+
+        metrics.record_request(len(text), monotonic() - started)
+        if circuit_breaker is not None:
+            circuit_breaker.record_success()
+        if cache is not None:
+            await loop.run_in_executor(None, cache.set, translator, text, translated)
+        return translated
+    raise TranslationFailedError(f"Failed to translate after {retry_policy.retries} attempts.")
+
+async def translate_batch_async(translator, batch, delay, rate_limiter=None, retry_policy=None, circuit_breaker=None):
+    """
+    Non-blocking version of translate_batch.
+    """
+    async def request(text):
+        return await safe_translate_async(
+            translator, text, delay=delay, rate_limiter=rate_limiter,
+            retry_policy=retry_policy, circuit_breaker=circuit_breaker
+        )
+
+    if len(batch) == 1:
+        return [await request(batch[0])]
+
+    translated = await request(SEGMENT_DELIMITER.join(batch))
+    parts = SEGMENT_SPLIT_REGEX.split(translated.strip())
+    if len(parts) == len(batch):
+        return parts
+
+    logger.warning(f"Batch of {len(batch)} segments came back as {len(parts)}. Translating them one by one...")
+    return [await request(segment) for segment in batch]
+
+async def translate_segments_async(translator, segments, delay, max_chars=DEFAULT_MAX_REQUEST_CHARS, cache=None, concurrency=64, rate_limiter=None, retry_policy=None, circuit_breaker=None, journal=None, skip_failures=False):
+    """
+    Non-blocking version of translate_segments.
+
+    At most concurrency requests are in flight at the same time.
+    """
+    import asyncio
+    unique, positions = dedupe_segments(segments)
+    duplicates = sum(position is not None for position in positions) - len(unique)
+    # Segments are always translated normalized, whether they are repeated or not
+    if duplicates or any(position is not None and segment != unique[position] for segment, position in zip(segments, positions)):
+        if duplicates:
+            metrics.increment('duplicate_segments', duplicates)
+        translated_unique = await translate_segments_async(
+            translator, unique, delay, max_chars=max_chars, cache=cache, concurrency=concurrency,
+            rate_limiter=rate_limiter, retry_policy=retry_policy, circuit_breaker=circuit_breaker, journal=journal,
+            skip_failures=skip_failures
+        )
+        return expand_segments(translated_unique, positions, segments)
+
+    chunks, owners = chunk_segments(segments, max_chars)
+    if len(chunks) > len(segments):
+        translated_chunks = await translate_segments_async(
+            translator, chunks, delay, max_chars=max_chars, cache=cache, concurrency=concurrency,
+            rate_limiter=rate_limiter, retry_policy=retry_policy, circuit_breaker=circuit_breaker, journal=journal,
+            skip_failures=skip_failures
+        )
+        return join_chunks(translated_chunks, owners, len(segments))
+
+    # The cache and the journal are files, which are read and written off the event loop
+    loop = asyncio.get_running_loop()
+    translations, pending, owned, shared = await loop.run_in_executor(None, claim_segments, translator, segments, cache, journal)
+
+    def save(pairs):
+        if cache is not None:
+            cache.set_many(translator, pairs)
+        if journal is not None:
+            journal.record(pairs)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def translate_indices(batch):
+        try:
+            async with semaphore:
+                results = await translate_batch_async(
+                    translator, [segments[i] for i in batch], delay, rate_limiter=rate_limiter,
+                    retry_policy=retry_policy, circuit_breaker=circuit_breaker
+                )
+        except TranslationFailedError as e:
+            if not skip_failures:
+                raise
+            return fail_batch(batch, owned, e)
+        if cache is not None or journal is not None:
+            await loop.run_in_executor(None, save, list(zip([segments[i] for i in batch], results)))
+        for index, result in zip(batch, results):
+            in_flight.resolve(*owned[index], result=result)
+        return results
+
+    batches = pack_segments(pending, max_chars)
+    metrics.increment('segments', sum(1 for segment in segments if segment.strip()))
+    try:
+        # gather keeps the results in the order of the batches
+        for batch, results in zip(batches, await asyncio.gather(*(translate_indices(batch) for batch in batches))):
+            for index, result in zip(batch, results):
+                translations[index] = result
+    except BaseException as e:
+        release_segments(owned, TranslationFailedError(f"Concurrent translation failed: {e}"))
+        raise
+    for index, future in shared.items():
+        try:
+            translations[index] = await asyncio.wrap_future(future)
+        except TranslationFailedError:
+            if not skip_failures:
+                raise
+            translations[index] = None
+    return translations
+
+async def translate_notebook_async(fname, translator, dest_language, delay=10, max_chars=DEFAULT_MAX_REQUEST_CHARS, cache=None, concurrency=64, rate_limiter=None, dest_fname=None, print_translation=False, retry_policy=None, circuit_breaker=None):
+    """
+    Translates a Jupyter Notebook with an AsyncTranslator without blocking the event loop.
+
+    Args:
+        fname (str): Path to the notebook
+        translator (AsyncTranslator): Translator to use
+        dest_language (str): Destination language code, used to name the output file
+        delay (int): Delay between retries in seconds
+        max_chars (int): Maximum number of characters per request
+        cache (TranslationCache): Translation memory, or None to disable it
+        concurrency (int): Maximum number of requests in flight
+        rate_limiter (RateLimiter): Rate limiter, or None to disable it
+        dest_fname (str): Path of the output file (default: <name>_<dest_language>.ipynb)
+        print_translation (bool): Whether to print translations to console
+        retry_policy (RetryPolicy): Retry policy, or None to use delay as base delay
+        circuit_breaker (CircuitBreaker): Circuit breaker shared by all requests, or None to disable it
+
+    Returns:
+        str: Path of the translated notebook
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    notebook = await loop.run_in_executor(None, NotebookDocument, fname)
+    # Parsing and tokenizing the cells takes a while on large notebooks
+    plans, segments = await loop.run_in_executor(None, plan_notebook, notebook.cells)
+
+    translations = await translate_segments_async(
+        translator, segments, delay=delay, max_chars=max_chars, cache=cache,
+        concurrency=concurrency, rate_limiter=rate_limiter,
+        retry_policy=retry_policy, circuit_breaker=circuit_breaker
+    )
+    await loop.run_in_executor(None, lambda: apply_translations(notebook.cells, plans, translations, print_translation=print_translation))
+
+    dest_fname = dest_fname or output_filename(fname, dest_language)
+    try:
+        await loop.run_in_executor(None, notebook.write, f"{dest_fname}.part")
+    finally:
+        notebook.close()
+    await loop.run_in_executor(None, os.replace, f"{dest_fname}.part", dest_fname)
+    return dest_fname
+
+# Key of the metadata recorded by jupyter_translate in translated notebooks and cells
+METADATA_KEY = 'jupyter_translate'
+
+def cell_hash(cell):
+    """
+    Returns the content hash of the source of a cell.
+    """
+    content = cell['cell_type'] + '\0' + ''.join(cell['source'])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def translation_fingerprint(translator_name, src_language, dest_language, endpoint_url=None):
+    """
+    Returns the settings recorded in the metadata of an output, which must match to reuse it.
+    """
+    return {
+        'translator': translator_name.lower(),
+        'source_language': src_language,
+        'target_language': dest_language,
+        # Outputs of a mock server are not reused with the real provider
+        'endpoint_url': endpoint_url,
+    }
+
+def load_previous_translation(dest_fname, fingerprint):
+    """
+    Reads the translation metadata of a previous output of the same notebook.
+
+    Returns a tuple (notebook_sha, sources) where sources maps the hash of each
+    source cell to its translated source, or None if there is no previous output
+    made with the same translator and languages.
+    """
+    if not os.path.exists(dest_fname):
+        return None
+    try:
+        with NotebookDocument(dest_fname) as previous:
+            notebook_metadata = previous.metadata.get(METADATA_KEY, {})
+            cells = previous.cells
+    except (OSError, ValueError):
+        return None
+
+    if {key: notebook_metadata.get(key) for key in fingerprint} != fingerprint:
+        return None
+
+    sources = {}
+    for cell in cells:
+        src_sha = cell['metadata'].get(METADATA_KEY, {}).get('src_sha')
+        if src_sha:
+            sources[src_sha] = cell['source']
+    return notebook_metadata.get('src_sha'), sources
+
+class TranslationJournal:
+    """
+    Append-only log of the segments translated for an output file, so that
+    rerunning an interrupted translation resumes where it stopped.
+
+    The first line records the fingerprint of the translation, and a journal
+    of another translator or other languages is discarded. Each following
+    line holds the hash of a normalized segment and its translation. Lines
+    are written as soon as a request completes, and fsynced at most every
+    sync_interval seconds. A truncated last line, left by a process killed
+    while writing, is ignored.
+
+    Args:
+        path (str): Path of the journal, next to the output file
+        fingerprint (dict): Settings of the translation, see translation_fingerprint
+        sync_interval (float): Maximum seconds between two fsyncs of the journal
+    """
+
+    def __init__(self, path, fingerprint, sync_interval=1.0):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.sync_interval = sync_interval
+        self.entries = {}
+        self._valid_size = 0  # Bytes of the journal that can be appended to, 0 to start over
+        self._file = None
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def key(segment):
+        return hashlib.sha256(normalize_segment(segment).encode('utf-8')).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                lines = f.read().splitlines(keepends=True)
+        except OSError:
+            return
+        if not lines or not lines[0].endswith(b'\n'):
+            return
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return
+        if header != {'fingerprint': self.fingerprint}:
+            return
+        size = len(lines[0])
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line) if line.endswith(b'\n') else None
+            except ValueError:
+                entry = None
+            if entry is None:
+                break  # Cut by a crash
+            self.entries[entry['key']] = entry['translation']
+            size += len(line)
+        self._valid_size = size
+        logger.info(f"Resuming from {self.path}: {len(self.entries)} segments already translated")
+
+    def get(self, segment):
+        return self.entries.get(self.key(segment))
+
+    def record(self, pairs):
+        """
+        Appends (segment, translation) pairs to the journal.
+        """
+        lines = ''.join(
+            json.dumps({'key': self.key(segment), 'translation': translation}, ensure_ascii=False) + '\n'
+            for segment, translation in pairs
+        )
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(lines.encode('utf-8'))
+            # Written lines survive the process being killed, fsync protects them from a system crash
+            self._file.flush()
+            if monotonic() - self._last_sync >= self.sync_interval:
+                os.fsync(self._file.fileno())
+                self._last_sync = monotonic()
+
+    def _open(self):
+        if self._valid_size:
+            self._file = open(self.path, 'r+b')
+            # Drops a line cut by a crash
+            self._file.truncate(self._valid_size)
+            self._file.seek(self._valid_size)
+        else:
+            self._file = open(self.path, 'wb')
+            self._file.write(json.dumps({'fingerprint': self.fingerprint}).encode('utf-8') + b'\n')
+        self._last_sync = monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """
+        Deletes the journal, once the output it was written for is complete.
+        """
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class DeadLetterQueue:
+    """
+    File of the segments left untranslated, one JSON record per line, to be
+    translated again with retry_failures.
+
+    Each record holds the notebook and its output, the index of the cell,
+    the offset of the segment among the segments of the cell, its text, and
+    the fingerprint of the translation. Translating a notebook again only
+    replaces its own records, see discard.
+
+    Args:
+        path (str): Path of the file, only created when a segment fails
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def add(self, records):
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+        # One append per notebook, so that the records of parallel processes don't interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+
+    def read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def replace(self, records):
+        """
+        Rewrites the file with records, deleting it if there are none.
+        """
+        if not records:
+            return self.clear()
+        with open(f"{self.path}.part", 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        os.replace(f"{self.path}.part", self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def records_of(self, notebooks, dest_language):
+        """
+        Returns the records of the notebooks translated into dest_language.
+        """
+        notebooks = {os.path.abspath(notebook) for notebook in notebooks}
+        languages = set(parse_languages(dest_language))
+        return [
+            record for record in self.read()
+            if record['notebook'] in notebooks and record['fingerprint']['target_language'] in languages
+        ]
+
+    def discard(self, notebooks, dest_language):
+        """
+        Removes the records of notebooks that are about to be translated again into dest_language.
+
+        The other records are kept for --retry-failures. Called before translating,
+        from a single process, since the file is rewritten.
+        """
+        discarded = self.records_of(notebooks, dest_language)
+        if discarded:
+            records = self.read()
+            self.replace([record for record in records if record not in discarded])
+
+def untranslated_segments(plans, segments, translations):
+    """
+    Puts the source text back in place of the segments left untranslated (None).
+
+    Returns the (cell_index, offset, text) of each of them, where offset is
+    the position of the segment among the segments of its cell.
+    """
+    untranslated = []
+    for cell_index, start, count, _ in plans:
+        for offset in range(count):
+            if translations[start + offset] is None:
+                translations[start + offset] = segments[start + offset]
+                untranslated.append((cell_index, offset, segments[start + offset]))
+    return untranslated
+
+def parse_languages(dest_language):
+    """
+    Returns the list of destination languages of a code, a comma-separated string of codes or a list.
+    """
+    if isinstance(dest_language, str):
+        return [language.strip() for language in dest_language.split(',') if language.strip()]
+    return list(dest_language)
+
+def select_plans(plans, segments, skip):
+    """
+    Keeps the plans of plan_notebook whose cell index isn't in skip, with their segments.
+    """
+    selected, selected_segments = [], []
+    for i, offset, count, rebuild in plans:
+        if i not in skip:
+            selected.append((i, len(selected_segments), count, rebuild))
+            selected_segments.extend(segments[offset:offset + count])
+    return selected, selected_segments
+
+def jupyter_translate(fname, src_language, dest_language, delay, translator_name, rename_source_file=False, print_translation=False, cache=None, workers=1, rate_limiter=None, translator=None, force=False, retry_policy=None, circuit_breaker=None, endpoint_url=None, dead_letter=None):
+    """
+    Translates a Jupyter Notebook from one language to another.
+
+    If a TranslationCache is given, cached segments are reused instead of being sent to the translator.
+    Requests are sent from a pool of worker threads, throttled by the optional RateLimiter.
+    A translator already built and checked by the caller can be given to skip its initialization.
+    Failed requests are retried following the RetryPolicy, or with delay as base backoff delay,
+    and a CircuitBreaker pauses all workers when the provider keeps failing.
+    The requests go to endpoint_url instead of the provider's URL if given.
+
+    dest_language can also be a list, or a comma-separated string, of several languages. The
+    notebook is then read and its segments extracted once, the languages are translated
+    concurrently, and each one is written to its own output. translator is then a dict of
+    the translators by language, or None to build them.
+
+    The hash of each source cell is recorded in the metadata of the translated cells, so that
+    the next run only translates the cells that changed since the previous output, and doesn't
+    write anything if the notebook didn't change. Use force to translate every cell again.
+
+    Translated segments are appended to a TranslationJournal next to the output until it is
+    written, so that running the same translation again after a failure or a crash resumes it.
+
+    With a DeadLetterQueue, the segments that still fail after their retries are left in the
+    source language and recorded in it instead of failing the notebook. Their cells are not
+    marked as translated, so the next run translates them again. The records of a previous
+    run are not removed here: callers discard them before translating the notebook again.
+
+    Returns:
+        str: Path of the translated notebook, or list of the paths of each language
+    """
+
+    # Check if the necessary parameters are provided
+    dest_languages = parse_languages(dest_language or '')
+    if not fname or not dest_languages:
+        logger.error("Missing required parameters.")
+        logger.error("Usage: python jupyter_translate.py <notebook_file> --source <source_language> --target <destination_language> --translator <translator>")
+        sys.exit(1)
+    if rename_source_file and len(dest_languages) > 1:
+        raise ValueError("The source file can't be renamed when translating into several languages.")
+    if isinstance(translator, dict):
+        translators = dict(translator)
+    elif translator is not None:
+        if len(dest_languages) > 1:
+            raise ValueError("Give a dict of translators by language to translate into several languages.")
+        translators = {dest_languages[0]: translator}
+    else:
+        translators = {}
+
+    with tracer.span(fname, 'notebook'):
+        # Open the notebook file, without decoding its outputs
+        with tracer.span('read'):
+            notebook = NotebookDocument(fname)
+        with notebook:
+            notebook_sha = notebook.sha256()
+            src_shas = [cell_hash(cell) for cell in notebook.cells]
+
+            # Reuse the cells of the previous translation of each language that didn't change
+            outputs, targets = {}, []
+            for language in dest_languages:
+                dest_fname = fname if rename_source_file else output_filename(fname, language)
+                fingerprint = translation_fingerprint(translator_name, src_language, language, endpoint_url)
+                with tracer.span('load previous translation', language=language):
+                    previous = None if rename_source_file or force else load_previous_translation(dest_fname, fingerprint)
+                outputs[language] = dest_fname
+                if previous is not None and previous[0] == notebook_sha:
+                    logger.info(f'{fname} did not change since {dest_fname} was written. Skipping.')
+                    continue
+                previous_sources = previous[1] if previous is not None else {}
+                reused = {i for i, src_sha in enumerate(src_shas) if src_sha in previous_sources}
+                if previous_sources:
+                    logger.info(f"Cells unchanged since the previous {language} translation: {len(reused)}")
+                targets.append(dict(
+                    language=language, dest_fname=dest_fname, fingerprint=fingerprint,
+                    previous_sources=previous_sources, reused=reused
+                ))
+
+            cells = notebook.cells
+            if targets:
+                total_cells = len(cells)
+                code_cells = sum(1 for cell in cells if cell['cell_type'] == 'code')
+                markdown_cells = sum(1 for cell in cells if cell['cell_type'] == 'markdown')
+
+                logger.info(f"Total cells: {total_cells}")
+                logger.info(f"Code cells: {code_cells}")
+                logger.info(f"Markdown cells: {markdown_cells}")
+
+                # Extract the translatable segments of every cell before translating anything,
+                # once for all the languages
+                with tracer.span('plan'):
+                    plans, segments = plan_notebook(cells, skip=set.intersection(*(target['reused'] for target in targets)))
+
+            for target in targets:
+                target['plans'], target['segments'] = select_plans(plans, segments, target['reused'])
+                logger.info(f"Segments to translate into {target['language']}: {len(target['segments'])}")
+                # Initialize the translators, unless ready ones are given
+                if target['segments'] and target['language'] not in translators:
+                    with tracer.span('initialize translator', language=target['language']):
+                        translators[target['language']] = get_translator(
+                            translator_name, src_language, target['language'], endpoint_url=endpoint_url
+                        )
+                        if translator is None and len(translators) == 1:
+                            # The other languages use the same provider
+                            check_translator(translators[target['language']])
+
+            def translate_target(target):
+                # Each language has its own copy of the sources and metadata of the cells
+                target_cells = json.loads(json.dumps(cells))
+                for i, cell in enumerate(target_cells):
+                    if i in target['reused']:
+                        cell['source'] = target['previous_sources'][src_shas[i]]
+                    cell['metadata'][METADATA_KEY] = {'src_sha': src_shas[i]}
+
+                target_plans, target_segments = target['plans'], target['segments']
+                target['journal'] = None
+                if target_segments:
+                    # Translate all segments of the notebook at once, packed into as few requests as possible
+                    max_chars = MAX_REQUEST_CHARS.get(translator_name.lower(), DEFAULT_MAX_REQUEST_CHARS)
+                    journal = target['journal'] = TranslationJournal(f"{target['dest_fname']}.journal", target['fingerprint'])
+                    with tracer.span('translate', segments=len(target_segments), language=target['language']), journal:
+                        translations = translate_segments(
+                            translators[target['language']], target_segments, delay=delay, max_chars=max_chars,
+                            cache=cache, workers=workers, rate_limiter=rate_limiter,
+                            retry_policy=retry_policy, circuit_breaker=circuit_breaker, journal=journal,
+                            skip_failures=dead_letter is not None
+                        )
+                else:
+                    translations = []
+
+                untranslated = target['untranslated'] = untranslated_segments(target_plans, target_segments, translations)
+                target['failed_cells'] = {}
+                for cell_index in {cell_index for cell_index, _, _ in untranslated}:
+                    # A failed cell is translated again on the next run
+                    target_cells[cell_index]['metadata'].pop(METADATA_KEY, None)
+                    target['failed_cells'][cell_index] = src_shas[cell_index]
+
+                # Map the translations back into the cells
+                with tracer.span('apply translations', language=target['language']):
+                    apply_translations(target_cells, target_plans, translations, print_translation=print_translation)
+                metadata = dict(notebook.metadata)
+                metadata[METADATA_KEY] = dict(target['fingerprint'], src_sha=None if untranslated else notebook_sha)
+
+                # Write next to the destination, and move it in place once the source file is closed
+                with tracer.span('write', language=target['language']):
+                    notebook.write(f"{target['dest_fname']}.part", cells=target_cells, metadata=metadata)
+
+            # The languages are translated concurrently, sharing the cache and rate limits
+            errors = []
+            with ThreadPoolExecutor(max_workers=max(1, len(targets))) as executor:
+                futures = [executor.submit(translate_target, target) for target in targets]
+                for target, future in zip(targets, futures):
+                    try:
+                        future.result()
+                        target['done'] = True
+                    except Exception as e:
+                        errors.append(e)
+                        logger.error(f"Failed to translate {fname} into {target['language']}: {e}")
+
+        if rename_source_file and targets and not errors:
+            fname_bk = f"{'.'.join(fname.split('.')[:-1])}_bk.ipynb"  # index.ipynb -> index_bk.ipynb
+
+            os.rename(fname, fname_bk)
+            logger.info(f'{fname} has been renamed as {fname_bk}')
+
+        for target in targets:
+            if not target.get('done'):
+                continue
+            dest_fname = target['dest_fname']
+            os.replace(f"{dest_fname}.part", dest_fname)
+            if target['journal'] is not None:
+                target['journal'].remove()
+            logger.info(f"The {target['language']} translation has been saved as {dest_fname}")
+            if target['untranslated']:
+                dead_letter.add([
+                    {
+                        'notebook': os.path.abspath(fname), 'output': os.path.abspath(dest_fname), 'cell': cell_index, 'offset': offset, 'text': text,
+                        'src_sha': target['failed_cells'][cell_index], 'notebook_sha': notebook_sha, 'fingerprint': target['fingerprint'],
+                    }
+                    for cell_index, offset, text in target['untranslated']
+                ])
+                logger.warning(f"{len(target['untranslated'])} segments of {fname} were left untranslated and recorded in {dead_letter.path}")
+        if errors:
+            raise errors[0]
+        return outputs[dest_languages[0]] if len(dest_languages) == 1 else [outputs[language] for language in dest_languages]
+
+def find_notebooks(directory, recursive=True):
+    """
+    Lists the .ipynb files of a directory, and of its subdirectories if recursive is True.
+    """
+    if not recursive:
+        # Process only files in the current directory
+        return [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith('.ipynb')]
+
+    # Walk through the directory and its subdirectories
+    return [
+        os.path.join(root, file)
+        for root, _, files in os.walk(directory)
+        for file in files
+        if file.endswith('.ipynb')
+    ]
+
+def is_translation_output(fname):
+    """
+    Tells whether a notebook was written by a translation, from the translation metadata it holds.
+    """
+    try:
+        with NotebookDocument(fname) as notebook:
+            return METADATA_KEY in notebook.metadata
+    except (OSError, ValueError):
+        return False  # The translation reports what is wrong with it
+
+def find_source_notebooks(directory, recursive=True):
+    """
+    Lists the notebooks of a directory like find_notebooks, without the outputs of previous translations.
+    """
+    notebooks = []
+    for fname in find_notebooks(directory, recursive):
+        if is_translation_output(fname):
+            logger.info(f"Skipping {fname}, which is the output of a previous translation")
+        else:
+            notebooks.append(fname)
+    return notebooks
+
+# Translator, cache and rate limiter of the current worker process in directory mode
+_worker_state = {}
+
+def _init_worker(translator, cache, rate_limiter, circuit_breaker, log_level=logging.INFO, trace=False):
+    # Processes that are not forked don't inherit the logging configuration
+    logging.basicConfig(level=log_level, format='%(message)s')
+    if trace:
+        tracer.enable()
+    _worker_state['translator'] = translator
+    _worker_state['cache'] = cache
+    _worker_state['rate_limiter'] = rate_limiter
+    _worker_state['circuit_breaker'] = circuit_breaker
+
+def _translate_notebook_job(notebook_path, options):
+    """
+    Translates one notebook in a worker process, returning (notebook_path, error, metrics, trace_events)
+    where metrics is the snapshot of the TranslationMetrics of the job and trace_events its spans.
+    """
+    metrics.reset()
+    try:
+        jupyter_translate(
+            fname=notebook_path,
+            translator=_worker_state.get('translator'),
+            cache=_worker_state.get('cache'),
+            rate_limiter=_worker_state.get('rate_limiter'),
+            circuit_breaker=_worker_state.get('circuit_breaker'),
+            **options
+        )
+        return notebook_path, None, metrics.snapshot(), tracer.take_events()
+    except (Exception, SystemExit) as e:
+        return notebook_path, f"{type(e).__name__}: {e}", metrics.snapshot(), tracer.take_events()
+
+def translate_directory(directory, src_language, dest_language, delay, translator_name, rename_source_file=False, print_translation=False, recursive=True, cache=None, workers=1, rate_limiter=None, jobs=1, force=False, retry_policy=None, circuit_breaker=None, translator=None, endpoint_url=None, dead_letter=None):
+    """
+    Translates all Jupyter Notebooks in a directory.
+    
+    Args:
+        directory (str): Path to the directory containing the notebooks
+        src_language (str): Source language code
+        dest_language (str): Destination language code, or comma-separated codes of several languages
+        delay (int): Delay between API calls to avoid rate limiting
+        translator_name (str): Name of the translator to use
+        rename_source_file (bool): Whether to rename the original file
+        print_translation (bool): Whether to print translations to console
+        recursive (bool): Whether to process subdirectories recursively
+        cache (TranslationCache): Translation memory shared by all notebooks, or None to disable it
+        workers (int): Number of concurrent translation requests
+        rate_limiter (RateLimiter): Rate limiter shared by all notebooks, or None to disable it
+        jobs (int): Number of notebooks translated in parallel processes. With more than one job,
+            the rate limiter should be a SharedRateLimiter so that all processes share its budget.
+        force (bool): Whether to translate every cell again instead of reusing the previous outputs
+        retry_policy (RetryPolicy): Retry policy, or None to use delay as base delay
+        circuit_breaker (CircuitBreaker): Circuit breaker shared by the notebooks of each process, or None to disable it
+        translator: Translator already built and checked, a dict of them by language, or None to build them from translator_name
+        endpoint_url (str): URL the requests are sent to instead of the provider's URL, or None
+        dead_letter (DeadLetterQueue): Queue of the segments left untranslated, or None to fail their notebook.
+            The previous records of the notebooks are discarded first.
+
+    Returns:
+        dict: Error message of each notebook that failed, by path
+    """
+    if not os.path.isdir(directory):
+        logger.error(f"{directory} is not a valid directory")
+        return
+
+    notebooks = find_source_notebooks(directory, recursive)
+    if dead_letter is not None:
+        dead_letter.discard(notebooks, dest_language)
+
+    # The translators are built once for the whole run, and the provider checked once
+    if translator is None:
+        dest_languages = parse_languages(dest_language)
+        translators = {
+            language: get_translator(
+                translator_name, src_language, language,
+                rate_limiter_class=SharedRateLimiter if jobs > 1 else RateLimiter,
+                endpoint_url=endpoint_url
+            )
+            for language in dest_languages
+        }
+        check_translator(translators[dest_languages[0]])
+        translator = translators if len(dest_languages) > 1 else translators[dest_languages[0]]
+
+    options = dict(
+        src_language=src_language,
+        dest_language=dest_language,
+        delay=delay,
+        translator_name=translator_name,
+        rename_source_file=rename_source_file,
+        print_translation=print_translation,
+        workers=workers,
+        force=force,
+        retry_policy=retry_policy,
+        endpoint_url=endpoint_url,
+        dead_letter=dead_letter
+    )
+    failures = {}
+
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(translator, cache, rate_limiter, circuit_breaker, logger.getEffectiveLevel(), tracer.enabled)) as executor:
+            futures = [executor.submit(_translate_notebook_job, notebook_path, options) for notebook_path in notebooks]
+            for future in as_completed(futures):
+                notebook_path, error, job_metrics, trace_events = future.result()
+                metrics.merge(job_metrics)
+                tracer.merge(trace_events)
+                if error:
+                    failures[notebook_path] = error
+                    logger.error(f"\nFailed to translate {notebook_path}: {error}")
+                else:
+                    logger.info(f"\nTranslated {notebook_path}")
+    else:
+        for notebook_path in notebooks:
+            logger.info(f"\nTranslating {notebook_path}...")
+            try:
+                jupyter_translate(
+                    fname=notebook_path, translator=translator, cache=cache,
+                    rate_limiter=rate_limiter, circuit_breaker=circuit_breaker, **options
+                )
+            except (Exception, SystemExit) as e:
+                failures[notebook_path] = f"{type(e).__name__}: {e}"
+                logger.error(f"Failed to translate {notebook_path}: {failures[notebook_path]}")
+
+    translated_files = len(notebooks) - len(failures)
+    logger.info(f"\nTranslation complete! Translated {translated_files} notebook{'s' if translated_files != 1 else ''}.")
+    if failures:
+        logger.error(f"Failed to translate {len(failures)} notebook{'s' if len(failures) != 1 else ''}:")
+        for notebook_path, error in sorted(failures.items()):
+            logger.error(f"  - {notebook_path}: {error}")
+    return failures
+
+class PollingWatcher:
+    """
+    Detects the notebooks of a directory that were created or modified by
+    comparing their modification time and size every interval seconds.
+    """
+
+    def __init__(self, directory, recursive=True, interval=0.5):
+        self.directory = directory
+        self.recursive = recursive
+        self.interval = interval
+        self._stats = self._scan()
+
+    def _scan(self):
+        stats = {}
+        for path in find_notebooks(self.directory, self.recursive):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def wait(self, timeout):
+        """
+        Returns the notebooks changed since the previous call, waiting up to timeout seconds for one.
+        """
+        deadline = monotonic() + timeout
+        while True:
+            stats = self._scan()
+            changed = {path for path, stat in stats.items() if self._stats.get(path) != stat}
+            self._stats = stats
+            remaining = deadline - monotonic()
+            if changed or remaining <= 0:
+                return changed
+            sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """
+    Detects the notebooks of a directory that were written or moved in place
+    with the inotify API of Linux, called through ctypes.
+
+    Raises OSError where inotify isn't available.
+    """
+    # Constants of <sys/inotify.h>
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = 16  # struct inotify_event without its name
+
+    def __init__(self, directory, recursive=True):
+        if not sys.platform.startswith('linux'):
+            raise OSError(f"inotify isn't available on {sys.platform}")
+        import ctypes, ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.directory = directory
+        self.recursive = recursive
+        self.fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise_errno('inotify_init1')
+        self.directories = {}  # Watched directory of each watch descriptor
+        try:
+            self._watch_tree(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _raise_errno(self, call, path=None):
+        errno = self._ctypes.get_errno()
+        raise OSError(errno, f"{call} failed: {os.strerror(errno)}", path)
+
+    def _watch_tree(self, directory):
+        for root, subdirectories, _ in os.walk(directory):
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(root), mask)
+            if wd < 0:
+                self._raise_errno('inotify_add_watch', root)
+            self.directories[wd] = root
+            if not self.recursive:
+                subdirectories.clear()
+
+    def wait(self, timeout):
+        """
+        Returns the notebooks changed since the previous call, waiting up to timeout seconds for one.
+        """
+        import select, struct
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = os.fsdecode(data[offset + self.EVENT_HEADER:offset + self.EVENT_HEADER + length].rstrip(b'\0'))
+            offset += self.EVENT_HEADER + length
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost, so any notebook may have changed
+                changed.update(find_notebooks(self.directory, self.recursive))
+            elif mask & self.IN_IGNORED:
+                self.directories.pop(wd, None)
+            elif wd in self.directories:
+                path = os.path.join(self.directories[wd], name)
+                if not mask & self.IN_ISDIR:
+                    if path.endswith('.ipynb') and mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                        changed.add(path)
+                elif self.recursive:
+                    # The notebooks of a new directory may be written before it is watched
+                    try:
+                        self._watch_tree(path)
+                    except OSError as e:
+                        logger.warning(f"Can't watch {path}: {e}")
+                    changed.update(find_notebooks(path))
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def notebook_watcher(directory, recursive=True, poll_interval=0.5):
+    """
+    Returns an InotifyWatcher of directory, or a PollingWatcher where inotify isn't available.
+    """
+    try:
+        return InotifyWatcher(directory, recursive)
+    except (OSError, AttributeError) as e:  # AttributeError: a C library without inotify
+        logger.info(f"Can't use inotify ({e}), checking {directory} for changes every {poll_interval} seconds")
+        return PollingWatcher(directory, recursive, poll_interval)
+
+def watch(directory, src_language, dest_language, delay, translator_name, recursive=True, cache=None, workers=1, rate_limiter=None, retry_policy=None, circuit_breaker=None, translator=None, endpoint_url=None, dead_letter=None, debounce=0.2, poll_interval=0.5, watcher=None, stop=None):
+    """
+    Translates the notebooks of a directory, then translates each notebook again when it is saved.
+
+    The translators, the cache and the rate limits stay loaded between the
+    saves, and only the cells that changed are translated again. Saves are
+    debounced: a notebook is translated once no more changes came for
+    debounce seconds. Runs until stop is set or the process is interrupted.
+
+    Args:
+        directory (str): Path to the directory containing the notebooks
+        src_language (str): Source language code
+        dest_language (str): Destination language code, or comma-separated codes of several languages
+        delay (int): Base delay of the exponential backoff, unless a RetryPolicy is given
+        translator_name (str): Name of the translator to use
+        recursive (bool): Whether to watch subdirectories
+        cache (TranslationCache): Translation memory, or None to disable it
+        workers (int): Number of concurrent translation requests
+        rate_limiter (RateLimiter): Rate limiter, or None to disable it
+        retry_policy (RetryPolicy): Retry policy, or None to use delay as base delay
+        circuit_breaker (CircuitBreaker): Circuit breaker shared by all requests, or None to disable it
+        translator: Dict of the translators already built by language, or None to build them from translator_name
+        endpoint_url (str): URL the requests are sent to instead of the provider's URL, or None
+        dead_letter (DeadLetterQueue): Queue of the segments left untranslated, or None to fail their notebook
+        debounce (float): Seconds without changes before a saved notebook is translated
+        poll_interval (float): Seconds between two checks of the directory where inotify isn't available
+        watcher: InotifyWatcher or PollingWatcher of the directory, or None to pick one
+        stop (threading.Event): Event that stops watching, or None
+    """
+    dest_languages = parse_languages(dest_language)
+
+    if translator is None:
+        translator = {
+            language: get_translator(translator_name, src_language, language, endpoint_url=endpoint_url)
+            for language in dest_languages
+        }
+        check_translator(translator[dest_languages[0]])
+    watcher = watcher or notebook_watcher(directory, recursive, poll_interval)
+    stop = stop or threading.Event()
+
+    # Bring the outputs up to date before waiting for changes
+    pending = set(find_source_notebooks(directory, recursive))
+    logger.info(f"Watching {directory} for changes, press Ctrl+C to stop")
+    try:
+        while not stop.is_set():
+            if dead_letter is not None:
+                # Each save replaces the records of its notebook instead of adding to them
+                dead_letter.discard(pending, dest_languages)
+            for notebook_path in sorted(pending):
+                if not os.path.exists(notebook_path):
+                    continue
+                try:
+                    jupyter_translate(
+                        fname=notebook_path, src_language=src_language, dest_language=dest_languages, delay=delay,
+                        translator_name=translator_name, cache=cache, workers=workers, rate_limiter=rate_limiter,
+                        translator=translator, retry_policy=retry_policy, circuit_breaker=circuit_breaker,
+                        endpoint_url=endpoint_url, dead_letter=dead_letter
+                    )
+                except Exception as e:
+                    # e.g. a notebook saved in place and read while being written, which the next save fixes
+                    logger.error(f"Failed to translate {notebook_path}: {type(e).__name__}: {e}")
+
+            # Wait in short steps so that stop is noticed
+            changed = watcher.wait(0.5)
+            while changed and not stop.is_set():
+                more = watcher.wait(debounce)
+                if not more:
+                    break
+                changed |= more
+            # The outputs are written next to their notebooks, and must not be translated in turn
+            pending = set()
+            for path in changed:
+                if not os.path.exists(path):
+                    continue
+                if is_translation_output(path):
+                    logger.debug(f"Skipping {path}, which is the output of a previous translation")
+                else:
+                    pending.add(path)
+    except KeyboardInterrupt:
+        logger.info(f"Stopped watching {directory}")
+    finally:
+        watcher.close()
+
+def patch_output(output, patches, pending):
+    """
+    Replaces the untranslated segments of an output notebook by their translations.
+
+    A segment is looked up among the segments of its cell, so a record whose
+    cell was translated again in the meantime is dropped. The cells without
+    pending records are marked as translated again, and so is the notebook
+    when none of its records are pending.
+
+    Args:
+        output (str): Path of the output notebook
+        patches (list): (record, translation) of each translated segment
+        pending (list): Records of the segments of the output still untranslated
+    """
+    if not os.path.exists(output):
+        logger.warning(f"{output} doesn't exist anymore, skipping {len(patches)} segments")
+        return
+    pending_cells = {record['cell'] for record in pending}
+    with NotebookDocument(output) as notebook:
+        cells = notebook.cells
+        for record, translation in patches:
+            cell = cells[record['cell']] if record['cell'] < len(cells) else {}
+            plan = {'markdown': plan_markdown, 'code': plan_code}.get(cell.get('cell_type'))
+            cell_segments, rebuild = plan(''.join(cell['source'])) if plan else ([], None)
+            matches = [i for i, segment in enumerate(cell_segments) if normalize_segment(segment) == normalize_segment(record['text'])]
+            if not matches:
+                logger.warning(f"Segment of cell {record['cell']} of {output} not found, it was probably translated again")
+                continue
+            cell_segments[record['offset'] if record['offset'] in matches else matches[0]] = translation
+            cell['source'] = rebuild(cell_segments).splitlines(True)
+            if record['cell'] not in pending_cells:
+                cell['metadata'][METADATA_KEY] = {'src_sha': record['src_sha']}
+        if not pending:
+            notebook.metadata[METADATA_KEY] = dict(record['fingerprint'], src_sha=record['notebook_sha'])
+        notebook.write(f"{output}.part")
+    os.replace(f"{output}.part", output)
+    logger.info(f"Patched {len(patches)} segments into {output}")
+
+def retry_failures(dead_letter, delay, cache=None, workers=1, rate_limiter=None, retry_policy=None, circuit_breaker=None, translator=None):
+    """
+    Translates the segments of a DeadLetterQueue again, and patches them into their outputs.
+
+    The segments are translated together, in as few requests as possible, with
+    the translator and languages they were recorded with. The segments that
+    fail again are kept in the queue, which is deleted once it is empty.
+
+    Args:
+        dead_letter (DeadLetterQueue): Segments to translate
+        delay (float): Base delay of the exponential backoff, unless a RetryPolicy is given
+        cache (TranslationCache): Translation memory, or None to disable it
+        workers (int): Number of concurrent translation requests
+        rate_limiter (RateLimiter): Rate limiter, or None for the limits of each translator
+        retry_policy (RetryPolicy): Retry policy, or None to use delay as base delay
+        circuit_breaker (CircuitBreaker): Circuit breaker shared by all requests, or None to disable it
+        translator: Translator to use instead of the recorded ones, or None
+
+    Returns:
+        int: Number of segments still untranslated
+    """
+    groups = {}
+    for record in dead_letter.read():
+        groups.setdefault(json.dumps(record['fingerprint'], sort_keys=True), []).append(record)
+
+    patches, pending = {}, []
+    for records in groups.values():
+        fingerprint = records[0]['fingerprint']
+        logger.info(f"Retrying {len(records)} segments translated with {fingerprint['translator']} to {fingerprint['target_language']}")
+        group_translator = translator or get_translator(
+            fingerprint['translator'], fingerprint['source_language'], fingerprint['target_language'],
+            endpoint_url=fingerprint['endpoint_url']
+        )
+        translations = translate_segments(
+            group_translator, [record['text'] for record in records], delay,
+            max_chars=MAX_REQUEST_CHARS.get(fingerprint['translator'], DEFAULT_MAX_REQUEST_CHARS), cache=cache,
+            workers=workers, rate_limiter=rate_limiter or RateLimiter.for_translator(fingerprint['translator']),
+            retry_policy=retry_policy, circuit_breaker=circuit_breaker, skip_failures=True
+        )
+        for record, translation in zip(records, translations):
+            if translation is None:
+                pending.append(record)
+            else:
+                patches.setdefault(record['output'], []).append((record, translation))
+
+    for output, output_patches in patches.items():
+        patch_output(output, output_patches, [record for record in pending if record['output'] == output])
+    dead_letter.replace(pending)
+    return len(pending)
+
+XLIFF_NAMESPACE = 'urn:oasis:names:tc:xliff:document:1.2'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+def is_xliff(path):
+    return path.lower().endswith(('.xlf', '.xliff'))
+
+def extract_segments(notebooks, root):
+    """
+    Lists the translatable segments of notebooks, to be translated offline and merged with merge_segments.
+
+    Each record holds a stable id, the path of the notebook relative to root
+    with / separators, the index of the cell, the offset of the segment among
+    the segments of its cell, the hash of the source cell and its text under
+    'source'. Blank segments are left out, and so are the notebooks that are
+    outputs of a translation.
+    """
+    records = []
+    for fname in notebooks:
+        notebook_path = os.path.relpath(fname, root).replace(os.sep, '/')
+        with NotebookDocument(fname) as notebook:
+            if METADATA_KEY in notebook.metadata:
+                logger.info(f"Skipping {fname}, which is a translation")
+                continue
+            cells = notebook.cells
+            plans, segments = plan_notebook(cells)
+        for i, start, count, _ in plans:
+            src_sha = cell_hash(cells[i])
+            for offset, segment in enumerate(segments[start:start + count]):
+                if segment.strip():
+                    records.append({
+                        'id': f"{notebook_path}#{i}.{offset}", 'notebook': notebook_path,
+                        'cell': i, 'offset': offset, 'src_sha': src_sha, 'source': segment,
+                    })
+        logger.info(f"Extracted the segments of {fname}")
+    return records
+
+def write_segment_file(path, records, src_language, dest_language=None):
+    """
+    Writes segment records to a JSONL file, or to an XLIFF 1.2 file if path ends with .xlf or .xliff.
+
+    The XLIFF file has a <file> element for each notebook, with a trans-unit
+    for each segment, identified by its cell and offset.
+    """
+    if not is_xliff(path):
+        with open(f"{path}.part", 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        os.replace(f"{path}.part", path)
+        return
+
+    from xml.etree import ElementTree
+    ElementTree.register_namespace('', XLIFF_NAMESPACE)
+    tag = lambda name: f'{{{XLIFF_NAMESPACE}}}{name}'
+    root = ElementTree.Element(tag('xliff'), version='1.2')
+    bodies = {}
+    for record in records:
+        if record['notebook'] not in bodies:
+            attributes = {'original': record['notebook'], 'source-language': src_language, 'datatype': 'plaintext'}
+            if dest_language:
+                attributes['target-language'] = dest_language
+            bodies[record['notebook']] = ElementTree.SubElement(ElementTree.SubElement(root, tag('file'), attributes), tag('body'))
+        unit = ElementTree.SubElement(bodies[record['notebook']], tag('trans-unit'), {'id': f"{record['cell']}.{record['offset']}", XML_SPACE: 'preserve'})
+        ElementTree.SubElement(unit, tag('source')).text = record['source']
+        if record.get('target'):
+            ElementTree.SubElement(unit, tag('target')).text = record['target']
+        # The hash of the source cell tells merge_segments whether it changed since the extraction
+        context_group = ElementTree.SubElement(unit, tag('context-group'), purpose='location')
+        ElementTree.SubElement(context_group, tag('context'), {'context-type': 'x-cell-sha'}).text = record['src_sha']
+    tree = ElementTree.ElementTree(root)
+    if hasattr(ElementTree, 'indent'):  # Python 3.9+
+        ElementTree.indent(tree)
+    tree.write(f"{path}.part", encoding='utf-8', xml_declaration=True)
+    os.replace(f"{path}.part", path)
+
+def read_segment_file(path):
+    """
+    Reads the segment records of a JSONL or XLIFF file, with their translation under 'target'.
+    """
+    if not is_xliff(path):
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    from xml.etree import ElementTree
+    tag = lambda name: f'{{{XLIFF_NAMESPACE}}}{name}'
+    records = []
+    for file in ElementTree.parse(path).getroot().iter(tag('file')):
+        for unit in file.iter(tag('trans-unit')):
+            cell, offset = (int(part) for part in unit.get('id').split('.'))
+            target = unit.find(tag('target'))
+            src_sha = unit.find(f"{tag('context-group')}/{tag('context')}[@context-type='x-cell-sha']")
+            records.append({
+                'id': f"{file.get('original')}#{cell}.{offset}", 'notebook': file.get('original'),
+                'cell': cell, 'offset': offset, 'src_sha': src_sha.text if src_sha is not None else None,
+                'source': ''.join(unit.find(tag('source')).itertext()),
+                # Translation tools may wrap parts of the text in inline elements
+                'target': ''.join(target.itertext()) if target is not None else None,
+            })
+    return records
+
+def merge_notebook(fname, records, fingerprint, print_translation=False):
+    """
+    Writes the translation of a notebook from the translated segment records of extract_segments.
+
+    A record is applied to its cell if the cell didn't change since the extraction,
+    or else to the cells with the same source, e.g. when cells were inserted before it.
+    The segments without translation are left in the source language, and their
+    cells are not marked as translated, so that a later run translates them.
+
+    Returns:
+        int: Number of segments left untranslated
+    """
+    dest_fname = output_filename(fname, fingerprint['target_language'])
+    with NotebookDocument(fname) as notebook:
+        notebook_sha = notebook.sha256()
+        cells = notebook.cells
+        src_shas = [cell_hash(cell) for cell in cells]
+        plans, segments = plan_notebook(cells)
+        starts = {i: (start, count) for i, start, count, _ in plans}
+        cells_by_sha = {}
+        for i, src_sha in enumerate(src_shas):
+            cells_by_sha.setdefault(src_sha, []).append(i)
+
+        translations = [None if segment.strip() else segment for segment in segments]
+        stale = 0
+        for record in records:
+            if not record.get('target'):
+                continue
+            if record['cell'] < len(cells) and src_shas[record['cell']] == record['src_sha']:
+                cell_indexes = [record['cell']]
+            else:
+                cell_indexes = cells_by_sha.get(record['src_sha'], [])
+            stale += not cell_indexes
+            for i in cell_indexes:
+                start, count = starts.get(i, (0, 0))
+                if record['offset'] < count:
+                    translations[start + record['offset']] = record['target']
+        if stale:
+            logger.warning(f"{stale} segments of {fname} were not merged, their cells changed since the extraction")
+
+        untranslated = untranslated_segments(plans, segments, translations)
+        failed_cells = {cell_index for cell_index, _, _ in untranslated}
+        for i, cell in enumerate(cells):
+            if i not in failed_cells:
+                cell['metadata'][METADATA_KEY] = {'src_sha': src_shas[i]}
+        apply_translations(cells, plans, translations, print_translation=print_translation)
+        notebook.metadata[METADATA_KEY] = dict(fingerprint, src_sha=None if untranslated else notebook_sha)
+        notebook.write(f"{dest_fname}.part")
+    os.replace(f"{dest_fname}.part", dest_fname)
+    logger.info(f"The translation has been saved as {dest_fname}")
+    if untranslated:
+        logger.warning(f"{len(untranslated)} segments of {fname} have no translation and were left in the source language")
+    return len(untranslated)
+
+def merge_segments(records, root, src_language, dest_language, print_translation=False):
+    """
+    Writes the translation of each notebook of the segment records, relative to root.
+
+    The outputs are recorded as made by the 'merge' translator, so they are
+    not reused by the incremental runs of a provider.
+
+    Returns:
+        int: Number of segments left untranslated
+    """
+    fingerprint = translation_fingerprint('merge', src_language, dest_language)
+    notebooks = {}
+    for record in records:
+        notebooks.setdefault(record['notebook'], []).append(record)
+
+    untranslated = 0
+    for notebook_path, notebook_records in notebooks.items():
+        fname = os.path.join(root, *notebook_path.split('/'))
+        if not os.path.exists(fname):
+            logger.warning(f"{fname} doesn't exist anymore, skipping {len(notebook_records)} segments")
+            continue
+        untranslated += merge_notebook(fname, notebook_records, fingerprint, print_translation)
+    return untranslated
+
+# Rough latency of a provider request in seconds, to estimate the duration of a run
+ESTIMATED_REQUEST_SECONDS = 1.0
+
+def estimate_notebook(fname, translator, fingerprint, dest_language, max_chars=DEFAULT_MAX_REQUEST_CHARS, cache=None, force=False):
+    """
+    Runs the extraction of a notebook without translating anything.
+
+    Returns a dict with the number of segments and characters to translate,
+    the segments found in the cache, and the requests and characters that
+    would be sent to the provider. Cells unchanged since the previous output
+    are not counted, unless force is True.
+    """
+    dest_fname = output_filename(fname, dest_language)
+    with NotebookDocument(fname) as notebook:
+        previous = None if force else load_previous_translation(dest_fname, fingerprint)
+        if previous is not None and previous[0] == notebook.sha256():
+            reused = set(range(len(notebook.cells)))
+        else:
+            previous_sources = previous[1] if previous is not None else {}
+            reused = {i for i, cell in enumerate(notebook.cells) if cell_hash(cell) in previous_sources}
+        _, segments = plan_notebook(notebook.cells, skip=reused)
+
+    segments = [segment for segment in segments if segment.strip()]
+    # Identical segments are only sent once
+    unique = dedupe_segments(segments)[0]
+    pending = [segment for segment in unique if cache is None or not cache.contains(translator, segment)]
+    # Long segments are sent in chunks, and the chunks packed into batches
+    chunks = [chunk for chunk in chunk_segments(pending, max_chars)[0] if chunk.strip()]
+    batches = pack_segments(chunks, max_chars)
+    return {
+        'notebook': fname,
+        'reused_cells': len(reused),
+        'segments': len(segments),
+        'chars': sum(len(segment) for segment in segments),
+        'duplicates': len(segments) - len(unique),
+        'cache_hits': len(unique) - len(pending),
+        'requests': len(batches),
+        'chars_to_send': sum(len(SEGMENT_DELIMITER.join(chunks[i] for i in batch)) for batch in batches),
+    }
+
+def estimate_duration(requests, chars, rate_limiter=None, translator=None, concurrency=1):
+    """
+    Estimates how long sending requests with chars characters takes, in seconds.
+
+    The estimate is bound by the rate limits, or by the rate limits of the
+    backends of a RoutingTranslator, and by ESTIMATED_REQUEST_SECONDS per
+    request spread over concurrency workers.
+    """
+    limiters = [rate_limiter] if rate_limiter is not None else []
+    if not any(limiter.requests or limiter.chars for limiter in limiters) and isinstance(translator, RoutingTranslator):
+        limiters = [backend.rate_limiter for backend in translator.backends if backend.rate_limiter is not None]
+
+    def total_rate(bucket_name):
+        buckets = [getattr(limiter, bucket_name) for limiter in limiters]
+        if not buckets or any(bucket is None for bucket in buckets):
+            return None  # At least one path is unlimited
+        return sum(bucket.rate for bucket in buckets)
+
+    duration = requests * ESTIMATED_REQUEST_SECONDS / max(1, concurrency)
+    requests_rate = total_rate('requests')
+    if requests_rate:
+        duration = max(duration, requests / requests_rate)
+    chars_rate = total_rate('chars')
+    if chars_rate:
+        duration = max(duration, chars / chars_rate)
+    return duration
+
+def dry_run(notebooks, src_language, dest_language, translator_name, cache=None, rate_limiter=None, workers=1, jobs=1, force=False, endpoint_url=None):
+    """
+    Reports what translating the notebooks would cost, without any network call.
+
+    Prints the segments, characters, duplicates, cache hits and requests of each notebook
+    and in total, with the estimated duration under the rate limits. With several destination
+    languages, each notebook has a row for each language.
+
+    Returns:
+        dict: Totals of the estimate, with the estimates of each notebook under 'notebooks'
+    """
+    dest_languages = parse_languages(dest_language)
+    max_chars = MAX_REQUEST_CHARS.get(translator_name.lower(), DEFAULT_MAX_REQUEST_CHARS)
+
+    estimates = []
+    for language in dest_languages:
+        # Only the cache keys of the translator are needed, so its backend isn't even imported
+        translator = get_translator(translator_name, src_language, language, endpoint_url=endpoint_url, key_only=True)
+        fingerprint = translation_fingerprint(translator_name, src_language, language, endpoint_url)
+        for fname in notebooks:
+            try:
+                estimate = estimate_notebook(fname, translator, fingerprint, language, max_chars, cache, force)
+            except (OSError, ValueError) as e:
+                logger.error(f"Can't read {fname}: {e}")
+                continue
+            if len(dest_languages) > 1:
+                estimate['notebook'] = f"{fname} ({language})"
+            estimates.append(estimate)
+
+    columns = ('segments', 'chars', 'duplicates', 'cache_hits', 'requests', 'chars_to_send')
+    totals = {column: sum(estimate[column] for estimate in estimates) for column in columns}
+    totals['estimated_seconds'] = round(estimate_duration(
+        totals['requests'], totals['chars_to_send'], rate_limiter, translator, concurrency=workers * jobs
+    ), 1)
+    totals['notebooks'] = estimates
+
+    width = max([len('Total')] + [len(estimate['notebook']) for estimate in estimates])
+    print(f"{'Notebook'.ljust(width)}  " + '  '.join(f'{column:>13}' for column in columns))
+    for row in estimates + [dict(totals, notebook='Total')]:
+        print(f"{row['notebook'].ljust(width)}  " + '  '.join(f'{row[column]:>13}' for column in columns))
+    print(f"Estimated time: {totals['estimated_seconds']:.0f} seconds with the configured rate limits")
+    return totals
+
+# Map common language names to ISO codes if full names are provided
+LANGUAGE_NAMES = {
+    'english': 'en',
+    'portuguese': 'pt',
+    'spanish': 'es',
+    'french': 'fr',
+    'german': 'de',
+    'italian': 'it',
+    'dutch': 'nl',
+    'chinese': 'zh-CN',
+    'japanese': 'ja',
+    'korean': 'ko',
+    'russian': 'ru',
+    'arabic': 'ar'
+}
+
+def segment_file_main(command, argv):
+    """
+    Runs the extract and merge commands, which translate notebooks offline through a segment file.
+    """
+    extract = command == 'extract'
+    parser = argparse.ArgumentParser(
+        prog=f"jupyter_translate {command}",
+        description="Write the segments of notebooks to a JSONL or XLIFF file, to translate them offline." if extract
+        else "Write the translations of a JSONL or XLIFF file of segments into the translated notebooks."
+    )
+    parser.add_argument('fname', help="Path to the Jupyter Notebook file or directory containing notebooks")
+    parser.add_argument('segment_file', help="JSONL file of the segments, or XLIFF file if its name ends with .xlf or .xliff")
+    parser.add_argument('--source', default='auto', help="Source language code (default: auto-detect)")
+    parser.add_argument('--target', required=not extract, help="Destination language code" + (", recorded in the XLIFF file" if extract else ""))
+    if extract:
+        parser.add_argument('--no-recursive', dest='recursive', action='store_false', help="Don't extract the notebooks of subdirectories")
+    else:
+        parser.add_argument('--print', dest='print_translation', action='store_true', help="Print translations to console")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], type=str.upper, help="Minimum level of the messages shown (default: INFO)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(message)s')
+
+    src_language = LANGUAGE_NAMES.get(args.source.lower(), args.source.lower())
+    dest_language = LANGUAGE_NAMES.get(args.target.lower(), args.target.lower()) if args.target else None
+    # The notebooks are identified by their path relative to the directory, which can move between the commands
+    root = args.fname if os.path.isdir(args.fname) else os.path.dirname(args.fname) or '.'
+
+    if extract:
+        notebooks = find_notebooks(args.fname, args.recursive) if os.path.isdir(args.fname) else [args.fname]
+        records = extract_segments(notebooks, root)
+        write_segment_file(args.segment_file, records, src_language, dest_language)
+        logger.info(f"{len(records)} segments written to {args.segment_file}")
+        return
+
+    records = read_segment_file(args.segment_file)
+    if not os.path.isdir(args.fname):
+        records = [record for record in records if record['notebook'] == os.path.basename(args.fname)]
+    untranslated = merge_segments(records, root, src_language, dest_language, args.print_translation)
+    if untranslated:
+        logger.warning(f"{untranslated} segments had no translation in {args.segment_file} and were left in the source language")
+
+# Main function to parse arguments and run the translation
+def main():
+    if sys.argv[1:2] in (['extract'], ['merge']):
+        return segment_file_main(sys.argv[1], sys.argv[2:])
+    # `jupyter_translate watch DIR` takes the options of a translation
+    watch_mode = sys.argv[1:2] == ['watch']
+
+    parser = argparse.ArgumentParser(
+        description="Translate a Jupyter Notebook from one language to another.",
+        epilog="Use 'jupyter_translate extract' and 'jupyter_translate merge' to translate the segments offline through a JSONL or XLIFF file, "
+               "and 'jupyter_translate watch DIR --target LANG' to translate the notebooks of a directory again each time they are saved."
+    )
+    parser.add_argument('fname', nargs='?', help="Path to the Jupyter Notebook file or directory containing notebooks")
+    parser.add_argument('--source', default='auto', help="Source language code (default: auto-detect)")
+    parser.add_argument('--target', help="Destination language code, or comma-separated codes to translate into several languages at once")
+    parser.add_argument('--delay', type=float, default=1, help="Base delay of the exponential backoff between retries in seconds (default: 1)")
+    parser.add_argument('--max-delay', type=float, default=60, help="Maximum delay between retries in seconds (default: 60)")
+    parser.add_argument('--retries', type=int, default=3, help="Maximum number of attempts for each request (default: 3)")
+    parser.add_argument('--translator', default='google', help="Translator to use (options: google or mymemory), or a comma-separated list to spread the requests across several translators. Default: google")
+    parser.add_argument('--rename', action='store_true', help="Rename the original file after translation")
+    parser.add_argument('--print', dest='print_translation', action='store_true', help="Print translations to console")
+    parser.add_argument('--directory', action='store_true', help="Process all .ipynb files in the specified directory")
+    parser.add_argument('--no-recursive', dest='recursive', action='store_false', help="Don't process subdirectories when using --directory")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f"Directory of the translation cache (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help="Don't read or write the translation cache")
+    parser.add_argument('--workers', type=int, default=1, help="Number of concurrent translation requests (default: 1)")
+    parser.add_argument('--requests-per-second', type=float, help="Maximum requests per second sent to the translator (default: provider limit)")
+    parser.add_argument('--chars-per-minute', type=int, help="Maximum characters per minute sent to the translator (default: provider limit)")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of notebooks translated in parallel processes when translating a directory (default: 1)")
+    parser.add_argument('--force', action='store_true', help="Translate every cell again instead of only the cells changed since the previous translation")
+    parser.add_argument('--dry-run', action='store_true', help="Report the segments, characters, cache hits, requests and estimated time of the translation without translating anything")
+    parser.add_argument('--dead-letter', default=DEFAULT_DEAD_LETTER, help=f"File listing the segments left untranslated after their retries. Each run only replaces the records of the notebooks it translates (default: {DEFAULT_DEAD_LETTER})")
+    parser.add_argument('--retry-failures', metavar='FILE', help="Translate the segments listed in this file again and patch them into their outputs, instead of translating notebooks")
+    parser.add_argument('--debounce', type=float, default=0.2, help="With watch, seconds without changes before a saved notebook is translated (default: 0.2)")
+    parser.add_argument('--poll-interval', type=float, default=0.5, help="With watch, seconds between two checks of the directory where inotify isn't available (default: 0.5)")
+    parser.add_argument('--endpoint-url', help="Send the requests to this URL instead of the translator's, e.g. a local mock server")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], type=str.upper, help="Minimum level of the messages shown (default: INFO)")
+    parser.add_argument('--trace', help="Record the time spent in each phase, notebook, cell and request as a Chrome trace (Perfetto, speedscope) in this file")
+    parser.add_argument('--metrics-out', help="Write a JSON summary of the requests, characters sent, cache hits, retries and latencies to this file")
+    parser.set_defaults(recursive=True)
+
+    args = parser.parse_args(sys.argv[2:] if watch_mode else None)
+    if not args.retry_failures and not (args.fname and args.target):
+        parser.error("the fname and --target arguments are required, unless --retry-failures is used")
+    if watch_mode and (args.retry_failures or args.dry_run or args.rename or not os.path.isdir(args.fname)):
+        parser.error("watch needs a directory, and can't be used with --retry-failures, --dry-run or --rename")
+    logging.basicConfig(level=args.log_level, format='%(message)s')
+    if args.trace:
+        tracer.enable()
+
+    # Convert source and target languages to ISO codes if they are full names
+    src_language = LANGUAGE_NAMES.get(args.source.lower(), args.source.lower())
+
+    dest_languages = [LANGUAGE_NAMES.get(language, language) for language in parse_languages((args.target or '').lower())]
+    dest_language = ','.join(dest_languages)
+    if args.rename and len(dest_languages) > 1:
+        parser.error("--rename can't be used with several target languages")
+
+    if not args.retry_failures:
+        logger.info(f"Using source language code: {src_language}, target language code: {dest_language}")
+
+    cache = TranslationCache(args.cache_dir) if args.use_cache else None
+    # Parallel processes must share the same rate limit budget
+    rate_limiter_class = SharedRateLimiter if args.jobs > 1 else RateLimiter
+    rate_limiter = rate_limiter_class.for_translator(args.translator, args.requests_per_second, args.chars_per_minute)
+    retry_policy = RetryPolicy(retries=args.retries, base_delay=args.delay, max_delay=args.max_delay)
+    circuit_breaker = CircuitBreaker(cooldown=args.max_delay)
+
+    dead_letter = DeadLetterQueue(args.dead_letter)
+
+    # Check if we're processing a directory or a single file
+    if args.retry_failures:
+        # The languages and translator of each segment were recorded with it
+        explicit_limits = args.requests_per_second is not None or args.chars_per_minute is not None
+        remaining = retry_failures(
+            DeadLetterQueue(args.retry_failures), delay=args.delay, cache=cache, workers=args.workers,
+            rate_limiter=rate_limiter if explicit_limits else None, retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker
+        )
+        if remaining:
+            logger.warning(f"{remaining} segments are still untranslated, they were kept in {args.retry_failures}")
+    elif watch_mode:
+        watch(
+            args.fname, src_language, dest_language, delay=args.delay, translator_name=args.translator,
+            recursive=args.recursive, cache=cache, workers=args.workers, rate_limiter=rate_limiter,
+            retry_policy=retry_policy, circuit_breaker=circuit_breaker, endpoint_url=args.endpoint_url,
+            dead_letter=dead_letter, debounce=args.debounce, poll_interval=args.poll_interval
+        )
+    elif args.dry_run:
+        is_directory = args.directory or os.path.isdir(args.fname)
+        dry_run(
+            find_source_notebooks(args.fname, args.recursive) if is_directory else [args.fname],
+            src_language, dest_language, args.translator, cache=cache, rate_limiter=rate_limiter,
+            workers=args.workers, jobs=args.jobs if is_directory else 1, force=args.force or args.rename,
+            endpoint_url=args.endpoint_url
+        )
+    elif args.directory or os.path.isdir(args.fname):
+        translate_directory(
+            directory=args.fname,
+            src_language=src_language,
+            dest_language=dest_language,
+            delay=args.delay,
+            translator_name=args.translator,
+            rename_source_file=args.rename,
+            print_translation=args.print_translation,
+            recursive=args.recursive,
+            cache=cache,
+            workers=args.workers,
+            rate_limiter=rate_limiter,
+            jobs=args.jobs,
+            force=args.force,
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker,
+            endpoint_url=args.endpoint_url,
+            dead_letter=dead_letter
+        )
+    else:
+        dead_letter.discard([args.fname], dest_language)
+        jupyter_translate(
+            fname=args.fname,
+            src_language=src_language,
+            dest_language=dest_language,
+            delay=args.delay,
+            translator_name=args.translator,
+            rename_source_file=args.rename,
+            print_translation=args.print_translation,
+            cache=cache,
+            workers=args.workers,
+            rate_limiter=rate_limiter,
+            force=args.force,
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker,
+            endpoint_url=args.endpoint_url,
+            dead_letter=dead_letter
+        )
+
+    failed_segments = 0
+    if not (args.retry_failures or args.dry_run or watch_mode):
+        is_directory = args.directory or os.path.isdir(args.fname)
+        notebooks = find_source_notebooks(args.fname, args.recursive) if is_directory else [args.fname]
+        failed_segments = len(dead_letter.records_of(notebooks, dest_language))
+    if failed_segments:
+        logger.warning(
+            f"{failed_segments} segments were left in the source language, see {args.dead_letter}. "
+            f"Translate them again with: jupyter_translate --retry-failures {args.dead_letter}"
+        )
+
+    if cache is not None:
+        logger.info(f"Translation cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+
+    if args.metrics_out:
+        metrics.write(args.metrics_out)
+        logger.info(f"Metrics saved as {args.metrics_out}")
+
+    if args.trace:
+        tracer.write(args.trace)
+        logger.info(f"Trace saved as {args.trace}")
+
+if __name__ == '__main__':
+    main()
+
+
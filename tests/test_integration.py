@@ -4,6 +4,7 @@ import os
 import json
 import tempfile
 import shutil
+import threading
 from unittest.mock import patch, MagicMock
 
 # Add the parent directory to the path so we can import jupyter_translate
@@ -150,6 +151,392 @@ class TestJupyterTranslateIntegration:
             # No need to check for a real file
             assert True
     
+    def test_notebook_translation_is_batched(self, sample_notebook):
+        """Test that all segments of a notebook are sent in a single request"""
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+
+        with patch('jupyter_translate.get_translator', return_value=mock_translator):
+            jupyter_translate.jupyter_translate(
+                fname=sample_notebook,
+                src_language='en',
+                dest_language='pt',
+                delay=0,
+                translator_name='google',
+            )
+
+        # One call for the translator test and one for the whole notebook
+        assert mock_translator.translate.call_count == 2
+
+        output_path = sample_notebook.replace('.ipynb', '_pt.ipynb')
+        with open(output_path, encoding='utf-8') as f:
+            cells = json.load(f)['cells']
+        assert ''.join(cells[0]['source']) == '# SAMPLE NOTEBOOKTHIS IS A TEST NOTEBOOK.'
+        assert cells[1]['source'] == ['# THIS IS A CODE COMMENT\n', "print('HELLO, WORLD!')"]
+
+    def test_incremental_translation(self, sample_notebook):
+        """Test that only the cells changed since the previous output are translated"""
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        options = dict(src_language='en', dest_language='pt', delay=0, translator_name='google',
+                       translator=mock_translator)
+        output_path = sample_notebook.replace('.ipynb', '_pt.ipynb')
+
+        jupyter_translate.jupyter_translate(fname=sample_notebook, **options)
+        assert mock_translator.translate.call_count == 1
+        with open(output_path, encoding='utf-8') as f:
+            output = json.load(f)
+        assert output['metadata']['jupyter_translate']['target_language'] == 'pt'
+        assert output['cells'][0]['metadata']['jupyter_translate']['src_sha']
+
+        # Nothing changed: the output is not written again
+        mtime = os.path.getmtime(output_path)
+        os.utime(output_path, (mtime - 10, mtime - 10))
+        jupyter_translate.jupyter_translate(fname=sample_notebook, **options)
+        assert mock_translator.translate.call_count == 1
+        assert os.path.getmtime(output_path) == mtime - 10
+
+        # Only the edited cell is sent to the translator
+        with open(sample_notebook, encoding='utf-8') as f:
+            notebook = json.load(f)
+        notebook['cells'][0]['source'] = ['Edited text']
+        with open(sample_notebook, 'w', encoding='utf-8') as f:
+            json.dump(notebook, f)
+        jupyter_translate.jupyter_translate(fname=sample_notebook, **options)
+        mock_translator.translate.assert_called_with('Edited text')
+        assert mock_translator.translate.call_count == 2
+        with open(output_path, encoding='utf-8') as f:
+            cells = json.load(f)['cells']
+        assert cells[0]['source'] == ['EDITED TEXT']
+        assert cells[1]['source'] == ['# THIS IS A CODE COMMENT\n', "print('HELLO, WORLD!')"]
+
+    def test_interrupted_translation_resumes_from_journal(self, sample_notebook):
+        """Test that rerunning a failed translation only sends the segments that weren't translated"""
+        def translate(text):
+            if 'Hello' in text:
+                raise ValueError('Connection reset')
+            return text.upper()
+
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = translate
+        options = dict(src_language='en', dest_language='pt', delay=0, translator_name='google',
+                       translator=mock_translator, retry_policy=jupyter_translate.RetryPolicy(retries=1, base_delay=0))
+        output_path = sample_notebook.replace('.ipynb', '_pt.ipynb')
+
+        # One request per segment
+        with patch.dict(jupyter_translate.MAX_REQUEST_CHARS, {'google': 30}):
+            with pytest.raises(jupyter_translate.TranslationFailedError):
+                jupyter_translate.jupyter_translate(fname=sample_notebook, **options)
+            assert not os.path.exists(output_path)
+            assert os.path.exists(output_path + '.journal')
+
+            mock_translator.reset_mock()
+            mock_translator.translate.side_effect = lambda text: text.upper()
+            jupyter_translate.jupyter_translate(fname=sample_notebook, **options)
+
+        mock_translator.translate.assert_called_once_with('Hello, world!')
+        assert not os.path.exists(output_path + '.journal')
+        with open(output_path, encoding='utf-8') as f:
+            cells = json.load(f)['cells']
+        assert ''.join(cells[0]['source']) == '# SAMPLE NOTEBOOKTHIS IS A TEST NOTEBOOK.'
+        assert cells[1]['source'] == ['# THIS IS A CODE COMMENT\n', "print('HELLO, WORLD!')"]
+
+    def test_failed_segments_are_retried_from_dead_letter_file(self, sample_notebook, tmp_path):
+        """Test that failed segments are left untranslated, recorded, and patched in by --retry-failures"""
+        def translate(text):
+            if 'Hello' in text:
+                raise ValueError('Connection reset')
+            return text.upper()
+
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = translate
+        dead_letter = jupyter_translate.DeadLetterQueue(str(tmp_path / 'failures.jsonl'))
+        options = dict(src_language='en', dest_language='pt', delay=0, translator_name='google', translator=mock_translator,
+                       retry_policy=jupyter_translate.RetryPolicy(retries=1, base_delay=0), dead_letter=dead_letter)
+        output_path = sample_notebook.replace('.ipynb', '_pt.ipynb')
+
+        with patch.dict(jupyter_translate.MAX_REQUEST_CHARS, {'google': 30}):
+            jupyter_translate.jupyter_translate(fname=sample_notebook, **options)
+
+        with open(output_path, encoding='utf-8') as f:
+            output = json.load(f)
+        assert output['cells'][1]['source'] == ['# THIS IS A CODE COMMENT\n', "print('Hello, world!')"]
+        assert 'jupyter_translate' not in output['cells'][1].get('metadata', {})
+        assert output['metadata']['jupyter_translate']['src_sha'] is None
+        [record] = dead_letter.read()
+        assert (record['output'], record['cell'], record['offset'], record['text']) == (os.path.abspath(output_path), 1, 1, 'Hello, world!')
+
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        assert jupyter_translate.retry_failures(dead_letter, delay=0, translator=mock_translator) == 0
+
+        mock_translator.translate.assert_called_with('Hello, world!')
+        assert not os.path.exists(dead_letter.path)
+        with open(output_path, encoding='utf-8') as f:
+            output = json.load(f)
+        assert output['cells'][1]['source'] == ['# THIS IS A CODE COMMENT\n', "print('HELLO, WORLD!')"]
+        # The notebook is complete again, so the next run has nothing to do
+        calls = mock_translator.translate.call_count
+        jupyter_translate.jupyter_translate(fname=sample_notebook, **options)
+        assert mock_translator.translate.call_count == calls
+
+    def test_cell_with_several_failed_segments_is_recorded_once_per_segment(self, tmp_path):
+        """Test that a cell whose segments all fail is written untranslated, with a record for each segment"""
+        fname = str(tmp_path / 'comments.ipynb')
+        with open(fname, 'w', encoding='utf-8') as f:
+            json.dump({
+                'cells': [{'cell_type': 'code', 'metadata': {}, 'execution_count': 1, 'outputs': [],
+                           'source': ['# First comment\n', '# Second comment\n', "print('Hello')"]}],
+                'metadata': {}, 'nbformat': 4, 'nbformat_minor': 4
+            }, f)
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = ValueError('Connection reset')
+        dead_letter = jupyter_translate.DeadLetterQueue(str(tmp_path / 'failures.jsonl'))
+
+        jupyter_translate.jupyter_translate(fname=fname, src_language='en', dest_language='pt', delay=0, translator_name='google',
+                                            translator=mock_translator, retry_policy=jupyter_translate.RetryPolicy(retries=1, base_delay=0),
+                                            dead_letter=dead_letter)
+
+        with open(fname.replace('.ipynb', '_pt.ipynb'), encoding='utf-8') as f:
+            output = json.load(f)
+        assert output['cells'][0]['source'] == ['# First comment\n', '# Second comment\n', "print('Hello')"]
+        assert 'jupyter_translate' not in output['cells'][0]['metadata']
+        records = dead_letter.read()
+        assert sorted(record['text'] for record in records) == ['First comment', 'Hello', 'Second comment']
+        assert len({record['src_sha'] for record in records}) == 1
+
+    def test_dead_letter_file_only_replaces_the_records_of_translated_notebooks(self, sample_directory, tmp_path):
+        """Test that a run keeps the failures of the other notebooks, and that reruns don't duplicate records"""
+        def translate(text):
+            if 'Hello' in text:
+                raise ValueError('Connection reset')
+            return text.upper()
+
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = translate
+        dead_letter_path = str(tmp_path / 'failures.jsonl')
+        first, second = (os.path.join(sample_directory, f'notebook_{i}.ipynb') for i in range(2))
+
+        def run(fname):
+            argv = ['jupyter_translate', fname, '--target', 'pt', '--no-cache', '--retries', '1', '--delay', '0', '--dead-letter', dead_letter_path]
+            with patch('sys.argv', argv), patch('jupyter_translate.get_translator', return_value=mock_translator), \
+                    patch.dict(jupyter_translate.MAX_REQUEST_CHARS, {'google': 30}):
+                jupyter_translate.main()
+
+        run(first)
+        run(second)
+        run(first)
+        records = jupyter_translate.DeadLetterQueue(dead_letter_path).read()
+        assert sorted(os.path.basename(record['notebook']) for record in records) == ['notebook_0.ipynb', 'notebook_1.ipynb']
+
+        # Each save of a watched notebook replaces its records
+        class ScriptedWatcher:
+            steps = [{first}, {first}]
+
+            def wait(self, timeout):
+                if not self.steps:
+                    stop.set()
+                    return set()
+                return self.steps.pop(0)
+
+            def close(self):
+                pass
+
+        stop = threading.Event()
+        with patch.dict(jupyter_translate.MAX_REQUEST_CHARS, {'google': 30}):
+            jupyter_translate.watch(
+                sample_directory, 'en', 'pt', delay=0, translator_name='google', translator={'pt': mock_translator},
+                retry_policy=jupyter_translate.RetryPolicy(retries=1, base_delay=0),
+                dead_letter=jupyter_translate.DeadLetterQueue(dead_letter_path), watcher=ScriptedWatcher(), stop=stop
+            )
+        records = jupyter_translate.DeadLetterQueue(dead_letter_path).read()
+        assert len(records) == 4
+        assert len({record['notebook'] for record in records}) == 4
+
+    def test_translation_into_several_languages(self, sample_notebook):
+        """Test that the notebook is read and planned once, and each language written to its own output"""
+        translators = {'es': MagicMock(), 'fr': MagicMock()}
+        translators['es'].translate.side_effect = lambda text: text.upper()
+        translators['fr'].translate.side_effect = lambda text: text.swapcase()
+
+        with patch('jupyter_translate.NotebookDocument', wraps=jupyter_translate.NotebookDocument) as document, \
+                patch('jupyter_translate.plan_notebook', wraps=jupyter_translate.plan_notebook) as plan:
+            outputs = jupyter_translate.jupyter_translate(
+                fname=sample_notebook, src_language='en', dest_language='es, fr', delay=0,
+                translator_name='google', translator=translators
+            )
+
+        assert document.call_count == 1
+        assert plan.call_count == 1
+        assert outputs == [sample_notebook.replace('.ipynb', '_es.ipynb'), sample_notebook.replace('.ipynb', '_fr.ipynb')]
+        for language, output_path, comment in zip(('es', 'fr'), outputs, ('# THIS IS A CODE COMMENT\n', '# tHIS IS A CODE COMMENT\n')):
+            with open(output_path, encoding='utf-8') as f:
+                output = json.load(f)
+            assert output['cells'][1]['source'][0] == comment
+            assert output['metadata']['jupyter_translate']['target_language'] == language
+
+        # Only the language whose output is missing is translated again
+        os.remove(outputs[1])
+        translators['es'].reset_mock()
+        jupyter_translate.jupyter_translate(
+            fname=sample_notebook, src_language='en', dest_language=['es', 'fr'], delay=0,
+            translator_name='google', translator=translators
+        )
+        translators['es'].translate.assert_not_called()
+        assert os.path.exists(outputs[1])
+
+    def test_failed_language_does_not_stop_the_others(self, sample_notebook):
+        """Test that the other languages are still written when one of them fails"""
+        failing = MagicMock()
+        failing.translate.side_effect = ValueError('Connection reset')
+        working = MagicMock()
+        working.translate.side_effect = lambda text: text.upper()
+
+        with pytest.raises(jupyter_translate.TranslationFailedError):
+            jupyter_translate.jupyter_translate(
+                fname=sample_notebook, src_language='en', dest_language='es,fr', delay=0, translator_name='google',
+                translator={'es': failing, 'fr': working}, retry_policy=jupyter_translate.RetryPolicy(retries=1, base_delay=0)
+            )
+
+        assert not os.path.exists(sample_notebook.replace('.ipynb', '_es.ipynb'))
+        assert os.path.exists(sample_notebook.replace('.ipynb', '_fr.ipynb'))
+        with pytest.raises(ValueError):
+            jupyter_translate.jupyter_translate(
+                fname=sample_notebook, src_language='en', dest_language='es,fr', delay=0, translator_name='google',
+                translator={'es': working, 'fr': working}, rename_source_file=True
+            )
+
+    def test_extract_and_merge_segments(self, sample_directory, tmp_path):
+        """Test that segments extracted to a file and translated offline are merged back into the notebooks"""
+        segment_file = str(tmp_path / 'segments.xlf')
+        with patch('sys.argv', ['jupyter_translate', 'extract', sample_directory, segment_file, '--source', 'en']):
+            jupyter_translate.main()
+
+        records = jupyter_translate.read_segment_file(segment_file)
+        assert len(records) == 4 * 3
+        assert {record['id'] for record in records} >= {'notebook_0.ipynb#1.1', 'subdir/sub_notebook_1.ipynb#1.1'}
+        for record in records:
+            if record['source'] != 'Hello, world!':
+                record['target'] = record['source'].upper()
+        jupyter_translate.write_segment_file(segment_file, records, 'en', 'pt')
+
+        # A cell inserted since the extraction moves the others
+        notebook_path = os.path.join(sample_directory, 'notebook_0.ipynb')
+        with open(notebook_path, encoding='utf-8') as f:
+            notebook = json.load(f)
+        notebook['cells'].insert(0, {'cell_type': 'markdown', 'source': ['New cell']})
+        with open(notebook_path, 'w', encoding='utf-8') as f:
+            json.dump(notebook, f)
+
+        with patch('sys.argv', ['jupyter_translate', 'merge', sample_directory, segment_file, '--target', 'pt']):
+            jupyter_translate.main()
+
+        with open(os.path.join(sample_directory, 'notebook_0_pt.ipynb'), encoding='utf-8') as f:
+            output = json.load(f)
+        assert [cell['source'] for cell in output['cells']] == [
+            ['New cell'],
+            ['# SAMPLE NOTEBOOKTHIS IS A TEST NOTEBOOK.'],
+            ['# THIS IS A CODE COMMENT\n', "print('Hello, world!')"],
+        ]
+        # The cells left partly untranslated are translated by the next run
+        assert 'jupyter_translate' in output['cells'][1]['metadata']
+        assert 'jupyter_translate' not in output['cells'][2].get('metadata', {})
+        assert output['metadata']['jupyter_translate']['translator'] == 'merge'
+        assert os.path.exists(os.path.join(sample_directory, 'subdir', 'sub_notebook_1_pt.ipynb'))
+
+    def test_watch_translates_saved_notebooks(self, sample_directory):
+        """Test that watch translates the directory, then only the cells changed by each save"""
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        notebook_path = os.path.join(sample_directory, 'notebook_0.ipynb')
+        output_path = os.path.join(sample_directory, 'notebook_0_pt.ipynb')
+        stop = threading.Event()
+
+        def save():
+            with open(notebook_path, encoding='utf-8') as f:
+                notebook = json.load(f)
+            notebook['cells'][1]['source'] = ["print('Saved again')"]
+            with open(notebook_path, 'w', encoding='utf-8') as f:
+                json.dump(notebook, f)
+            mock_translator.reset_mock()
+            # The save and the outputs written by the previous translation, debounced together
+            return {notebook_path, output_path}
+
+        class ScriptedWatcher:
+            steps = [save, lambda: {notebook_path}, set]
+
+            def wait(self, timeout):
+                if not self.steps:
+                    stop.set()
+                    return set()
+                return self.steps.pop(0)()
+
+            def close(self):
+                self.closed = True
+
+        watcher = ScriptedWatcher()
+        jupyter_translate.watch(
+            sample_directory, 'en', 'pt', delay=0, translator_name='google',
+            translator={'pt': mock_translator}, watcher=watcher, stop=stop
+        )
+
+        mock_translator.translate.assert_called_once_with('Saved again')
+        with open(output_path, encoding='utf-8') as f:
+            assert json.load(f)['cells'][1]['source'] == ["print('SAVED AGAIN')"]
+        assert not os.path.exists(os.path.join(sample_directory, 'notebook_0_pt_pt.ipynb'))
+        assert os.path.exists(os.path.join(sample_directory, 'subdir', 'sub_notebook_1_pt.ipynb'))
+        assert watcher.closed
+
+    def test_notebook_translation_trace(self, sample_notebook, tmp_path):
+        """Test that the phases, cells and requests of a run are recorded as Chrome trace events"""
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        trace_path = str(tmp_path / 'trace.json')
+        tracer = jupyter_translate.Tracer()
+        tracer.enable()
+
+        with patch('jupyter_translate.tracer', tracer):
+            jupyter_translate.jupyter_translate(
+                fname=sample_notebook, src_language='en', dest_language='pt', delay=0,
+                translator_name='google', translator=mock_translator, force=True
+            )
+            tracer.write(trace_path)
+
+        with open(trace_path, encoding='utf-8') as f:
+            events = json.load(f)['traceEvents']
+        names = {event['name'] for event in events}
+        assert {sample_notebook, 'read', 'plan', 'translate', 'write', 'request', 'plan code cell'} <= names
+        assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+        assert jupyter_translate.tracer.span('disabled') is jupyter_translate._NULL_SPAN
+
+    @pytest.mark.parametrize('translator_name', ['google', 'mymemory'])
+    def test_notebook_translation_with_mock_server(self, sample_notebook, translator_name):
+        """Test the translation end to end against the local mock translation server"""
+        from benchmarks.mock_server import MockTranslationServer
+
+        # MyMemory needs regional language codes
+        src_language, dest_language = ('en', 'pt') if translator_name == 'google' else ('en-GB', 'pt-PT')
+        server = MockTranslationServer(latency=0).start()
+        endpoint_url = server.url + '/translate'
+        try:
+            translator = jupyter_translate.get_translator(translator_name, src_language, dest_language, endpoint_url=endpoint_url)
+            jupyter_translate.check_translator(translator)
+            # The next requests are throttled
+            server._burst = (429, 2)
+            jupyter_translate.jupyter_translate(
+                fname=sample_notebook, src_language=src_language, dest_language='pt', delay=0,
+                translator_name=translator_name, translator=translator, endpoint_url=endpoint_url,
+                retry_policy=jupyter_translate.RetryPolicy(retries=5, base_delay=0, max_delay=0)
+            )
+        finally:
+            server.stop()
+
+        assert server.stats == {'200': 2, '429': 2}
+        output_path = sample_notebook.replace('.ipynb', '_pt.ipynb')
+        with open(output_path, encoding='utf-8') as f:
+            output = json.load(f)
+        assert output['cells'][1]['source'] == ['# THIS IS A CODE COMMENT\n', "print('HELLO, WORLD!')"]
+        assert output['metadata']['jupyter_translate']['endpoint_url'] == endpoint_url
+
     def test_main_function(self):
         """Test the main function with command line arguments"""
         # Mock the actual jupyter_translate function to avoid execution
@@ -245,6 +632,66 @@ class TestJupyterTranslateIntegration:
                 output_path = os.path.join(subdir_path, f"sub_notebook_{i}_portuguese.ipynb")
                 assert not os.path.exists(output_path)
     
+    def test_directory_translation_reuses_translator(self, sample_directory):
+        """Test that the translator is built and checked once for the whole directory"""
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text
+
+        with patch('jupyter_translate.get_translator', return_value=mock_translator) as mock_get_translator:
+            failures = jupyter_translate.translate_directory(
+                directory=sample_directory,
+                src_language='en',
+                dest_language='pt',
+                delay=0,
+                translator_name='google',
+            )
+
+        assert failures == {}
+        mock_get_translator.assert_called_once()
+        # One test translation plus one batched request per notebook
+        assert mock_translator.translate.call_count == 1 + 4
+
+    def test_directory_translation_skips_previous_outputs(self, sample_directory, capsys):
+        """Test that translating a directory again doesn't translate the outputs of the previous runs"""
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        options = dict(src_language='en', delay=0, translator_name='google', translator={'es': mock_translator, 'fr': mock_translator})
+
+        assert jupyter_translate.translate_directory(sample_directory, dest_language='es,fr', **options) == {}
+        # Another language, and an output renamed by hand, are recognized from their metadata
+        shutil.copy(os.path.join(sample_directory, 'notebook_0_fr.ipynb'), os.path.join(sample_directory, 'notebook_0 (French).ipynb'))
+        mock_translator.reset_mock()
+        assert jupyter_translate.translate_directory(sample_directory, dest_language='es,fr', **options) == {}
+        assert jupyter_translate.translate_directory(sample_directory, dest_language='es', **dict(options, translator=mock_translator)) == {}
+
+        mock_translator.translate.assert_not_called()
+        files = sorted(os.path.relpath(os.path.join(root, file), sample_directory) for root, _, names in os.walk(sample_directory) for file in names)
+        assert len(files) == 4 * 3 + 1
+        assert not [file for file in files if file.endswith(('_es_es.ipynb', '_fr_es.ipynb', '_es_fr.ipynb', ') _es.ipynb'))]
+
+        capsys.readouterr()
+        with patch('sys.argv', ['jupyter_translate', sample_directory, '--target', 'es', '--dry-run', '--no-cache']):
+            jupyter_translate.main()
+        rows = capsys.readouterr().out.splitlines()[1:-2]
+        assert len(rows) == 4
+        assert not [row for row in rows if '_es.ipynb' in row or 'French' in row]
+
+    def test_directory_translation_keeps_sources_named_like_outputs(self, sample_directory, caplog):
+        """Test that a source notebook whose name ends in _<lang>.ipynb is translated, and that skipped outputs are logged"""
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        shutil.copy(os.path.join(sample_directory, 'notebook_0.ipynb'), os.path.join(sample_directory, 'lesson_en.ipynb'))
+        options = dict(src_language='fr', dest_language='en', delay=0, translator_name='google', translator=mock_translator, recursive=False)
+
+        assert jupyter_translate.translate_directory(sample_directory, **options) == {}
+        assert os.path.exists(os.path.join(sample_directory, 'lesson_en_en.ipynb'))
+
+        with caplog.at_level('INFO', logger='jupyter_translate'):
+            jupyter_translate.translate_directory(sample_directory, **options)
+        skipped = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Skipping')]
+        assert len(skipped) == 3
+        assert not [message for message in skipped if 'lesson_en.ipynb' in message]
+
     @patch('jupyter_translate.GoogleTranslator')
     def test_main_function_with_directory(self, mock_translator_class, sample_directory):
         """Test the main function with directory option"""
@@ -1,6 +1,10 @@
+import asyncio
+import threading
+import json
 import pytest
 import sys
 import os
+from time import sleep
 from unittest.mock import patch, MagicMock
 
 # Add the parent directory to the path so we can import jupyter_translate
@@ -37,6 +41,24 @@ class TestGetTranslator:
         assert mock_translator.call_count >= 1
         assert translator is not None
     
+    def test_key_only_translator_shares_cache_keys(self):
+        for name, src, dest in [('google', 'english', 'pt'), ('mymemory', 'en-GB', 'portuguese brazil')]:
+            translator = jupyter_translate.get_translator(name, src, dest, endpoint_url='http://127.0.0.1:8765')
+            key_only = jupyter_translate.get_translator(name, src, dest, endpoint_url='http://127.0.0.1:8765', key_only=True)
+
+            assert isinstance(key_only, jupyter_translate.TranslatorKey)
+            assert jupyter_translate.TranslationCache.make_key(key_only, 'Hello') == jupyter_translate.TranslationCache.make_key(translator, 'Hello')
+
+    def test_import_skips_translation_backends(self):
+        import subprocess
+        code = "import sys, jupyter_translate; print([m for m in ('deep_translator', 'tqdm', 'asyncio') if m in sys.modules])"
+
+        root = os.path.dirname(os.path.abspath(jupyter_translate.__file__))
+        result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+
+        assert result.stdout.strip() == '[]'
+        assert jupyter_translate.lazy('GoogleTranslator').__module__.startswith('deep_translator')
+
     def test_get_translator_invalid(self):
         # Test with an invalid translator name
         with pytest.raises(ValueError):
@@ -84,7 +106,8 @@ class TestSafeTranslate:
         # Assertions
         assert "Failed to translate after 2 attempts" in str(excinfo.value)
         assert mock_translator.translate.call_count == 2
-        assert mock_sleep.call_count == 2
+        # There is no wait after the last attempt
+        assert mock_sleep.call_count == 1
 
 class TestTranslateMarkdown:
     def test_translate_markdown_simple(self):
@@ -141,24 +164,867 @@ class TestTranslateCodeCommentsAndPrints:
         assert '# This is a translated comment' in result
         assert 'x = 10' in result
     
-    @patch('jupyter_translate.re.search')
-    @patch('jupyter_translate.re.sub')
-    def test_translate_print_statements(self, mock_sub, mock_search):
+    def test_translate_print_statements(self):
         # Test translating print statements
         code_with_print = 'print("Hello, world!")'
         mock_translator = MagicMock()
-        
-        # Mock re.search to pretend it found a match for print statements
-        mock_match = MagicMock()
-        mock_match.group.return_value = '"Hello, world!"'
-        mock_search.return_value = mock_match
-        
-        # Mock re.sub to simulate replacing the text inside print
-        mock_sub.return_value = 'print("Hello, translated world!")'
-        
-        # Mock the safe_translate function
-        with patch('jupyter_translate.safe_translate', return_value='"Hello, translated world!"'):
+
+        def mock_safe_translate(translator, text, delay):
+            assert text == 'Hello, world!'
+            return 'Hello, translated world!'
+
+        with patch('jupyter_translate.safe_translate', side_effect=mock_safe_translate):
             result = jupyter_translate.translate_code_comments_and_prints(code_with_print, mock_translator, delay=0)
-        
+
         # Assert that we get the expected output
-        assert 'print("Hello, translated world!")' == result 
\ No newline at end of file
+        assert 'print("Hello, translated world!")' == result
+
+    def test_plan_code_ignores_hashes_in_strings(self):
+        code = 's = "# not a comment"  # a comment\nprint(f"Value {s}")\nprint(\'Done\', s)'
+
+        segments, rebuild = jupyter_translate.plan_code(code)
+
+        assert segments == ['a comment', 'Done']
+        assert rebuild(['um comentário', "C'est fini"]) == (
+            's = "# not a comment"  # um comentário\nprint(f"Value {s}")\nprint(\'C\\\'est fini\', s)')
+
+    def test_plan_code_translates_docstrings(self):
+        code = 'def f():\n    """Returns one."""\n    x = """not a docstring"""\n    return 1\n'
+
+        segments, rebuild = jupyter_translate.plan_code(code)
+
+        assert segments == ['Returns one.']
+        assert rebuild(['Retorna "um"']) == code.replace('Returns one.', 'Retorna "um\\"')
+
+    def test_plan_code_leaves_displayed_strings_alone(self):
+        # A lone string is the displayed value of the cell, not a docstring
+        assert jupyter_translate.plan_code('"Hello world"\n')[0] == []
+        assert jupyter_translate.plan_code('"Hello world"  # the result\n')[0] == ['the result']
+        # Followed by other statements, it documents the cell
+        assert jupyter_translate.plan_code('"""Loads the data."""\ndata = load()\n')[0] == ['Loads the data.']
+
+    def test_plan_code_escapes_backslashes_of_literals(self):
+        code = 'print("Match \\d+ in\\tC:\\\\data\\n")'
+
+        segments, rebuild = jupyter_translate.plan_code(code)
+
+        # The translator gets the value of the literal, which keeps its meaning once rebuilt
+        assert segments == ['Match \\d+ in\tC:\\data\n']
+        rebuilt = rebuild(['Encontra \\d+ em\tC:\\dados\n'])
+        assert rebuilt == 'print("Encontra \\\\d+ em\\tC:\\\\dados\\n")'
+        assert eval(rebuilt[6:-1]) == 'Encontra \\d+ em\tC:\\dados\n'
+
+    def test_plan_code_leaves_raw_literals_unescaped(self):
+        code = 'print(r"it\'s \\d+")\nprint(R\'a \\n b\')'
+
+        segments, rebuild = jupyter_translate.plan_code(code)
+
+        assert segments == ["it's \\d+", 'a \\n b']
+        # A translation that can't be written as a raw literal leaves the original text
+        assert rebuild(["c'est \\d+", 'it "ends" with\\']) == 'print(r"c\'est \\d+")\nprint(R\'a \\n b\')'
+
+    def test_plan_code_falls_back_to_lines(self):
+        # The unterminated quote can't be tokenized
+        code = "!echo it's\n# a comment"
+
+        segments, rebuild = jupyter_translate.plan_code(code)
+
+        assert segments == ['a comment']
+        assert rebuild(['um comentário']) == "!echo it's\n# um comentário"
+
+class TestSegmentBatching:
+    def test_pack_segments_respects_max_chars(self):
+        segments = ['a' * 10, 'b' * 10, '', 'c' * 10]
+        max_chars = 20 + len(jupyter_translate.SEGMENT_DELIMITER)
+
+        batches = jupyter_translate.pack_segments(segments, max_chars)
+
+        # The empty segment is skipped and the third one doesn't fit in the first batch
+        assert batches == [[0, 1], [3]]
+
+    def test_translate_segments_single_request(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+
+        result = jupyter_translate.translate_segments(mock_translator, ['one', '', 'two'], delay=0)
+
+        assert result == ['ONE', '', 'TWO']
+        mock_translator.translate.assert_called_once()
+
+    def test_translate_batch_falls_back_when_delimiter_is_lost(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.replace(
+            jupyter_translate.SEGMENT_DELIMITER, ' ') + '!'
+
+        result = jupyter_translate.translate_batch(mock_translator, ['one', 'two'], delay=0)
+
+        assert result == ['one!', 'two!']
+        assert mock_translator.translate.call_count == 3
+
+
+class TestTranslationCache:
+    def make_translator(self):
+        mock_translator = MagicMock()
+        mock_translator.source = 'en'
+        mock_translator.target = 'pt'
+        mock_translator.translate.side_effect = lambda text: 'translated ' + text
+        return mock_translator
+
+    @patch('jupyter_translate.sleep')
+    def test_safe_translate_uses_cache(self, mock_sleep, tmp_path):
+        cache = jupyter_translate.TranslationCache(str(tmp_path))
+        mock_translator = self.make_translator()
+
+        first = jupyter_translate.safe_translate(mock_translator, 'source text', cache=cache)
+        second = jupyter_translate.safe_translate(mock_translator, 'source text', cache=cache)
+
+        assert first == second == 'translated source text'
+        mock_translator.translate.assert_called_once()
+        assert cache.hits == 1
+
+    def test_cache_persists_on_disk(self, tmp_path):
+        mock_translator = self.make_translator()
+        cache = jupyter_translate.TranslationCache(str(tmp_path))
+        cache.set(mock_translator, 'Hello\r\n', 'Olá')
+        cache.close()
+
+        # A new instance has an empty memory tier and must read from SQLite
+        cache = jupyter_translate.TranslationCache(str(tmp_path))
+        assert cache.get(mock_translator, '  Hello\n') == 'Olá'
+
+        # The key includes the target language
+        mock_translator.target = 'es'
+        assert cache.get(mock_translator, 'Hello') is None
+
+    def test_cache_eviction(self, tmp_path):
+        mock_translator = self.make_translator()
+        cache = jupyter_translate.TranslationCache(str(tmp_path), memory_size=1, max_entries=2)
+        cache.set_many(mock_translator, [('a', 'A'), ('b', 'B'), ('c', 'C')])
+        assert len(cache._memory) == 1
+
+        cache.evict()
+        count = cache._connect().execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        assert count == 2
+
+        cache.max_age_days = 0
+        cache.evict()
+        count = cache._connect().execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        assert count == 0
+
+
+class TestConcurrency:
+    def test_token_bucket_waits_for_tokens(self):
+        clock = [0.0]
+        waits = []
+
+        def fake_sleep(seconds):
+            waits.append(seconds)
+            clock[0] += seconds
+
+        with patch('jupyter_translate.monotonic', side_effect=lambda: clock[0]), \
+                patch('jupyter_translate.sleep', side_effect=fake_sleep):
+            bucket = jupyter_translate.TokenBucket(rate=2, capacity=2)
+            for _ in range(4):
+                bucket.acquire()
+
+        # Two requests fit in the bucket, the other two wait half a second each
+        assert waits == [0.5, 0.5]
+
+    def test_rate_limiter_provider_defaults(self):
+        limiter = jupyter_translate.RateLimiter.for_translator('google', chars_per_minute=600)
+        assert limiter.requests.rate == jupyter_translate.DEFAULT_RATE_LIMITS['google'][0]
+        assert limiter.chars.rate == 10
+
+    def test_translate_segments_with_workers_keeps_order(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        segments = [f'segment {i}' for i in range(50)]
+
+        result = jupyter_translate.translate_segments(
+            mock_translator, segments, delay=0, max_chars=30, workers=8,
+            rate_limiter=jupyter_translate.RateLimiter()
+        )
+
+        assert result == [segment.upper() for segment in segments]
+
+
+class TestAsyncEngine:
+    class FakeAsyncTranslator:
+        source = 'en'
+        target = 'pt'
+
+        def __init__(self):
+            self.calls = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+        async def translate(self, text):
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0)
+            self.in_flight -= 1
+            return text.upper()
+
+    def test_translate_segments_async_keeps_order(self):
+        translator = self.FakeAsyncTranslator()
+        segments = [f'segment {i}' for i in range(20)]
+
+        result = asyncio.run(jupyter_translate.translate_segments_async(
+            translator, segments, delay=0, max_chars=30, concurrency=4))
+
+        assert result == [segment.upper() for segment in segments]
+        assert 1 < translator.max_in_flight <= 4
+
+    def test_translate_notebook_async(self, tmp_path):
+        notebook = {
+            "cells": [
+                {"cell_type": "markdown", "metadata": {}, "source": ["# Title\n", "Some text"]},
+                {"cell_type": "code", "metadata": {}, "outputs": [], "source": ["x = 1  # a comment"]},
+            ],
+            "metadata": {}, "nbformat": 4, "nbformat_minor": 4
+        }
+        fname = str(tmp_path / 'notebook.ipynb')
+        with open(fname, 'w', encoding='utf-8') as f:
+            json.dump(notebook, f)
+
+        dest_fname = asyncio.run(jupyter_translate.translate_notebook_async(
+            fname, self.FakeAsyncTranslator(), 'pt', delay=0))
+
+        assert dest_fname == str(tmp_path / 'notebook_pt.ipynb')
+        with open(dest_fname, encoding='utf-8') as f:
+            cells = json.load(f)['cells']
+        assert cells[0]['source'] == ['# TITLE\n', 'SOME TEXT']
+        assert cells[1]['source'] == ['x = 1  # A COMMENT']
+
+    def test_threaded_async_translator(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+
+        translator = jupyter_translate.ThreadedAsyncTranslator(mock_translator)
+
+        assert asyncio.run(translator.translate('hello')) == 'HELLO'
+
+    def test_async_google_translator_parses_result(self):
+        translator = jupyter_translate.AsyncGoogleTranslator('en', 'pt')
+        page = '<html><div class="result-container">Ol&aacute; mundo</div></html>'
+
+        async def fake_get(params):
+            assert params == {'sl': 'en', 'tl': 'pt', 'q': 'Hello world'}
+            return page
+
+        with patch.object(translator, '_get', side_effect=fake_get):
+            assert asyncio.run(translator.translate('Hello world')) == 'Olá mundo'
+
+    def test_async_http_translator_parses_retry_after_dates(self):
+        class FakeResponse:
+            status = 503
+            headers = {'Retry-After': 'Sun, 18 Oct 2026 12:00:30 GMT'}
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info):
+                pass
+
+        translator = jupyter_translate.AsyncGoogleTranslator('en', 'pt')
+        translator._session = MagicMock()
+        translator._session.get.return_value = FakeResponse()
+
+        with patch('jupyter_translate.time', return_value=1792324800.0):  # 2026-10-18 12:00:00 GMT
+            with pytest.raises(jupyter_translate.TranslationRequestError) as error:
+                asyncio.run(translator._get({'q': 'Hello'}))
+        assert error.value.status_code == 503
+        assert error.value.retry_after == 30.0
+
+    def test_async_cache_lookups_run_off_the_event_loop(self):
+        threads = []
+        claim_segments = jupyter_translate.claim_segments
+
+        def record_thread(*args):
+            threads.append(threading.current_thread())
+            return claim_segments(*args)
+
+        with patch('jupyter_translate.claim_segments', side_effect=record_thread):
+            translations = asyncio.run(jupyter_translate.translate_segments_async(
+                self.FakeAsyncTranslator(), ['Hello', 'world'], delay=0))
+
+        assert translations == ['HELLO', 'WORLD']
+        assert threads and threading.main_thread() not in threads
+
+
+class TestDirectoryJobs:
+    def test_shared_rate_limiter_uses_shared_buckets(self):
+        limiter = jupyter_translate.SharedRateLimiter.for_translator('google', chars_per_minute=600)
+        assert isinstance(limiter.requests, jupyter_translate.SharedTokenBucket)
+        assert isinstance(limiter.chars, jupyter_translate.SharedTokenBucket)
+
+    def test_shared_token_bucket_waits_for_tokens(self):
+        with patch('jupyter_translate.monotonic', return_value=0.0):
+            bucket = jupyter_translate.SharedTokenBucket(rate=1, capacity=1)
+            assert bucket._take(1) == 0
+            assert bucket._take(1) == 1
+
+    def test_translation_cache_is_picklable(self, tmp_path):
+        import pickle
+        cache = jupyter_translate.TranslationCache(str(tmp_path), memory_size=5)
+        cache._connect()
+
+        copy = pickle.loads(pickle.dumps(cache))
+
+        assert copy.cache_dir == str(tmp_path)
+        assert copy.memory_size == 5
+        assert copy._db is None
+
+    def test_translate_notebook_job_reports_errors(self):
+        with patch('jupyter_translate.jupyter_translate', side_effect=SystemExit(1)):
+            path, error, job_metrics, trace_events = jupyter_translate._translate_notebook_job('notebook.ipynb', {})
+
+        assert path == 'notebook.ipynb'
+        assert error == 'SystemExit: 1'
+
+
+class TestNotebookDocument:
+    def write_notebook(self, tmp_path, notebook, indent=None):
+        fname = str(tmp_path / 'notebook.ipynb')
+        with open(fname, 'w', encoding='utf-8') as f:
+            json.dump(notebook, f, indent=indent)
+        return fname
+
+    @pytest.mark.parametrize('indent', [None, 1, 2])
+    def test_round_trip_splices_changes(self, tmp_path, indent):
+        notebook = {
+            "cells": [
+                {"cell_type": "code", "source": ["x = 1  # [not a bracket\n", "y = '\"}'"],
+                 "outputs": [{"data": {"image/png": "iVBOR" * 1000}, "output_type": "display_data"}]},
+                {"cell_type": "markdown", "metadata": {"tags": ["a"]}, "source": "Text"},
+            ],
+            "metadata": {"kernelspec": {"name": "python3"}},
+            "nbformat": 4,
+            "nbformat_minor": 5
+        }
+        fname = self.write_notebook(tmp_path, notebook, indent)
+
+        with jupyter_translate.NotebookDocument(fname) as document:
+            assert [cell['source'] for cell in document.cells] == [notebook['cells'][0]['source'], 'Text']
+            assert document.cells[0]['metadata'] == {}
+            document.cells[0]['metadata']['translated'] = True
+            document.cells[1]['source'] = ['Texto']
+            document.metadata['translated'] = True
+            document.write(str(tmp_path / 'output.ipynb'))
+
+        with open(str(tmp_path / 'output.ipynb'), encoding='utf-8') as f:
+            output = json.load(f)
+        notebook['cells'][0]['metadata'] = {'translated': True}
+        notebook['cells'][1]['source'] = ['Texto']
+        notebook['metadata']['translated'] = True
+        assert output == notebook
+
+    def test_unchanged_document_is_copied_as_is(self, tmp_path):
+        fname = self.write_notebook(tmp_path, {"cells": [{"cell_type": "raw", "source": []}], "metadata": {}}, indent=1)
+
+        with jupyter_translate.NotebookDocument(fname) as document:
+            document.write(str(tmp_path / 'output.ipynb'))
+
+        with open(fname, 'rb') as original, open(str(tmp_path / 'output.ipynb'), 'rb') as output:
+            assert original.read() == output.read()
+
+    def test_cannot_write_over_itself(self, tmp_path):
+        fname = self.write_notebook(tmp_path, {"cells": [], "metadata": {}})
+
+        with jupyter_translate.NotebookDocument(fname) as document:
+            with pytest.raises(ValueError):
+                document.write(fname)
+
+
+class TestMarkdownProtection:
+    def test_mask_and_restore(self):
+        text = ('Some `code`, $x^2$, a [link](http://a.b), ![an image](img.png), '
+                '<b>bold</b> and https://example.com.\n```python\nx = 1\n```')
+
+        masked, protected = jupyter_translate.mask_markdown(text)
+
+        assert masked == ('Some xxcode0xx, xxmath1xx, a xxlink2xx, xximg3xx, '
+                          'xxhtml4xx bold xxhtml5xx and xxurl6xx.\nxxcode7xx')
+        assert jupyter_translate.restore_markdown(masked, protected) == text
+
+    def test_text_between_tags_is_translated(self):
+        segments, rebuild = jupyter_translate.plan_markdown('Use <b>bold</b> text, <a href="x.html">a link</a> or H<sub>2</sub>O.')
+
+        # Each tag is a separate word for the translator
+        assert segments == ['Use xxhtml0xx bold xxhtml1xx text, xxhtml2xx a link xxhtml3xx or H xxhtml4xx 2 xxhtml5xx O.']
+        # The translator may also drop or add spaces around the placeholders
+        assert rebuild(['Usa xxhtml0xx negrito xxhtml1xx texto, xxhtml2xxum linkxxhtml3xx ou H xxhtml4xx 2 xxhtml5xx O.']) == \
+            'Usa <b>negrito</b> texto, <a href="x.html">um link</a> ou H<sub>2</sub>O.'
+
+    def test_comparisons_are_not_tags(self):
+        masked, _ = jupyter_translate.mask_markdown('If a<b and c>d, or x < y > z, then <br/> <input disabled>')
+
+        assert masked == 'If a<b and c>d, or x < y > z, then xxhtml0xx xxhtml1xx'
+
+    def test_restore_follows_placeholder_indices(self):
+        masked, protected = jupyter_translate.mask_markdown('[first](1) and [second](2)')
+
+        # The translator reordered the placeholders and added spaces
+        restored = jupyter_translate.restore_markdown('xx link1 xx e XXLINK0XX', protected)
+
+        assert restored == '[second](2) e [first](1)'
+
+    def test_plan_markdown_skips_protected_only_cells(self):
+        segments, rebuild = jupyter_translate.plan_markdown('![image](img.png)\n')
+
+        assert segments == []
+        assert rebuild([]) == '![image](img.png)\n'
+
+
+class TestRetryPolicy:
+    def test_backoff_is_exponential_with_full_jitter(self):
+        policy = jupyter_translate.RetryPolicy(base_delay=1, max_delay=5)
+
+        with patch('jupyter_translate.random.uniform', side_effect=lambda low, high: high) as mock_uniform:
+            assert [policy.backoff(attempt) for attempt in range(4)] == [1, 2, 4, 5]
+        assert all(call.args[0] == 0 for call in mock_uniform.call_args_list)
+
+    def test_backoff_honors_retry_after(self):
+        policy = jupyter_translate.RetryPolicy(max_delay=60)
+        error = jupyter_translate.TranslationRequestError('throttled', status_code=429, retry_after=7)
+
+        assert policy.backoff(0, error) == 7
+        assert policy.is_retryable(error)
+
+    def test_fatal_errors_are_not_retried(self):
+        class NotValidLength(Exception):
+            pass
+
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = NotValidLength('too long')
+
+        with pytest.raises(jupyter_translate.TranslationFailedError):
+            jupyter_translate.safe_translate(mock_translator, 'source text')
+        mock_translator.translate.assert_called_once()
+        assert not jupyter_translate.RetryPolicy().is_retryable(
+            jupyter_translate.TranslationRequestError('forbidden', status_code=403))
+
+    def test_circuit_breaker_pauses_after_consecutive_failures(self):
+        clock = [0.0]
+        waits = []
+
+        def fake_sleep(seconds):
+            waits.append(seconds)
+            clock[0] += seconds
+
+        with patch('jupyter_translate.monotonic', side_effect=lambda: clock[0]), \
+                patch('jupyter_translate.sleep', side_effect=fake_sleep):
+            breaker = jupyter_translate.CircuitBreaker(failure_threshold=2, cooldown=30)
+            breaker.record_failure()
+            breaker.wait()
+            assert waits == []
+
+            breaker.record_failure()
+            breaker.wait()
+            assert waits == [30]
+
+            # A Retry-After hint opens the circuit right away
+            breaker.record_success()
+            breaker.record_failure(retry_after=5)
+            breaker.wait()
+            assert waits == [30, 5]
+
+class TestRoutingTranslator:
+    def make_backend(self, name, translate, rate=1, max_chars=None):
+        translator = MagicMock(source='en', target='pt')
+        translator.translate.side_effect = translate
+        return jupyter_translate.RouteBackend(
+            name, translator, rate_limiter=jupyter_translate.RateLimiter(requests_per_second=rate),
+            max_chars=max_chars, circuit_breaker=jupyter_translate.CircuitBreaker(failure_threshold=1, cooldown=60)
+        )
+
+    def test_fails_over_to_healthy_backend(self):
+        def throttled(text):
+            raise jupyter_translate.TranslationRequestError('throttled', status_code=429)
+
+        google = self.make_backend('google', throttled, rate=5)
+        mymemory = self.make_backend('mymemory', lambda text: text.upper())
+        router = jupyter_translate.RoutingTranslator([google, mymemory])
+
+        assert router.translate('hello') == 'HELLO'
+        assert router.translate('world') == 'WORLD'
+        # The failed backend is out of the rotation until its cooldown is over
+        google.translator.translate.assert_called_once()
+        assert google.circuit_breaker.remaining() > 0
+
+    def test_spreads_load_by_rate(self):
+        fast = self.make_backend('google', lambda text: text, rate=5)
+        slow = self.make_backend('mymemory', lambda text: text, rate=2)
+        fast.in_flight = 2
+        router = jupyter_translate.RoutingTranslator([fast, slow])
+
+        router.translate('hello')
+        slow.translator.translate.assert_called_once()
+
+    def test_splits_payloads_for_smaller_backends(self):
+        backend = self.make_backend('mymemory', lambda text: text.replace('s', 'S'), rate=100, max_chars=50)
+        router = jupyter_translate.RoutingTranslator([backend])
+        payload = jupyter_translate.SEGMENT_DELIMITER.join(['first segment', 'second segment', 'third'])
+
+        translated = router.translate(payload)
+        assert jupyter_translate.SEGMENT_SPLIT_REGEX.split(translated) == ['firSt Segment', 'Second Segment', 'third']
+        assert backend.translator.translate.call_count == 2
+        with pytest.raises(ValueError):
+            router.translate('x' * 51)
+
+    @patch('jupyter_translate.MyMemoryTranslator')
+    @patch('jupyter_translate.GoogleTranslator')
+    def test_get_translator_builds_router(self, mock_google, mock_mymemory):
+        router = jupyter_translate.get_translator('google, mymemory', 'en', 'pt')
+
+        assert isinstance(router, jupyter_translate.RoutingTranslator)
+        assert [backend.name for backend in router.backends] == ['google', 'mymemory']
+        assert router.backends[1].max_chars == jupyter_translate.MAX_REQUEST_CHARS['mymemory']
+        mock_mymemory.assert_called_with(source='en-GB', target='pt-PT')
+
+class TestMetrics:
+    @patch('jupyter_translate.sleep')
+    def test_safe_translate_records_requests_and_retries(self, mock_sleep):
+        jupyter_translate.metrics.reset()
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = [Exception('timeout'), 'translated']
+
+        jupyter_translate.safe_translate(mock_translator, 'source text', delay=0)
+
+        snapshot = jupyter_translate.metrics.snapshot()
+        assert snapshot['requests'] == 2
+        assert snapshot['failed_requests'] == 1
+        assert snapshot['retries'] == 1
+        assert snapshot['chars_sent'] == 2 * len('source text')
+        assert snapshot['latency_seconds']['count'] == 2
+        assert json.loads(json.dumps(snapshot)) == snapshot
+
+    def test_latency_histogram_and_merge(self):
+        collector = jupyter_translate.TranslationMetrics()
+        collector.record_request(10, 0.07)
+        collector.record_request(10, 60)
+        worker = jupyter_translate.TranslationMetrics()
+        worker.record_request(5, 0.07)
+        worker.increment('cache_hits', 3)
+
+        collector.merge(worker.snapshot())
+
+        snapshot = collector.snapshot()
+        assert snapshot['requests'] == 3
+        assert snapshot['cache_hits'] == 3
+        assert snapshot['latency_seconds']['buckets']['0.1'] == 2
+        assert snapshot['latency_seconds']['buckets']['+Inf'] == 1
+        assert snapshot['latency_seconds']['max'] == 60
+
+    def test_debug_messages_are_logged_at_debug_level(self, caplog):
+        mock_translator = MagicMock()
+        mock_translator.translate.return_value = 'translated'
+
+        with caplog.at_level('INFO', logger='jupyter_translate'):
+            jupyter_translate.safe_translate(mock_translator, 'source text')
+        assert 'Translating text' not in caplog.text
+
+        with caplog.at_level('DEBUG', logger='jupyter_translate'):
+            jupyter_translate.safe_translate(mock_translator, 'source text')
+        assert 'Translating text: source text' in caplog.text
+
+class TestBenchmarks:
+    def test_fake_translator_is_deterministic(self):
+        from benchmarks.fake_translator import FakeTranslator
+
+        def outcomes(translator):
+            results = []
+            for text in ['first', 'second', 'first', 'third'] * 5:
+                try:
+                    results.append(translator.translate(text))
+                except jupyter_translate.TranslationRequestError as e:
+                    results.append(e.status_code)
+            return results
+
+        options = dict(latency=0, error_rate=0.2, throttle_rate=0.2, seed=1)
+        results = outcomes(FakeTranslator(**options))
+        assert results == outcomes(FakeTranslator(**options))
+        assert 429 in results and 500 in results and 'FIRST' in results
+
+    def test_synthetic_notebook_profiles(self):
+        from benchmarks.notebooks import generate_notebook
+
+        markdown = generate_notebook(cells=200, profile='markdown')
+        comments = generate_notebook(cells=200, profile='comments')
+        outputs = generate_notebook(cells=10, profile='outputs')
+
+        def markdown_cells(notebook):
+            return sum(cell['cell_type'] == 'markdown' for cell in notebook['cells'])
+
+        assert len(markdown['cells']) == 200
+        assert markdown_cells(markdown) > 150 > 50 > markdown_cells(comments)
+        assert generate_notebook(cells=20, seed=3) == generate_notebook(cells=20, seed=3)
+        assert len(json.dumps(outputs)) > 1000000
+
+    def test_startup_measurements(self):
+        from benchmarks.run import measure_startup
+
+        startup = measure_startup(runs=1)
+
+        assert startup['import_ms'] > 0 and startup['help_ms'] > 0 and startup['dry_run_ms'] > 0
+        # The dry run never loads the translation backends
+        assert startup['dry_run_heavy_modules'] == []
+
+class TestTranslationJournal:
+    fingerprint = jupyter_translate.translation_fingerprint('google', 'en', 'pt')
+
+    def test_journal_is_replayed(self, tmp_path):
+        path = str(tmp_path / 'notebook_pt.ipynb.journal')
+        with jupyter_translate.TranslationJournal(path, self.fingerprint) as journal:
+            journal.record([('First cell.', 'Primeira célula.'), ('Second cell.', 'Segunda célula.')])
+
+        journal = jupyter_translate.TranslationJournal(path, self.fingerprint)
+
+        assert journal.get(' First cell.\r\n') == 'Primeira célula.'
+        assert journal.get('Third cell.') is None
+        # Another translation starts over
+        assert jupyter_translate.TranslationJournal(path, dict(self.fingerprint, target_language='es')).entries == {}
+
+    def test_line_cut_by_a_crash_is_dropped(self, tmp_path):
+        path = str(tmp_path / 'notebook_pt.ipynb.journal')
+        with jupyter_translate.TranslationJournal(path, self.fingerprint) as journal:
+            journal.record([('First cell.', 'Primeira célula.')])
+        with open(path, 'ab') as f:
+            f.write(b'{"key": "abc", "transl')
+
+        with jupyter_translate.TranslationJournal(path, self.fingerprint) as journal:
+            assert len(journal.entries) == 1
+            journal.record([('Second cell.', 'Segunda célula.')])
+
+        journal = jupyter_translate.TranslationJournal(path, self.fingerprint)
+        assert journal.get('Second cell.') == 'Segunda célula.'
+        journal.remove()
+        assert not os.path.exists(path)
+
+    def test_failed_requests_can_be_skipped(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper() if 'Two' not in text else 1 / 0
+        paragraphs = '\n\n'.join(['Paragraph one.', 'Paragraph Two.'])
+
+        result = jupyter_translate.translate_segments(
+            mock_translator, ['One.', 'Two.', paragraphs], delay=0, max_chars=16, skip_failures=True,
+            retry_policy=jupyter_translate.RetryPolicy(retries=1, base_delay=0)
+        )
+
+        # A segment with a failed chunk is left untranslated as a whole
+        assert result == ['ONE.', None, None]
+
+class TestDryRun:
+    def write_notebook(self, path, sources):
+        cells = [{'cell_type': 'markdown', 'metadata': {}, 'source': [source]} for source in sources]
+        path.write_text(json.dumps({'cells': cells, 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5}))
+        return str(path)
+
+    def test_estimate_notebook_counts_cache_hits_and_requests(self, tmp_path):
+        fname = self.write_notebook(tmp_path / 'notebook.ipynb', ['First cell.', 'Second cell.', 'Third cell.'])
+        translator = MagicMock(source='en', target='pt', provider_name='GoogleTranslator')
+        cache = jupyter_translate.TranslationCache(str(tmp_path / 'cache'))
+        cache.set(translator, 'Second cell.', 'Segunda célula.')
+        fingerprint = jupyter_translate.translation_fingerprint('google', 'en', 'pt')
+
+        estimate = jupyter_translate.estimate_notebook(fname, translator, fingerprint, 'pt', max_chars=20, cache=cache)
+
+        assert estimate['segments'] == 3
+        assert estimate['chars'] == len('First cell.Second cell.Third cell.')
+        assert estimate['cache_hits'] == 1
+        assert estimate['requests'] == 2
+        assert cache.hits == 0
+        translator.translate.assert_not_called()
+
+    def test_estimate_duration_follows_rate_limits(self):
+        limiter = jupyter_translate.RateLimiter(requests_per_second=2, chars_per_minute=600)
+
+        # 10 requests at 2 per second, or 300 characters at 10 per second
+        assert jupyter_translate.estimate_duration(10, 40, limiter, concurrency=100) == 5
+        assert jupyter_translate.estimate_duration(10, 300, limiter, concurrency=100) == 30
+        assert jupyter_translate.estimate_duration(10, 100, None, concurrency=2) == 5 * jupyter_translate.ESTIMATED_REQUEST_SECONDS
+
+    @patch('jupyter_translate.GoogleTranslator')
+    def test_dry_run_sends_no_request(self, mock_translator_class, tmp_path, capsys):
+        fname = self.write_notebook(tmp_path / 'notebook.ipynb', ['First cell.', 'Second cell.'])
+
+        totals = jupyter_translate.dry_run([fname], 'en', 'pt', 'google')
+
+        mock_translator_class.return_value.translate.assert_not_called()
+        assert totals['segments'] == 2
+        assert totals['requests'] == 1
+        assert not os.path.exists(fname.replace('.ipynb', '_pt.ipynb'))
+        assert 'Estimated time' in capsys.readouterr().out
+
+class TestChunking:
+    def test_chunk_segment_splits_at_safe_boundaries(self):
+        text = "First paragraph. Second sentence.\n\n  Next paragraph with xxcode0xx here.\nLast line."
+
+        chunks = jupyter_translate.chunk_segment(text, 40)
+
+        assert ''.join(chunks) == text
+        assert chunks == [
+            'First paragraph. Second sentence.', '\n\n  ',
+            'Next paragraph with xxcode0xx here.', '\n', 'Last line.'
+        ]
+
+    def test_chunk_segment_never_cuts_placeholders(self):
+        text = 'a' * 15 + 'xxlink12xx' + 'b' * 15
+
+        chunks = jupyter_translate.chunk_segment(text, 20)
+
+        assert ''.join(chunks) == text
+        assert chunks[1].startswith('xxlink12xx')
+
+    def test_translate_segments_chunks_oversized_segments(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        paragraphs = [f'Paragraph {i} of a long markdown cell.' for i in range(30)]
+        long_segment = '\n\n'.join(paragraphs)
+
+        result = jupyter_translate.translate_segments(mock_translator, ['Short one.', long_segment], delay=0, max_chars=200)
+
+        assert result == ['SHORT ONE.', long_segment.upper()]
+        assert all(len(call.args[0]) <= 200 for call in mock_translator.translate.call_args_list)
+
+class TestDeduplication:
+    def test_dedupe_segments_normalizes_and_keeps_one_copy(self):
+        segments = ['# Plot the results', '', 'Plot the results\r\n', '  # Plot the results ', 'Other']
+
+        unique, positions = jupyter_translate.dedupe_segments(segments)
+
+        assert unique == ['# Plot the results', 'Plot the results', 'Other']
+        assert positions == [0, None, 1, 0, 2]
+
+    def test_translate_segments_sends_duplicates_once(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        jupyter_translate.metrics.reset()
+
+        result = jupyter_translate.translate_segments(
+            mock_translator, ['Import libraries', ' ', 'Import libraries\n', 'Plot'], delay=0, max_chars=20
+        )
+
+        assert result == ['IMPORT LIBRARIES', ' ', 'IMPORT LIBRARIES\n', 'PLOT']
+        assert mock_translator.translate.call_count == 2
+        assert jupyter_translate.metrics.snapshot()['duplicate_segments'] == 1
+
+    def test_duplicates_keep_their_own_padding_and_line_endings(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = lambda text: text.upper()
+        segments = ['  hello  ', 'hello', '\thello\r\nworld\r\n', 'hello\nworld']
+
+        result = jupyter_translate.translate_segments(mock_translator, segments, delay=0)
+        single = jupyter_translate.translate_segments(mock_translator, ['  hello  '], delay=0)
+
+        assert result == ['  HELLO  ', 'HELLO', '\tHELLO\r\nWORLD\r\n', 'HELLO\nWORLD']
+        # A segment renders the same whether it is repeated in the notebook or not
+        assert single == ['  HELLO  ']
+
+    def test_concurrent_callers_share_in_flight_requests(self):
+        started, release = threading.Event(), threading.Event()
+        mock_translator = MagicMock()
+
+        def translate(text):
+            started.set()
+            release.wait(5)
+            return text.upper()
+
+        mock_translator.translate.side_effect = translate
+        jupyter_translate.metrics.reset()
+        results = {}
+
+        def run(name):
+            results[name] = jupyter_translate.translate_segments(mock_translator, ['Import libraries'], delay=0)
+
+        first = threading.Thread(target=run, args=('first',))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=run, args=('second',))
+        second.start()
+        # The second caller finds the segment in flight and waits for it
+        for _ in range(500):
+            if jupyter_translate.metrics.snapshot()['coalesced_segments']:
+                break
+            sleep(0.01)
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        assert results == {'first': ['IMPORT LIBRARIES'], 'second': ['IMPORT LIBRARIES']}
+        assert mock_translator.translate.call_count == 1
+        assert len(jupyter_translate.in_flight) == 0
+
+    def test_failed_claims_are_released(self):
+        mock_translator = MagicMock()
+        mock_translator.translate.side_effect = ValueError('boom')
+        waiter = jupyter_translate.SingleFlight()
+
+        with patch('jupyter_translate.in_flight', waiter):
+            with pytest.raises(Exception):
+                jupyter_translate.translate_segments(
+                    mock_translator, ['Hello'], delay=0,
+                    retry_policy=jupyter_translate.RetryPolicy(retries=1, base_delay=0)
+                )
+
+        assert len(waiter) == 0
+
+class TestSegmentFiles:
+    records = [
+        {'id': 'a.ipynb#0.0', 'notebook': 'a.ipynb', 'cell': 0, 'offset': 0, 'src_sha': 'abc', 'source': 'Title\n\n  Some <text> & xxcode0xx ', 'target': 'Título\n\n  Algum <texto> & xxcode0xx '},
+        {'id': 'sub/b.ipynb#2.1', 'notebook': 'sub/b.ipynb', 'cell': 2, 'offset': 1, 'src_sha': 'def', 'source': 'comment', 'target': None},
+    ]
+
+    @pytest.mark.parametrize('name', ['segments.jsonl', 'segments.xlf'])
+    def test_segment_file_round_trip(self, tmp_path, name):
+        path = str(tmp_path / name)
+        jupyter_translate.write_segment_file(path, self.records, 'en', 'pt')
+        assert jupyter_translate.read_segment_file(path) == self.records
+
+    def test_xliff_target_with_inline_elements(self, tmp_path):
+        path = tmp_path / 'segments.xliff'
+        path.write_text(
+            '<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" version="1.2">'
+            '<file original="a.ipynb" source-language="en" target-language="pt" datatype="plaintext"><body>'
+            '<trans-unit id="3.0"><source>Hello world</source><target state="translated">Olá <g id="1">mundo</g></target></trans-unit>'
+            '</body></file></xliff>', encoding='utf-8'
+        )
+        [record] = jupyter_translate.read_segment_file(str(path))
+        assert (record['notebook'], record['cell'], record['offset'], record['src_sha'], record['target']) == ('a.ipynb', 3, 0, None, 'Olá mundo')
+
+class TestNotebookWatchers:
+    def watchers(self, directory):
+        yield jupyter_translate.PollingWatcher(directory, interval=0.01)
+        try:
+            yield jupyter_translate.InotifyWatcher(directory)
+        except OSError:
+            pass  # Not on Linux
+
+    def test_saved_notebooks_are_detected(self, tmp_path):
+        (tmp_path / 'sub').mkdir()
+        (tmp_path / 'a.ipynb').write_text('{}')
+        for i, watcher in enumerate(self.watchers(str(tmp_path))):
+            assert watcher.wait(0.05) == set()
+            sleep(0.01)  # A different modification time for the polling watcher
+            # Saved atomically, as Jupyter does, and in place
+            (tmp_path / 'sub' / '.b.tmp').write_text(f'{{"cells": [{i}]}}')
+            os.replace(tmp_path / 'sub' / '.b.tmp', tmp_path / 'sub' / 'b.ipynb')
+            (tmp_path / 'a.ipynb').write_text(f'{{"cells": [{i}]}}')
+            (tmp_path / 'notes.txt').write_text('Not a notebook')
+
+            changed = set()
+            for _ in range(10):
+                changed |= watcher.wait(0.1)
+            assert changed == {str(tmp_path / 'a.ipynb'), str(tmp_path / 'sub' / 'b.ipynb')}
+            watcher.close()
+
+    def test_notebooks_of_new_directories_are_detected(self, tmp_path):
+        for i, watcher in enumerate(self.watchers(str(tmp_path))):
+            (tmp_path / f'new_{i}').mkdir()
+            (tmp_path / f'new_{i}' / 'c.ipynb').write_text('{}')
+            changed = set()
+            for _ in range(10):
+                changed |= watcher.wait(0.1)
+            assert changed == {str(tmp_path / f'new_{i}' / 'c.ipynb')}
+            watcher.close()